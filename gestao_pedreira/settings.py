@@ -64,11 +64,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # IMMEDIATE: cada transação pede logo o lock de escrita, e espera por ele em vez de falhar com
+        # "database is locked" quando dois pedidos criam faturas ao mesmo tempo (ver SequenciaDocumento)
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 if 'DATABASE_URL' in os.environ:
     DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=False)
 
+# Cache (em ficheiros, para ser partilhada pelos vários processos do servidor e invalidada em todos ao mesmo tempo)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+    }
+}
+DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
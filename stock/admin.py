@@ -1,18 +1,25 @@
 # ficheiro: stock/admin.py
-import os
-import shutil
-import sqlite3
 from datetime import date
-from django.conf import settings
+from decimal import Decimal
+from django.db import transaction
 from django.utils import timezone
 from django.contrib import admin, messages
 from django.utils.translation import gettext_lazy as _
 from django import forms
-from django.core.mail import EmailMessage, get_connection
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.html import format_html
 from .models import (
     Produto, Cliente, Fatura, ItemFatura, DadosEmpresa, Configuracao, 
-    GuiaTransporte, ItemGuia, BackupConfig
+    GuiaTransporte, ItemGuia, BackupConfig, SequenciaDocumento, MovimentoEstoque, TarefaPDF, EnvioEmail,
+    TarefaAgendada, ExecucaoTarefa,
 )
+from .agendador import TAREFAS
+from .backup import iniciar_backup_em_segundo_plano
+from .emails import enviar_em_segundo_plano
+from .exportar_pdf import documentos_das_faturas, gerar_zip
+from .estoque import definir_estoque, movimentar_estoque, somar_quantidades
+from .vendas_diarias import chaves_faturas, refrescar_vendas_diarias
 
 @admin.action(description=_("Resetar numeração para faturas selecionadas (usar com cuidado)"))
 def resetar_numeracao(modeladmin, request, queryset):
@@ -20,12 +27,17 @@ def resetar_numeracao(modeladmin, request, queryset):
     faturas_para_apagar = queryset.filter(data_emissao__year=ano_atual)
     count = faturas_para_apagar.count()
     if count > 0:
-        for fatura in faturas_para_apagar:
-            for item in fatura.itens.all():
-                if item.quantidade is not None:
-                    item.produto.estoque_atual += item.quantidade
-                    item.produto.save()
-        faturas_para_apagar.delete()
+        with transaction.atomic():
+            chaves_vendas = chaves_faturas(faturas_para_apagar)
+            movimentar_estoque(
+                somar_quantidades(ItemFatura.objects.filter(fatura__in=faturas_para_apagar).values_list('produto_id', 'quantidade')),
+                'DEVOLUCAO_RESET', utilizador=request.user, nota=f"Reset da numeração de {ano_atual}",
+            )
+            faturas_para_apagar.delete()
+            refrescar_vendas_diarias(chaves_vendas)
+            # A numeração do ano continua a seguir o maior número que ficou (as guias são apagadas em cascata)
+            SequenciaDocumento.reiniciar('FATURA', ano_atual)
+            SequenciaDocumento.reiniciar('GUIA', ano_atual)
         messages.success(request, f"{count} faturas do ano {ano_atual} foram apagadas e o estoque foi devolvido.")
     else:
         messages.warning(request, "Nenhuma fatura do ano atual foi selecionada para resetar.")
@@ -50,7 +62,36 @@ class FaturaAdmin(admin.ModelAdmin):
     inlines = [ItemFaturaInline]
     list_filter = ('paga', 'data_emissao', 'cliente')
     search_fields = ('numero_fatura', 'cliente__nome')
-    actions = [resetar_numeracao]
+    actions = [resetar_numeracao, 'exportar_pdfs']
+
+    @admin.action(description=_("Exportar PDFs das faturas selecionadas (ZIP)"))
+    def exportar_pdfs(self, request, queryset):
+        resposta = StreamingHttpResponse(gerar_zip(documentos_das_faturas(queryset)), content_type='application/zip')
+        resposta['Content-Disposition'] = f'attachment; filename="faturas_{timezone.localdate():%Y%m%d}.zip"'
+        return resposta
+
+    def save_model(self, request, obj, form, change):
+        # Guardar o par (data, cliente) anterior para atualizar também as vendas diárias de onde a fatura saiu
+        obj._chaves_vendas = chaves_faturas(Fatura.objects.filter(pk=obj.pk)) if change else set()
+        if not obj.numero_fatura:
+            obj.numero_fatura = SequenciaDocumento.proximo_numero('FATURA', obj.data_emissao.year)
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Os itens do inline só ficam gravados depois da fatura: voltar a calcular os totais guardados
+        form.instance.recalcular_totais()
+        refrescar_vendas_diarias(getattr(form.instance, '_chaves_vendas', set()) | chaves_faturas([form.instance]))
+
+    def delete_model(self, request, obj):
+        chaves_vendas = chaves_faturas([obj])
+        super().delete_model(request, obj)
+        refrescar_vendas_diarias(chaves_vendas)
+
+    def delete_queryset(self, request, queryset):
+        chaves_vendas = chaves_faturas(queryset)
+        super().delete_queryset(request, queryset)
+        refrescar_vendas_diarias(chaves_vendas)
 
     @admin.display(description=_('Total Geral (CFA)'), ordering='total_geral')
     def formatted_total_geral(self, obj):
@@ -78,6 +119,11 @@ class GuiaTransporteAdmin(admin.ModelAdmin):
     search_fields = ('numero_guia', 'fatura__cliente__nome', 'matricula_veiculo')
     readonly_fields = ('fatura',)
 
+    def save_model(self, request, obj, form, change):
+        if not obj.numero_guia:
+            obj.numero_guia = SequenciaDocumento.proximo_numero('GUIA', obj.data_emissao.year)
+        super().save_model(request, obj, form, change)
+
     @admin.display(description=_('Cliente'), ordering='fatura__cliente__nome')
     def get_cliente(self, obj):
         return obj.fatura.cliente if obj.fatura else None
@@ -109,45 +155,109 @@ class BackupConfigAdmin(admin.ModelAdmin):
         if not config:
             self.message_user(request, _("Nenhuma configuração de backup selecionada."), messages.ERROR)
             return
-        temp_backup_dir = os.path.join(settings.BASE_DIR, 'temp_backup_dir')
-        try:
-            if not config.recipient_email: raise ValueError(_("Email de destino para backups não configurado."))
-            email_config = Configuracao.objects.first()
-            if not email_config or not email_config.email_remetente or not email_config.password_remetente:
-                 raise ValueError(_("Email de envio ou palavra-passe não configurados nas Configurações Gerais."))
-            os.makedirs(temp_backup_dir, exist_ok=True)
-            timestamp = timezone.now().strftime('%Y-%m-%d_%H-%M-%S')
-            db_path = settings.DATABASES['default']['NAME']
-            backup_db_path = os.path.join(temp_backup_dir, f'db_backup_{timestamp}.sqlite3')
-            shutil.copyfile(db_path, backup_db_path)
-            zip_path = shutil.make_archive(os.path.join(temp_backup_dir, f'media_backup_{timestamp}'), 'zip', settings.MEDIA_ROOT)
-            subject = _("Backup do Sistema Pedreira - {}").format(timestamp)
-            body = _("Em anexo seguem os ficheiros de backup do sistema (base de dados e ficheiros de media).")
-            email = EmailMessage(subject, body, email_config.email_remetente, [config.recipient_email])
-            email.attach_file(backup_db_path)
-            email.attach_file(zip_path)
-            connection = get_connection(host=settings.EMAIL_HOST, port=settings.EMAIL_PORT, username=email_config.email_remetente, password=email_config.password_remetente, use_tls=settings.EMAIL_USE_TLS)
-            connection.send_messages([email])
-            config.last_backup_status = _("Sucesso")
-            self.message_user(request, _("Backup enviado por email com sucesso para {}!").format(config.recipient_email))
-        except Exception as e:
-            config.last_backup_status = _("Falhou: {}").format(str(e))
-            self.message_user(request, _("Ocorreu um erro durante o backup: {}").format(e), messages.ERROR)
-        finally:
-            config.last_backup_time = timezone.now()
-            config.save()
-            if os.path.exists(temp_backup_dir): shutil.rmtree(temp_backup_dir)
+        # O backup corre numa thread: o pedido responde logo e o progresso aparece nesta página
+        if iniciar_backup_em_segundo_plano(config):
+            self.message_user(request, _("Backup iniciado em segundo plano. Atualize a página para acompanhar o progresso."))
+        else:
+            self.message_user(request, _("Já está um backup a correr ({}%).").format(config.backup_progress), messages.WARNING)
+
+    def save_model(self, request, obj, form, change):
+        # Os campos de estado são escritos pelo backup em curso; gravar o formulário não os pode repor
+        if not change:
+            super().save_model(request, obj, form, change)
+        elif form.changed_data:
+            obj.save(update_fields=form.changed_data)
 
     actions = ['run_backup_now']
     fieldsets = (
         (_('Configuração do Backup'), {'fields': ('recipient_email', 'schedule')}),
-        (_('Estado do Último Backup'), {'fields': ('last_backup_status', 'last_backup_time',),}),
+        (_('Estado do Último Backup'), {'fields': ('last_backup_status', 'last_backup_time', 'backup_started_at', 'backup_progress'),}),
     )
-    readonly_fields = ('last_backup_status', 'last_backup_time')
+    readonly_fields = ('last_backup_status', 'last_backup_time', 'backup_started_at', 'backup_progress')
     def has_add_permission(self, request): return not BackupConfig.objects.exists()
     def has_delete_permission(self, request, obj=None): return False
 
-admin.site.register(Produto)
+@admin.register(Produto)
+class ProdutoAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'calibre', 'estoque_atual', 'preco_por_unidade')
+
+    def save_model(self, request, obj, form, change):
+        # Alterações de estoque feitas no admin também ficam no registo de movimentos
+        if 'estoque_atual' not in form.changed_data:
+            return super().save_model(request, obj, form, change)
+        novo_estoque = obj.estoque_atual
+        with transaction.atomic():
+            if change:
+                obj.estoque_atual = Produto.objects.values_list('estoque_atual', flat=True).get(pk=obj.pk)
+            else:
+                obj.estoque_atual = Decimal('0.00')
+            super().save_model(request, obj, form, change)
+            definir_estoque({obj.pk: novo_estoque}, request.user, tipo='CORRECAO_MANUAL' if change else 'ENTRADA_PRODUCAO', nota="Admin")
+
+@admin.register(MovimentoEstoque)
+class MovimentoEstoqueAdmin(admin.ModelAdmin):
+    list_display = ('criado_em', 'produto', 'tipo', 'quantidade', 'saldo_apos', 'fatura', 'utilizador')
+    list_filter = ('tipo', 'produto')
+    list_select_related = ('produto', 'fatura', 'utilizador')
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
+    def has_delete_permission(self, request, obj=None): return False
+
+@admin.register(TarefaPDF)
+class TarefaPDFAdmin(admin.ModelAdmin):
+    list_display = ('pedido_em', 'tipo', 'objeto_id', 'estado', 'tentativas', 'concluido_em')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = ('tipo', 'objeto_id', 'tentativas', 'erro', 'pedido_em', 'iniciado_em', 'concluido_em')
+    actions = ['repetir']
+    def has_add_permission(self, request): return False
+
+    @admin.action(description=_("Voltar a pôr na fila"))
+    def repetir(self, request, queryset):
+        n = queryset.update(estado='PENDENTE', tentativas=0, erro='', pedido_em=timezone.now())
+        self.message_user(request, _("%(n)d tarefas voltaram à fila.") % {'n': n})
+
+@admin.register(EnvioEmail)
+class EnvioEmailAdmin(admin.ModelAdmin):
+    list_display = ('criado_em', 'destinatario', 'assunto', 'estado', 'tentativas', 'enviado_em')
+    list_filter = ('estado',)
+    list_select_related = ('fatura', 'guia')
+    search_fields = ('destinatario', 'assunto', 'fatura__numero_fatura', 'guia__numero_guia')
+    readonly_fields = ('fatura', 'guia', 'destinatario', 'assunto', 'corpo', 'tentativas', 'erro', 'utilizador', 'criado_em', 'enviado_em')
+    actions = ['repetir']
+    def has_add_permission(self, request): return False
+
+    @admin.action(description=_("Voltar a enviar"))
+    def repetir(self, request, queryset):
+        n = queryset.exclude(estado='EM_ENVIO').update(estado='PENDENTE', tentativas=0, erro='', proxima_tentativa=timezone.now())
+        transaction.on_commit(enviar_em_segundo_plano)
+        self.message_user(request, _("%(n)d emails voltaram à fila.") % {'n': n})
+
+@admin.register(TarefaAgendada)
+class TarefaAgendadaAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'descricao', 'ativa', 'hora', 'intervalo_minutos', 'ultima_execucao', 'proxima_execucao', 'em_curso_desde', 'historico')
+    list_editable = ('ativa',)
+    fields = ('nome', 'ativa', 'hora', 'intervalo_minutos', 'ultima_execucao', 'proxima_execucao', 'em_curso_desde', 'em_curso_por')
+    readonly_fields = ('nome', 'ultima_execucao', 'proxima_execucao', 'em_curso_desde', 'em_curso_por')
+    def has_add_permission(self, request): return False
+    def has_delete_permission(self, request, obj=None): return False
+
+    @admin.display(description=_("descrição"))
+    def descricao(self, obj):
+        return TAREFAS[obj.nome].descricao if obj.nome in TAREFAS else '-'
+
+    @admin.display(description=_("histórico"))
+    def historico(self, obj):
+        url = reverse('admin:stock_execucaotarefa_changelist') + f'?tarefa__id__exact={obj.pk}'
+        return format_html('<a href="{}">{}</a>', url, _("Execuções"))
+
+@admin.register(ExecucaoTarefa)
+class ExecucaoTarefaAdmin(admin.ModelAdmin):
+    list_display = ('inicio', 'tarefa', 'estado', 'fim', 'processo')
+    list_filter = ('estado', 'tarefa')
+    list_select_related = ('tarefa',)
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
+
 admin.site.register(Cliente)
 admin.site.register(DadosEmpresa)
 
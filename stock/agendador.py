@@ -0,0 +1,218 @@
+# Ficheiro: stock/agendador.py
+# Tarefas periódicas (backups, PDFs, emails, agregados, cache) corridas pelo comando `agendador`.
+#
+# Cada tarefa registada aqui tem uma linha TarefaAgendada, com a hora (tarefas diárias) ou o intervalo
+# (tarefas repetidas) editáveis no admin. Em cada passagem o agendador calcula, a partir da última
+# execução, se a tarefa já devia ter corrido; se sim, reserva a linha com um update condicional (só passa
+# se ninguém a tiver reservado nem corrido entretanto) e corre-a numa thread. Assim, dois agendadores
+# (ou dois servidores) nunca correm a mesma tarefa duas vezes. Cada execução fica em ExecucaoTarefa.
+
+import os
+import socket
+import threading
+import traceback
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.translation import gettext as _, gettext_lazy
+
+from .backup import DURACAO_MAXIMA as DURACAO_MAXIMA_BACKUP, correr_backup_reservado, reservar_backup
+from .dashboard import blocos_dashboard
+from .emails import enviar_pendentes, recuperar_envios_presos
+from .estoque import fotografar_saldos
+from .models import ExecucaoTarefa, TarefaAgendada
+from .singletons import obter_backup_config
+from .tarefas_pdf import concluir_tarefa, falhar_tarefa, limpar_tarefas_concluidas, recuperar_tarefas_presas, renderizar, reservar_tarefas
+from .vendas_diarias import reconstruir_vendas_diarias
+
+# Uma tarefa "em curso" há mais do que isto ficou presa (o processo morreu) e pode voltar a ser reservada
+DURACAO_MAXIMA = timedelta(minutes=30)
+DIAS_BACKUP = {'DIARIO': 1, 'SEMANAL': 7}
+# Depois de um backup falhado (o último feito continua em atraso), intervalo até à tentativa seguinte
+REPETIR_BACKUP = timedelta(hours=1)
+
+Tarefa = namedtuple('Tarefa', 'nome descricao funcao hora intervalo_minutos proxima duracao_maxima')
+TAREFAS = {}
+
+
+def tarefa(nome, descricao, hora=None, intervalo_minutos=None, proxima=None, duracao_maxima=DURACAO_MAXIMA):
+    """Regista a função como tarefa periódica. Devolve uma mensagem curta para o histórico (ou None)."""
+    def registar(funcao):
+        TAREFAS[nome] = Tarefa(nome, descricao, funcao, hora, intervalo_minutos, proxima, duracao_maxima)
+        return funcao
+    return registar
+
+
+def processo_atual():
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+
+def seguinte(hora, depois):
+    """Primeira ocorrência da hora local `hora` estritamente depois de `depois`."""
+    dia = timezone.localtime(depois).date()
+    candidata = timezone.make_aware(datetime.combine(dia, hora))
+    if candidata <= depois:
+        candidata = timezone.make_aware(datetime.combine(dia + timedelta(days=1), hora))
+    return candidata
+
+
+def proxima_backup(hora, agora):
+    """Próximo backup automático segundo a frequência do BackupConfig; None se for manual."""
+    config = obter_backup_config()
+    if not config or config.schedule not in DIAS_BACKUP:
+        return None
+    # O último backup feito (automático ou pedido no admin) conta: o próximo é à hora marcada, N dias depois
+    proxima = seguinte(hora or time(2, 0), config.last_backup_time + timedelta(days=DIAS_BACKUP[config.schedule] - 1)) if config.last_backup_time else agora
+    tentativa = TarefaAgendada.objects.filter(nome='backup').values_list('ultima_execucao', flat=True).first()
+    if tentativa and (not config.last_backup_time or tentativa > config.last_backup_time):
+        # A última tentativa do agendador falhou: espera REPETIR_BACKUP antes de voltar a tentar
+        return max(proxima, tentativa + REPETIR_BACKUP)
+    return proxima
+
+
+def proxima_execucao(linha, agora):
+    definicao = TAREFAS[linha.nome]
+    if not linha.ativa:
+        return None
+    if definicao.proxima:
+        return definicao.proxima(linha.hora, agora)
+    if linha.intervalo_minutos:
+        return linha.ultima_execucao + timedelta(minutes=linha.intervalo_minutos) if linha.ultima_execucao else agora
+    if linha.hora:
+        # Nunca corrida: a ocorrência mais recente da hora (nas últimas 24h) já está em atraso
+        return seguinte(linha.hora, linha.ultima_execucao or agora - timedelta(days=1))
+    return None
+
+
+def sincronizar():
+    """Cria as linhas das tarefas registadas que ainda não existem, com a hora/intervalo por omissão."""
+    existentes = set(TarefaAgendada.objects.values_list('nome', flat=True))
+    TarefaAgendada.objects.bulk_create([
+        TarefaAgendada(nome=t.nome, hora=t.hora, intervalo_minutos=t.intervalo_minutos)
+        for t in TAREFAS.values() if t.nome not in existentes
+    ], ignore_conflicts=True)
+    return TarefaAgendada.objects.filter(nome__in=TAREFAS)
+
+
+def reservar(linha, agora, processo):
+    """
+    Marca a tarefa como em curso. Falha (False) se já estiver a correr noutro processo, ou se alguém a
+    correu depois de `linha` ter sido lida (a última execução já não é a mesma).
+    """
+    livre = TarefaAgendada.objects.filter(pk=linha.pk).exclude(em_curso_desde__gt=agora - TAREFAS[linha.nome].duracao_maxima)
+    livre = livre.filter(ultima_execucao=linha.ultima_execucao) if linha.ultima_execucao else livre.filter(ultima_execucao__isnull=True)
+    return bool(livre.update(em_curso_desde=agora, em_curso_por=processo))
+
+
+def executar(linha, processo):
+    """Corre uma tarefa já reservada, regista a execução e liberta a reserva."""
+    # Execuções deixadas "em curso" por um processo que morreu (a reserva dele já expirou)
+    linha.execucoes.filter(estado='EM_CURSO').update(estado='ERRO', resultado=_("Interrompida."))
+    execucao = ExecucaoTarefa.objects.create(tarefa=linha, processo=processo)
+    try:
+        resultado = TAREFAS[linha.nome].funcao()
+        estado = 'SUCESSO'
+    except Exception:
+        resultado, estado = traceback.format_exc(), 'ERRO'
+    fim = timezone.now()
+    ExecucaoTarefa.objects.filter(pk=execucao.pk).update(fim=fim, estado=estado, resultado=str(resultado or '')[:5000])
+    linha.ultima_execucao = execucao.inicio
+    TarefaAgendada.objects.filter(pk=linha.pk).update(
+        ultima_execucao=execucao.inicio, proxima_execucao=proxima_execucao(linha, fim), em_curso_desde=None, em_curso_por='',
+    )
+    return estado
+
+
+def executar_em_thread(linha, processo):
+    def correr():
+        try:
+            executar(linha, processo)
+        finally:
+            connection.close()
+    thread = threading.Thread(target=correr, name=f"agendador-{linha.nome}", daemon=True)
+    thread.start()
+    return thread
+
+
+def passagem(processo, a_correr=None):
+    """
+    Uma passagem do agendador: lança numa thread cada tarefa em atraso que consiga reservar.
+    `a_correr` ({nome: thread}) evita voltar a lançar o que este processo ainda está a correr.
+    Devolve as threads lançadas.
+    """
+    a_correr = {} if a_correr is None else a_correr
+    agora = timezone.now()
+    lancadas = []
+    for linha in sincronizar():
+        if linha.nome in a_correr and a_correr[linha.nome].is_alive():
+            continue
+        proxima = proxima_execucao(linha, agora)
+        if proxima != linha.proxima_execucao:
+            TarefaAgendada.objects.filter(pk=linha.pk).update(proxima_execucao=proxima)
+        if proxima is None or proxima > agora or not reservar(linha, agora, processo):
+            continue
+        a_correr[linha.nome] = executar_em_thread(linha, processo)
+        lancadas.append(a_correr[linha.nome])
+    return lancadas
+
+
+# --- Tarefas ---
+
+@tarefa('backup', gettext_lazy("Backup incremental enviado por email (frequência no BackupConfig)"), hora=time(2, 0), proxima=proxima_backup, duracao_maxima=DURACAO_MAXIMA_BACKUP)
+def tarefa_backup():
+    config = obter_backup_config()
+    if not config or not reservar_backup(config):
+        return _("Já está um backup a correr. A saltar.")
+    manifesto = correr_backup_reservado(config, origem=_(" via Agendador"))
+    return _("Backup {nome}: {blocos} blocos novos, {kb} KB enviados.").format(nome=manifesto['nome'], blocos=manifesto['blocos_novos'], kb=manifesto['tamanho_envio'] // 1024)
+
+
+@tarefa('pdfs', gettext_lazy("Pré-renderização dos PDFs em fila (TarefaPDF)"), intervalo_minutos=1)
+def tarefa_pdfs():
+    # Em série, neste processo: o comando processar_pdfs continua disponível para grandes volumes
+    recuperar_tarefas_presas()
+    limpar_tarefas_concluidas()
+    prontos = erros = 0
+    while tarefas := reservar_tarefas(20):
+        for tarefa_pdf in tarefas:
+            try:
+                renderizar(tarefa_pdf.tipo, tarefa_pdf.objeto_id)
+                concluir_tarefa(tarefa_pdf)
+                prontos += 1
+            except Exception as e:
+                falhar_tarefa(tarefa_pdf, e)
+                erros += 1
+    return _("{prontos} PDFs prontos, {erros} erros.").format(prontos=prontos, erros=erros)
+
+
+@tarefa('emails', gettext_lazy("Envio dos emails em fila e novas tentativas"), intervalo_minutos=1)
+def tarefa_emails():
+    recuperar_envios_presos()
+    enviados, falhados = enviar_pendentes()
+    return _("{enviados} emails enviados, {falhados} falhados.").format(enviados=enviados, falhados=falhados)
+
+
+@tarefa('vendas_diarias', gettext_lazy("Reconstrução da tabela de vendas diárias"), hora=time(3, 0))
+def tarefa_vendas_diarias():
+    # Os sinais mantêm a tabela ao dia; a reconstrução noturna corrige qualquer desvio
+    return _("{linhas} linhas de vendas diárias.").format(linhas=reconstruir_vendas_diarias())
+
+
+@tarefa('saldos_estoque', gettext_lazy("Fotografia diária dos saldos de estoque"), hora=time(0, 15))
+def tarefa_saldos_estoque():
+    return _("Saldo de {total} produtos registado.").format(total=fotografar_saldos())
+
+
+@tarefa('cache_dashboard', gettext_lazy("Pré-cálculo do dashboard com os filtros por omissão"), intervalo_minutos=15)
+def tarefa_cache_dashboard():
+    blocos_dashboard('1m_daily', 'todas', None, None)
+    return _("Dashboard pré-calculado.")
+
+
+@tarefa('limpar_historico', gettext_lazy("Apagar o histórico antigo do agendador"), hora=time(4, 0))
+def tarefa_limpar_historico():
+    limite = timezone.now() - timedelta(days=getattr(settings, 'AGENDADOR_HISTORICO_DIAS', 30))
+    apagadas, _detalhe = ExecucaoTarefa.objects.filter(inicio__lt=limite).exclude(estado='EM_CURSO').delete()
+    return _("{apagadas} execuções apagadas.").format(apagadas=apagadas)
@@ -0,0 +1,426 @@
+# Ficheiro: stock/backup.py
+# Backups incrementais da base de dados e da pasta media.
+#
+# Cada backup guarda, num repositório local (settings.BACKUP_ROOT, por omissão BASE_DIR/backups):
+#   objetos/ab/abcd....gz  - blocos de 1 MiB comprimidos com gzip, com o nome do sha256 do conteúdo;
+#   manifestos/<data>.json - a lista de blocos de cada ficheiro (base de dados e media) nesse momento.
+# Um bloco que já existe nunca volta a ser gravado: logotipos e anexos que não mudaram, e as páginas da
+# base de dados que não mudaram desde o último backup, não ocupam mais espaço. O email leva só um .tar
+# com o manifesto e os blocos que ainda não seguiram num email anterior; extrair todos esses .tar para a
+# mesma pasta reconstrói o repositório, e restaurar_backup refaz os ficheiros de qualquer manifesto.
+# Depois de cada envio só ficam os últimos BACKUP_MANTER manifestos (por omissão 30), e os blocos a que
+# nenhum deles se refere são apagados.
+
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .exportacao_dados import exportar_dados
+from .models import BackupConfig
+from .pdf import PASTA_CACHE as PASTA_CACHE_PDF
+from .singletons import invalidar, obter_configuracao
+
+TAMANHO_BLOCO = 1024 * 1024
+NOME_BASE_DADOS = 'db.sqlite3'
+# Noutros motores (MySQL) a base de dados vai como exportação lógica (ver exportacao_dados), sem gzip
+# (os blocos já são comprimidos um a um). Não é cortada em blocos de tamanho fixo, em que uma linha
+# nova deslocaria todos os blocos seguintes, mas no fim das linhas cujo crc32 é múltiplo de CORTE_LINHAS:
+# o corte depende só do conteúdo, e uma linha alterada ou inserida só muda o bloco em que está
+NOME_DADOS_LOGICOS = 'dados.ndjson'
+CORTE_LINHAS = 4096
+TAMANHO_MINIMO_LINHAS = 256 * 1024
+# A cópia da base de dados é feita aos poucos (256 páginas de cada vez, com uma pausa entre passos), para
+# que os pedidos que escrevem na base de dados nunca fiquem à espera do backup inteiro
+PAGINAS_POR_PASSO = 256
+PAUSA_ENTRE_PASSOS = 0.05
+# Cada escrita de outra ligação na base de dados faz o SQLite recomeçar a cópia do início; se isso
+# acontecer mais do que estas vezes (muita atividade), a cópia é feita de uma só vez
+MAX_RECOMECOS = 20
+# Um backup "em curso" há mais do que isto ficou preso (o processo morreu) e não impede outro
+DURACAO_MAXIMA = timedelta(hours=2)
+# Número de manifestos guardados no repositório local (settings.BACKUP_MANTER)
+MANTER_BACKUPS = 30
+# Pastas da media que são só caches (regeneram-se sozinhas) e não entram no backup
+MEDIA_EXCLUIDA = {PASTA_CACHE_PDF}
+
+
+class BackupErro(RuntimeError):
+    pass
+
+
+class _DemasiadosRecomecos(Exception):
+    pass
+
+
+# Ligação sqlite3 da cópia online em curso nesta thread (ver _registar_progresso)
+_copia = threading.local()
+
+
+def pasta_backups():
+    return pathlib.Path(getattr(settings, 'BACKUP_ROOT', settings.BASE_DIR / 'backups'))
+
+
+def _caminho_bloco(repositorio, hash_bloco):
+    return repositorio / 'objetos' / hash_bloco[:2] / f"{hash_bloco}.gz"
+
+
+def _blocos_fixos(origem):
+    while bloco := origem.read(TAMANHO_BLOCO):
+        yield bloco
+
+
+def _blocos_por_linhas(origem):
+    """Blocos do NDJSON cortados pelo conteúdo das linhas (ver CORTE_LINHAS), com um máximo de 4 blocos fixos."""
+    bloco = bytearray()
+    for linha in origem:
+        bloco += linha
+        if len(bloco) >= TAMANHO_MINIMO_LINHAS and zlib.crc32(linha) % CORTE_LINHAS == 0 or len(bloco) >= 4 * TAMANHO_BLOCO:
+            yield bytes(bloco)
+            bloco = bytearray()
+    if bloco:
+        yield bytes(bloco)
+
+
+def _guardar_blocos(blocos, repositorio, novos):
+    """Grava os blocos (bytes) que ainda não existem no repositório. Devolve a lista de hashes."""
+    hashes = []
+    for bloco in blocos:
+        hash_bloco = hashlib.sha256(bloco).hexdigest()
+        caminho = _caminho_bloco(repositorio, hash_bloco)
+        if hash_bloco not in novos and not caminho.exists():
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            temporario = caminho.with_suffix('.tmp')
+            with gzip.open(temporario, 'wb', compresslevel=6) as destino:
+                destino.write(bloco)
+            os.replace(temporario, caminho)
+            novos.add(hash_bloco)
+        hashes.append(hash_bloco)
+    return hashes
+
+
+def _sem_progresso(percentagem):
+    pass
+
+
+def _copiar_base_dados(pasta, progresso=_sem_progresso):
+    """
+    Cópia consistente da base de dados em uso para a pasta `pasta`; devolve o caminho do ficheiro.
+    Em SQLite usa a API de backup online do sqlite3, em passos de PAGINAS_POR_PASSO páginas, e verifica a
+    cópia com PRAGMA integrity_check antes de a aceitar. Noutros motores faz a exportação lógica NDJSON
+    dentro de uma transação (em InnoDB, REPEATABLE READ dá a mesma fotografia a todas as tabelas).
+    """
+    if connection.vendor != 'sqlite':
+        destino = pasta / NOME_DADOS_LOGICOS
+        with transaction.atomic(), open(destino, 'w', encoding='utf-8') as saida:
+            exportar_dados(saida)
+        progresso(100)
+        return destino
+    destino = pasta / NOME_BASE_DADOS
+    origem = sqlite3.connect(settings.DATABASES['default']['NAME'], timeout=20)
+    copia = sqlite3.connect(destino)
+    anterior, recomecos = [None], [0]
+
+    def passo(estado, restantes, total):
+        if anterior[0] is not None and restantes >= anterior[0]:  # não avançou: recomeçou
+            recomecos[0] += 1
+            if recomecos[0] > MAX_RECOMECOS:
+                raise _DemasiadosRecomecos()
+        anterior[0] = restantes
+        progresso(int(100 * (total - restantes) / total) if total else 100)
+
+    _copia.ligacao = origem
+    try:
+        try:
+            origem.backup(copia, pages=PAGINAS_POR_PASSO, sleep=PAUSA_ENTRE_PASSOS, progress=passo)
+        except _DemasiadosRecomecos:
+            origem.backup(copia)  # num só passo: os pedidos que escrevem esperam pelo fim da cópia
+            progresso(100)
+        resultado = [linha[0] for linha in copia.execute('PRAGMA integrity_check').fetchall()]
+    finally:
+        _copia.ligacao = None
+        copia.close()
+        origem.close()
+    if resultado != ['ok']:
+        raise BackupErro(_("A cópia da base de dados falhou a verificação de integridade: {erros}").format(erros='; '.join(resultado[:5])))
+    return destino
+
+
+def _ficheiros_media():
+    raiz = pathlib.Path(settings.MEDIA_ROOT)
+    if not raiz.is_dir():
+        return
+    for pasta, subpastas, ficheiros in os.walk(raiz):
+        if pathlib.Path(pasta) == raiz:
+            subpastas[:] = [nome for nome in subpastas if nome not in MEDIA_EXCLUIDA]
+        for nome in sorted(ficheiros):
+            caminho = pathlib.Path(pasta) / nome
+            yield caminho.relative_to(raiz).as_posix(), caminho
+
+
+def listar_backups(repositorio=None):
+    """Nomes dos manifestos do repositório, do mais antigo para o mais recente."""
+    pasta = (repositorio or pasta_backups()) / 'manifestos'
+    return sorted(caminho.stem for caminho in pasta.glob('*.json')) if pasta.is_dir() else []
+
+
+def ler_manifesto(nome, repositorio=None):
+    caminho = (repositorio or pasta_backups()) / 'manifestos' / f"{nome}.json"
+    if not caminho.exists():
+        raise BackupErro(_("Backup '{nome}' não encontrado.").format(nome=nome))
+    return json.loads(caminho.read_text(encoding='utf-8'))
+
+
+def _blocos(manifesto):
+    blocos = set(manifesto['base_dados']['blocos'])
+    for ficheiro in manifesto['media'].values():
+        blocos.update(ficheiro['blocos'])
+    return blocos
+
+
+def criar_backup(repositorio=None, progresso=_sem_progresso):
+    """
+    Faz um backup incremental para o repositório local e devolve o manifesto.
+    `progresso(percentagem)` é chamado à medida que avança (base de dados até 50%, media até 100%).
+    """
+    repositorio = repositorio or pasta_backups()
+    anteriores = listar_backups(repositorio)
+    anterior = ler_manifesto(anteriores[-1], repositorio) if anteriores else None
+    media_anterior = anterior['media'] if anterior else {}
+    nome = base = timezone.localtime().strftime('%Y-%m-%d_%H-%M-%S')
+    while nome in anteriores:  # dois backups no mesmo segundo
+        nome = f"{base}_{len(anteriores)}"
+    novos = set()
+    manifesto = {'nome': nome, 'anterior': anterior['nome'] if anterior else None, 'tamanho_bloco': TAMANHO_BLOCO, 'media': {}}
+
+    with tempfile.TemporaryDirectory() as temporaria:
+        copia = _copiar_base_dados(pathlib.Path(temporaria), lambda percentagem: progresso(percentagem * 40 // 100))
+        cortar = _blocos_por_linhas if copia.name == NOME_DADOS_LOGICOS else _blocos_fixos
+        with open(copia, 'rb') as origem:
+            manifesto['base_dados'] = {'nome': copia.name, 'tamanho': copia.stat().st_size, 'blocos': _guardar_blocos(cortar(origem), repositorio, novos)}
+    progresso(50)
+
+    ficheiros = list(_ficheiros_media())
+    for numero, (relativo, caminho) in enumerate(ficheiros, 1):
+        progresso(50 + 50 * numero // len(ficheiros))
+        estado = caminho.stat()
+        antes = media_anterior.get(relativo)
+        if antes and antes['tamanho'] == estado.st_size and antes['mtime_ns'] == estado.st_mtime_ns:
+            manifesto['media'][relativo] = antes  # ficheiro igual: nem volta a ser lido
+            continue
+        with open(caminho, 'rb') as origem:
+            blocos = _guardar_blocos(_blocos_fixos(origem), repositorio, novos)
+        manifesto['media'][relativo] = {'tamanho': estado.st_size, 'mtime_ns': estado.st_mtime_ns, 'blocos': blocos}
+
+    manifesto['blocos_novos'] = len(novos)
+    caminho_manifesto = repositorio / 'manifestos' / f"{nome}.json"
+    caminho_manifesto.parent.mkdir(parents=True, exist_ok=True)
+    caminho_manifesto.write_text(json.dumps(manifesto, indent=1), encoding='utf-8')
+    return manifesto
+
+
+def _enviados(repositorio):
+    caminho = repositorio / 'enviados.txt'
+    return caminho.read_text().split() if caminho.exists() else []
+
+
+def marcar_enviado(nome, repositorio=None):
+    repositorio = repositorio or pasta_backups()
+    with open(repositorio / 'enviados.txt', 'a') as ficheiro:
+        ficheiro.write(f"{nome}\n")
+
+
+def limpar_backups(manter=None, repositorio=None):
+    """
+    Apaga os manifestos mais antigos, deixando os últimos `manter`, e os blocos que já nenhum manifesto usa.
+    Só pode correr com a reserva de reservar_backup(): um backup a meio usa blocos que ainda não estão em
+    nenhum manifesto. Devolve (manifestos apagados, blocos apagados).
+    """
+    repositorio = repositorio or pasta_backups()
+    manter = max(manter or getattr(settings, 'BACKUP_MANTER', MANTER_BACKUPS), 1)
+    nomes = listar_backups(repositorio)
+    antigos, ficam = nomes[:-manter], nomes[-manter:]
+    for nome in antigos:
+        (repositorio / 'manifestos' / f"{nome}.json").unlink()
+    if antigos and (repositorio / 'enviados.txt').exists():
+        (repositorio / 'enviados.txt').write_text(''.join(f"{nome}\n" for nome in _enviados(repositorio) if nome in ficam))
+    usados = set()
+    for nome in ficam:
+        usados |= _blocos(ler_manifesto(nome, repositorio))
+    apagados = 0
+    for caminho in (repositorio / 'objetos').glob('*/*.gz'):
+        if caminho.name[:-len('.gz')] not in usados:
+            caminho.unlink()
+            apagados += 1
+    return len(antigos), apagados
+
+
+def arquivo_delta(manifesto, repositorio=None):
+    """
+    Cria numa pasta temporária o .tar a enviar: o manifesto e os blocos que nenhum backup já enviado
+    contém (se um envio falhou, os blocos dele seguem no próximo). Quem o pede deve apagá-lo depois.
+    """
+    repositorio = repositorio or pasta_backups()
+    ja_enviados = set()
+    for nome in _enviados(repositorio):
+        ja_enviados |= _blocos(ler_manifesto(nome, repositorio))
+    delta = pathlib.Path(tempfile.mkdtemp()) / f"backup_{manifesto['nome']}.tar"
+    with tarfile.open(delta, 'w') as arquivo:
+        caminho = repositorio / 'manifestos' / f"{manifesto['nome']}.json"
+        arquivo.add(caminho, arcname=caminho.relative_to(repositorio).as_posix())
+        for hash_bloco in sorted(_blocos(manifesto) - ja_enviados):
+            caminho = _caminho_bloco(repositorio, hash_bloco)
+            arquivo.add(caminho, arcname=caminho.relative_to(repositorio).as_posix())
+    return delta
+
+
+def _reconstruir(repositorio, blocos, destino):
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    with open(destino, 'wb') as saida:
+        for hash_bloco in blocos:
+            caminho = _caminho_bloco(repositorio, hash_bloco)
+            if not caminho.exists():
+                raise BackupErro(_("Falta o bloco {bloco} no repositório de backups.").format(bloco=hash_bloco))
+            with gzip.open(caminho, 'rb') as origem:
+                bloco = origem.read()
+            if hashlib.sha256(bloco).hexdigest() != hash_bloco:
+                raise BackupErro(_("O bloco {bloco} está corrompido.").format(bloco=hash_bloco))
+            saida.write(bloco)
+
+
+def restaurar_backup(nome, destino, repositorio=None):
+    """
+    Refaz em `destino` a base de dados (db.sqlite3, ou dados.ndjson para carregar com importar_dados) e a
+    pasta media/ tal como estavam no backup `nome`.
+    """
+    repositorio = repositorio or pasta_backups()
+    manifesto = ler_manifesto(nome, repositorio)
+    destino = pathlib.Path(destino)
+    _reconstruir(repositorio, manifesto['base_dados']['blocos'], destino / manifesto['base_dados']['nome'])
+    for relativo, ficheiro in manifesto['media'].items():
+        caminho = destino / 'media' / relativo
+        _reconstruir(repositorio, ficheiro['blocos'], caminho)
+        os.utime(caminho, ns=(ficheiro['mtime_ns'], ficheiro['mtime_ns']))
+    return manifesto
+
+
+def extrair_arquivos(arquivos, repositorio):
+    """Junta num repositório os .tar recebidos por email (pela ordem em que forem dados)."""
+    for arquivo in arquivos:
+        with tarfile.open(arquivo) as tar:
+            tar.extractall(repositorio, filter='data')
+
+
+def enviar_backup(config, manifesto, delta):
+    """Envia por email o .tar de um backup para o destinatário configurado em BackupConfig."""
+    if not config.recipient_email:
+        raise BackupErro(_("Email de destino para backups não configurado."))
+    email_config = obter_configuracao()
+    if not email_config or not email_config.email_remetente or not email_config.password_remetente:
+        raise BackupErro(_("Email de envio ou palavra-passe não configurados nas Configurações Gerais."))
+    assunto = _("Backup do Sistema Pedreira - {}").format(manifesto['nome'])
+    corpo = _(
+        "Em anexo segue o backup incremental do sistema ({blocos} blocos novos; backup anterior: {anterior}).\n"
+        "Para restaurar, extraia este ficheiro e os anteriores para a mesma pasta e use o comando restaurar_backup."
+    ).format(blocos=manifesto['blocos_novos'], anterior=manifesto['anterior'] or '-')
+    email = EmailMessage(assunto, corpo, email_config.email_remetente, [config.recipient_email])
+    email.attach_file(delta)
+    ligacao = get_connection(host=settings.EMAIL_HOST, port=settings.EMAIL_PORT, username=email_config.email_remetente, password=email_config.password_remetente, use_tls=settings.EMAIL_USE_TLS)
+    ligacao.send_messages([email])
+
+
+def executar_backup(config, progresso=_sem_progresso):
+    """
+    Backup incremental e envio por email do que é novo; no fim apaga o .tar temporário e os backups locais
+    mais antigos (limpar_backups). Devolve o manifesto.
+    """
+    manifesto = criar_backup(progresso=lambda percentagem: progresso(percentagem * 90 // 100))
+    delta = arquivo_delta(manifesto)
+    progresso(95)
+    try:
+        manifesto['tamanho_envio'] = delta.stat().st_size
+        enviar_backup(config, manifesto, delta)
+        marcar_enviado(manifesto['nome'])
+    finally:
+        shutil.rmtree(delta.parent, ignore_errors=True)
+    limpar_backups()
+    progresso(100)
+    return manifesto
+
+
+def reservar_backup(config):
+    """Marca o backup como em curso; devolve False se já houver outro a correr (e não estiver preso)."""
+    agora = timezone.now()
+    livre = BackupConfig.objects.filter(pk=config.pk).exclude(backup_started_at__gt=agora - DURACAO_MAXIMA)
+    if not livre.update(backup_started_at=agora, backup_progress=0):
+        return False
+    # update() não emite post_save: os outros processos têm de ser avisados à mão (stock/singletons.py)
+    transaction.on_commit(lambda: invalidar(BackupConfig))
+    config.backup_started_at, config.backup_progress = agora, 0
+    return True
+
+
+def _registar_progresso(config):
+    ultimo = [-1]
+    def registar(percentagem):
+        if percentagem == ultimo[0]:  # uma escrita por cada ponto percentual, no máximo
+            return
+        ultimo[0] = percentagem
+        ligacao = getattr(_copia, 'ligacao', None)
+        if ligacao is None:
+            BackupConfig.objects.filter(pk=config.pk).update(backup_progress=percentagem)
+            return
+        # Durante a cópia online, uma escrita pela ligação do Django faria o SQLite recomeçar a cópia;
+        # escrita pela própria ligação da cópia, entra na cópia sem a interromper
+        with ligacao:
+            ligacao.execute(f'UPDATE "{BackupConfig._meta.db_table}" SET backup_progress = ? WHERE id = ?', (percentagem, config.pk))
+    return registar
+
+
+def correr_backup_reservado(config, origem=''):
+    """
+    Corre um backup já reservado com reservar_backup(), regista o progresso e o resultado em BackupConfig
+    e liberta a reserva no fim. Devolve o manifesto, ou lança a exceção depois de a registar.
+    """
+    campos = {'last_backup_status': _("Falhou{origem}: {erro}").format(origem=origem, erro=_("interrompido"))}
+    try:
+        manifesto = executar_backup(config, _registar_progresso(config))
+        # Só um backup feito conta como último backup: depois de uma falha o agendador tenta outra vez
+        campos = {'last_backup_status': _("Sucesso{origem}").format(origem=origem), 'last_backup_time': timezone.now()}
+        return manifesto
+    except Exception as e:
+        campos['last_backup_status'] = _("Falhou{origem}: {erro}").format(origem=origem, erro=e)
+        raise
+    finally:
+        campos['last_backup_status'] = str(campos['last_backup_status'])[:255]
+        BackupConfig.objects.filter(pk=config.pk).update(backup_started_at=None, **campos)
+        transaction.on_commit(lambda: invalidar(BackupConfig))
+
+
+def iniciar_backup_em_segundo_plano(config):
+    """Lança o backup numa thread (fora do pedido HTTP). Devolve False se já houver um backup a correr."""
+    if not reservar_backup(config):
+        return False
+
+    def correr():
+        try:
+            correr_backup_reservado(config)
+        except Exception:
+            pass  # o erro já ficou registado em last_backup_status
+        finally:
+            connection.close()
+    transaction.on_commit(lambda: threading.Thread(target=correr, daemon=True).start())
+    return True
@@ -1,9 +1,9 @@
 # Em stock/context_processors.py
 
-from .models import DadosEmpresa
+from django.utils.functional import SimpleLazyObject
+
+from .singletons import obter_dados_empresa
 
 def dados_empresa_processor(request):
-    # Vai buscar o primeiro (e único) objeto DadosEmpresa
-    dados = DadosEmpresa.objects.first()
-    # Retorna um dicionário que será adicionado a todos os contextos
-    return {'dados_empresa': dados}
\ No newline at end of file
+    # O objeto DadosEmpresa (único) só é lido se o template o usar, e vem da memória (stock/singletons.py)
+    return {'dados_empresa': SimpleLazyObject(obter_dados_empresa)}
@@ -0,0 +1,143 @@
+# Ficheiro: stock/dashboard.py
+# Cálculos agregados do dashboard (home_view): os cartões e o gráfico usam as colunas de totais guardadas
+# na Fatura, os tops usam a tabela pré-agregada VendaDiaria.
+
+import calendar
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth
+
+from .models import Cliente, Fatura, Produto, VendaDiaria
+from .singletons import obter_configuracao
+
+ZERO = Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+# As chaves de cache incluem uma "versão" global; invalidar = mudar a versão (as entradas antigas expiram sozinhas).
+# A versão é um timestamp e não um contador, para que uma versão perdida (cache limpa) nunca volte a um valor antigo.
+CHAVE_VERSAO = 'dashboard:versao'
+
+
+def _versao():
+    versao = cache.get(CHAVE_VERSAO)
+    if versao is None:
+        versao = time.time_ns()
+        cache.set(CHAVE_VERSAO, versao, None)
+    return versao
+
+
+def invalidar_dashboard():
+    """Descarta todos os blocos do dashboard em cache. Chamado pelos sinais de stock.signals."""
+    cache.set(CHAVE_VERSAO, time.time_ns(), None)
+
+
+def _em_cache(bloco, params, calcular):
+    chave = f"dashboard:{_versao()}:{bloco}:{':'.join(str(p) for p in params)}"
+    valor = cache.get(chave)
+    if valor is None:
+        valor = calcular()
+        cache.set(chave, valor, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 60 * 60 * 24))
+    return valor
+
+
+def resumo_faturas(hoje=None):
+    """
+    Valores dos cartões do topo do dashboard (pagas, por pagar, mês atual e clientes).
+    Custa sempre duas queries, independentemente do número de faturas.
+    """
+    hoje = hoje or date.today()
+    inicio_mes = hoje.replace(day=1)
+    do_mes = Q(data_emissao__gte=inicio_mes, data_emissao__lt=inicio_mes + relativedelta(months=1))
+    resumo = Fatura.objects.aggregate(
+        num_pagas=Count('id', filter=Q(paga=True)),
+        total_recebido=Coalesce(Sum('total_geral', filter=Q(paga=True)), ZERO),
+        num_nao_pagas=Count('id', filter=Q(paga=False)),
+        valor_em_divida=Coalesce(Sum('valor_a_pagar', filter=Q(paga=False)), ZERO),
+        num_faturas_mes=Count('id', filter=do_mes),
+        total_faturado_mes=Coalesce(Sum('total_geral', filter=do_mes), ZERO),
+    )
+    resumo['num_clientes'] = Cliente.objects.count()
+    return resumo
+
+
+def _buckets_grafico(periodo, start_date, end_date, hoje):
+    """Devolve (granularidade, lista de datas de início de cada barra) para o período escolhido."""
+    if periodo == 'custom' and start_date and end_date:
+        mes, fim = date(start_date.year, start_date.month, 1), end_date
+        buckets = []
+        while mes <= fim:
+            buckets.append(mes)
+            mes += relativedelta(months=1)
+        return 'mes', buckets
+    if periodo == '1m_daily':
+        _, num_dias = calendar.monthrange(hoje.year, hoje.month)
+        return 'dia', [date(hoje.year, hoje.month, dia) for dia in range(1, num_dias + 1)]
+    num_meses = 3 if periodo == '3m' else 6
+    inicio_mes = hoje.replace(day=1)
+    return 'mes', [inicio_mes - relativedelta(months=i) for i in reversed(range(num_meses))]
+
+
+def serie_faturacao(periodo, status_fatura='todas', start_date=None, end_date=None, hoje=None):
+    """
+    Labels e valores (total com IGV) do gráfico de vendas.
+    Uma única query agrupada por dia/mês sobre o total_geral guardado em cada fatura (a VendaDiaria arredonda
+    por produto e não por fatura, o que desviaria os totais em cêntimos); as barras sem faturas ficam a zero.
+    """
+    hoje = hoje or date.today()
+    granularidade, buckets = _buckets_grafico(periodo, start_date, end_date, hoje)
+    passo = relativedelta(days=1) if granularidade == 'dia' else relativedelta(months=1)
+    faturas = Fatura.objects.filter(data_emissao__gte=buckets[0], data_emissao__lt=buckets[-1] + passo) if buckets else Fatura.objects.none()
+    if status_fatura == 'pagas':
+        faturas = faturas.filter(paga=True)
+    elif status_fatura == 'nao_pagas':
+        faturas = faturas.filter(paga=False)
+
+    trunc = TruncDay if granularidade == 'dia' else TruncMonth
+    totais = dict(faturas.annotate(bucket=trunc('data_emissao')).values('bucket').annotate(total=Sum('total_geral')).values_list('bucket', 'total'))
+
+    if granularidade == 'dia':
+        labels = [str(bucket.day) for bucket in buckets]
+    else:
+        labels = [bucket.strftime('%b/%y') for bucket in buckets]
+    dados = [float(totais.get(bucket) or 0) for bucket in buckets]
+    return labels, dados
+
+
+def top_clientes(hoje=None, dias=30, limite=10):
+    """Clientes com maior valor bruto (quantidade × preço, antes do desconto e do IGV) faturado nos últimos `dias` dias."""
+    desde = (hoje or date.today()) - timedelta(days=dias)
+    return list(VendaDiaria.objects.filter(data__gte=desde).values('cliente').annotate(nome=F('cliente__nome'), total_gasto=Sum('valor_bruto')).filter(total_gasto__gt=0).order_by('-total_gasto')[:limite])
+
+
+def top_produtos(hoje=None, dias=30, limite=10):
+    """Produtos com maior valor bruto (quantidade × preço, antes do desconto e do IGV) vendido nos últimos `dias` dias."""
+    desde = (hoje or date.today()) - timedelta(days=dias)
+    return list(VendaDiaria.objects.filter(data__gte=desde).values('produto').annotate(nome=F('produto__nome'), total_vendido=Sum('valor_bruto')).filter(total_vendido__gt=0).order_by('-total_vendido')[:limite])
+
+
+def estoque_baixo():
+    """(limite do alerta, produtos com estoque igual ou inferior ao limite)."""
+    limite = obter_configuracao(criar=True).limite_alerta_estoque
+    return limite, list(Produto.objects.filter(estoque_atual__lte=limite).order_by('estoque_atual'))
+
+
+def blocos_dashboard(periodo, status_fatura, start_date, end_date, hoje=None):
+    """
+    Contexto calculado do home_view, bloco a bloco, através da cache.
+    Cada bloco tem a sua chave (período/estado só afetam o gráfico), e todos são invalidados juntos
+    quando Fatura, ItemFatura, Cliente, Produto ou Configuracao mudam.
+    """
+    hoje = hoje or date.today()
+    labels, dados = _em_cache('grafico', (periodo, status_fatura, start_date, end_date, hoje), lambda: serie_faturacao(periodo, status_fatura, start_date, end_date, hoje))
+    limite, produtos = _em_cache('estoque_baixo', (), estoque_baixo)
+    return {
+        **_em_cache('resumo', (hoje,), lambda: resumo_faturas(hoje)),
+        'labels_grafico': labels, 'dados_grafico': dados,
+        'limite_estoque_baixo': limite, 'produtos_estoque_baixo': produtos,
+        'top_clientes': _em_cache('top_clientes', (hoje,), lambda: top_clientes(hoje)),
+        'top_produtos': _em_cache('top_produtos', (hoje,), lambda: top_produtos(hoje)),
+    }
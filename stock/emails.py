@@ -0,0 +1,149 @@
+# Ficheiro: stock/emails.py
+# Envio dos emails de faturas e guias através da caixa de saída EnvioEmail.
+#
+# As views só põem o email na fila (enfileirar_email_*) e respondem logo; o envio corre numa thread
+# em segundo plano logo a seguir e, para as novas tentativas, no comando enviar_emails (cron). Cada lote
+# usa uma única ligação SMTP. Um envio falhado volta a ser tentado com espera crescente
+# (1, 2, 4, ... minutos) até MAX_TENTATIVAS, e o estado fica registado em cada EnvioEmail.
+
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as ligacao_bd, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .models import EnvioEmail
+from .pdf import abrir_pdf
+from .singletons import obter_configuracao, obter_dados_empresa
+
+MAX_TENTATIVAS = 6
+ESPERA_INICIAL = timedelta(minutes=1)
+# Numa mesma instância só uma thread envia de cada vez; as outras esperam e depois apanham o que sobrar
+_envio_em_curso = threading.Lock()
+
+
+class EmailNaoConfigurado(RuntimeError):
+    pass
+
+
+def _configuracao():
+    config = obter_configuracao()
+    if not config or not config.email_remetente or not config.password_remetente:
+        raise EmailNaoConfigurado(_("As credenciais de email não estão configuradas na área de administração."))
+    return config
+
+
+def _nome_empresa(dados_empresa):
+    return dados_empresa.nome_empresa if dados_empresa else ''
+
+
+def enfileirar_email_fatura(fatura, utilizador=None):
+    _configuracao()
+    dados_empresa = obter_dados_empresa()
+    corpo = _("""
+            Caro(a) {cliente_nome},
+
+            Segue em anexo a fatura com o número {numero_fatura}.
+
+            Com os melhores cumprimentos,
+            {nome_empresa}
+            """).format(cliente_nome=fatura.cliente.nome, numero_fatura=fatura.numero_fatura, nome_empresa=_nome_empresa(dados_empresa) or 'A nossa empresa')
+    assunto = _("Fatura Nº {numero_fatura} da {nome_empresa}").format(numero_fatura=fatura.numero_fatura, nome_empresa=_nome_empresa(dados_empresa))
+    return _enfileirar(EnvioEmail(fatura=fatura, destinatario=fatura.cliente.email, assunto=assunto, corpo=corpo, utilizador=utilizador))
+
+
+def enfileirar_email_guia(guia, utilizador=None):
+    _configuracao()
+    dados_empresa = obter_dados_empresa()
+    corpo = f"Caro(a) {guia.cliente.nome},\n\nSegue em anexo a Guia de Transporte com o número {guia.numero_guia}.\n\nCom os melhores cumprimentos,\n{_nome_empresa(dados_empresa) or 'A nossa empresa'}"
+    assunto = _("Guia de Transporte Nº {numero_guia} da {nome_empresa}").format(numero_guia=guia.numero_guia, nome_empresa=_nome_empresa(dados_empresa))
+    return _enfileirar(EnvioEmail(guia=guia, destinatario=guia.cliente.email, assunto=assunto, corpo=corpo, utilizador=utilizador))
+
+
+def _enfileirar(envio):
+    envio.save()
+    if getattr(settings, 'EMAIL_ENVIO_IMEDIATO', True):
+        transaction.on_commit(enviar_em_segundo_plano)
+    return envio
+
+
+def enviar_em_segundo_plano():
+    """Despacha a fila numa thread, para o pedido HTTP não esperar pelo servidor SMTP."""
+    threading.Thread(target=_enviar_na_thread, daemon=True).start()
+
+
+def _enviar_na_thread():
+    try:
+        enviar_pendentes()
+    finally:
+        ligacao_bd.close()
+
+
+def _anexo(envio):
+    """(nome, bytes) do PDF a anexar; é o mesmo ficheiro do download (vem da cache se o documento não mudou)."""
+    if envio.fatura_id:
+        with abrir_pdf('fatura', envio.fatura) as ficheiro:
+            return f'Fatura-{envio.fatura.numero_fatura}.pdf', ficheiro.read()
+    if envio.guia_id:
+        with abrir_pdf('guia', envio.guia) as ficheiro:
+            return f'Guia-{envio.guia.numero_guia}.pdf', ficheiro.read()
+    raise ValueError(_("O documento deste email foi apagado."))
+
+
+def recuperar_envios_presos(minutos=30):
+    """Devolve à fila os emails EM_ENVIO há demasiado tempo (o processo que os enviava morreu)."""
+    return EnvioEmail.objects.filter(estado='EM_ENVIO', proxima_tentativa__lt=timezone.now() - timedelta(minutes=minutos)).update(estado='PENDENTE')
+
+
+def _reservar(limite):
+    agora = timezone.now()
+    with transaction.atomic():
+        ids = list(EnvioEmail.objects.select_for_update().filter(estado='PENDENTE', proxima_tentativa__lte=agora).order_by('proxima_tentativa').values_list('id', flat=True)[:limite])
+        EnvioEmail.objects.filter(id__in=ids, estado='PENDENTE').update(estado='EM_ENVIO', proxima_tentativa=agora, tentativas=F('tentativas') + 1)
+    return list(EnvioEmail.objects.filter(id__in=ids, estado='EM_ENVIO').select_related('fatura', 'guia'))
+
+
+def _falhou(envio, erro):
+    if envio.tentativas >= MAX_TENTATIVAS:
+        estado, proxima = 'ERRO', timezone.now()
+    else:
+        estado, proxima = 'PENDENTE', timezone.now() + ESPERA_INICIAL * 2 ** (envio.tentativas - 1)
+    EnvioEmail.objects.filter(id=envio.id).update(estado=estado, proxima_tentativa=proxima, erro=str(erro)[:2000])
+
+
+def enviar_pendentes(limite=50):
+    """
+    Envia os emails pendentes cuja hora de tentativa já chegou, todos pela mesma ligação SMTP.
+    Devolve (enviados, falhados). Sem credenciais configuradas não faz nada (os emails ficam na fila).
+    """
+    with _envio_em_curso:
+        try:
+            config = _configuracao()
+        except EmailNaoConfigurado:
+            return 0, 0
+        enviados = falhados = 0
+        ligacao = get_connection(host=settings.EMAIL_HOST, port=settings.EMAIL_PORT, username=config.email_remetente, password=config.password_remetente, use_tls=settings.EMAIL_USE_TLS)
+        try:
+            while True:
+                envios = _reservar(limite)
+                if not envios:
+                    break
+                for envio in envios:
+                    try:
+                        mensagem = EmailMessage(envio.assunto, envio.corpo, config.email_remetente, [envio.destinatario], connection=ligacao)
+                        mensagem.attach(*_anexo(envio), 'application/pdf')
+                        ligacao.open()  # não faz nada se a ligação já estiver aberta
+                        mensagem.send()
+                    except Exception as e:
+                        falhados += 1
+                        _falhou(envio, e)
+                        ligacao.close()  # a próxima mensagem abre uma ligação nova
+                    else:
+                        enviados += 1
+                        EnvioEmail.objects.filter(id=envio.id).update(estado='ENVIADO', enviado_em=timezone.now(), erro='')
+        finally:
+            ligacao.close()
+        return enviados, falhados
@@ -0,0 +1,131 @@
+# Ficheiro: stock/estoque.py
+# Todas as entradas e saídas de estoque passam por aqui: cada alteração de Produto.estoque_atual
+# fica registada em MovimentoEstoque (kardex), e SaldoEstoque guarda fotografias diárias do saldo.
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .dashboard import invalidar_dashboard
+from .models import MovimentoEstoque, Produto, SaldoEstoque
+
+
+class EstoqueInsuficiente(ValueError):
+    pass
+
+
+def somar_quantidades(linhas, sinal=1):
+    """Agrupa (produto_id, quantidade) por produto: {produto_id: soma * sinal}."""
+    deltas = defaultdict(Decimal)
+    for produto_id, quantidade in linhas:
+        if quantidade:
+            deltas[int(produto_id)] += Decimal(quantidade) * sinal
+    return deltas
+
+
+def juntar_deltas(*lista_deltas):
+    total = defaultdict(Decimal)
+    for deltas in lista_deltas:
+        for produto_id, delta in deltas.items():
+            total[produto_id] += delta
+    return total
+
+
+def _bloquear(produto_ids):
+    """Bloqueia os produtos numa única query (select_for_update) e devolve {produto_id: Produto}."""
+    produtos = Produto.objects.select_for_update().in_bulk(list(produto_ids))
+    em_falta = set(produto_ids) - set(produtos)
+    if em_falta:
+        raise Produto.DoesNotExist(_("Produto não encontrado (id {ids}).").format(ids=', '.join(str(i) for i in sorted(em_falta))))
+    return produtos
+
+
+def _aplicar(produtos, deltas, tipo, fatura=None, utilizador=None, nota=''):
+    """Aplica os deltas já validados (UPDATE com F() por produto) e regista os movimentos."""
+    agora = timezone.now()
+    movimentos = []
+    for produto_id, delta in deltas.items():
+        Produto.objects.filter(pk=produto_id).update(estoque_atual=F('estoque_atual') + delta, atualizado_em=agora)
+        movimentos.append(MovimentoEstoque(
+            produto_id=produto_id, tipo=tipo, quantidade=delta, saldo_apos=produtos[produto_id].estoque_atual + delta,
+            fatura=fatura, utilizador=utilizador, nota=nota, criado_em=agora,
+        ))
+    MovimentoEstoque.objects.bulk_create(movimentos)
+    # update() não envia post_save: invalidar a cache do dashboard (estoque baixo) à mão
+    transaction.on_commit(invalidar_dashboard)
+
+
+def movimentar_estoque(deltas, tipo, fatura=None, utilizador=None, nota=''):
+    """
+    Aplica {produto_id: delta} ao estoque (delta negativo = saída), tudo ou nada.
+
+    Bloqueia todos os produtos envolvidos numa única query, valida todas as saídas contra o estoque
+    atual e só depois aplica um UPDATE com F('estoque_atual') + delta por produto, para que duas
+    faturas em simultâneo nunca vendam a mesma pedra duas vezes. Cada delta fica registado como um
+    MovimentoEstoque do `tipo` indicado. Deve ser chamada dentro de transaction.atomic().
+    """
+    deltas = {produto_id: delta for produto_id, delta in deltas.items() if delta}
+    if not deltas:
+        return {}
+    if not all(Decimal(delta).is_finite() for delta in deltas.values()):
+        raise ValueError(_("Quantidade inválida."))
+    produtos = _bloquear(deltas)
+    erros = [
+        _("Estoque insuficiente para {produto_nome}. Disponível: {estoque}").format(produto_nome=produtos[produto_id].nome, estoque=produtos[produto_id].estoque_atual)
+        for produto_id, delta in deltas.items() if delta < 0 and produtos[produto_id].estoque_atual + delta < 0
+    ]
+    if erros:
+        raise EstoqueInsuficiente(' '.join(erros))
+    _aplicar(produtos, deltas, tipo, fatura, utilizador, nota)
+    return produtos
+
+
+def definir_estoque(valores, utilizador=None, tipo='CORRECAO_MANUAL', nota=''):
+    """
+    Acerta o estoque para os valores contados {produto_id: novo_estoque}. A diferença para o saldo atual
+    (lido já com o produto bloqueado) é registada como movimento. Deve correr dentro de transaction.atomic().
+    """
+    if not valores:
+        return {}
+    produtos = _bloquear(valores)
+    deltas = {produto_id: Decimal(novo) - produtos[produto_id].estoque_atual for produto_id, novo in valores.items()}
+    deltas = {produto_id: delta for produto_id, delta in deltas.items() if delta}
+    if deltas:
+        _aplicar(produtos, deltas, tipo, utilizador=utilizador, nota=nota)
+    return produtos
+
+
+def _inicio_do_dia_seguinte(dia):
+    return timezone.make_aware(datetime.combine(dia + timedelta(days=1), time.min))
+
+
+def saldo_em(produto_id, dia):
+    """
+    Saldo do produto no fim do dia indicado: a última fotografia (SaldoEstoque) até esse dia mais os
+    movimentos posteriores a ela, que nunca são mais do que os de um intervalo entre fotografias.
+    """
+    foto = SaldoEstoque.objects.filter(produto_id=produto_id, data__lte=dia).order_by('-data').first()
+    movimentos = MovimentoEstoque.objects.filter(produto_id=produto_id, criado_em__lt=_inicio_do_dia_seguinte(dia))
+    if foto:
+        movimentos = movimentos.filter(id__gt=foto.ultimo_movimento_id)
+    soma = movimentos.aggregate(soma=Sum('quantidade'))['soma'] or Decimal('0.00')
+    return (foto.saldo if foto else Decimal('0.00')) + soma
+
+
+def fotografar_saldos(dia=None):
+    """Cria (ou refaz) a fotografia do saldo de todos os produtos no fim do dia (por omissão, ontem)."""
+    dia = dia or (timezone.localdate() - timedelta(days=1))
+    fim = _inicio_do_dia_seguinte(dia)
+    ultimo_id = MovimentoEstoque.objects.filter(criado_em__lt=fim).aggregate(ultimo=Max('id'))['ultimo'] or 0
+    fotos = [
+        SaldoEstoque(produto_id=produto_id, data=dia, saldo=saldo_em(produto_id, dia), ultimo_movimento_id=ultimo_id)
+        for produto_id in Produto.objects.values_list('id', flat=True)
+    ]
+    with transaction.atomic():
+        SaldoEstoque.objects.filter(data=dia).delete()
+        SaldoEstoque.objects.bulk_create(fotos)
+    return len(fotos)
@@ -0,0 +1,184 @@
+# Ficheiro: stock/exportacao_dados.py
+# Exportação/importação lógica de todos os dados, independente do motor de base de dados (SQLite ou MySQL).
+#
+# Formato NDJSON (uma linha JSON por registo, opcionalmente em .gz): para cada modelo, uma linha de
+# cabeçalho {"modelo": ..., "campos": [...]} seguida de uma lista de valores por registo, pela ordem dos
+# campos. A exportação lê cada tabela em lotes (iterator) e a importação grava com bulk_create em lotes,
+# por isso a memória usada não depende do tamanho da base de dados.
+# As tabelas derivadas (VendaDiaria, EntradaPesquisa) e a fila TarefaPDF não são exportadas: as duas
+# primeiras são refeitas no fim da importação. As permissões (auth.Permission) são criadas pelo migrate de
+# cada base de dados com ids que podem ser outros, por isso as ligações a elas vão como [app, codename].
+# Com `substituir`, as tabelas são esvaziadas com um DELETE por tabela (sem o collector do Django nem os sinais
+# post_delete por registo); o índice de pesquisa e as caches do dashboard são refeitos uma vez no fim.
+
+import datetime
+import gzip
+import json
+from contextlib import contextmanager
+from django.apps import apps
+from django.contrib.auth.models import Permission
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.translation import gettext as _
+
+from .dashboard import invalidar_dashboard
+from .pesquisa import reconstruir_indice
+from .singletons import invalidar_todos
+from .vendas_diarias import reconstruir_vendas_diarias
+
+LOTE = 2000
+# Por ordem de dependência (um modelo só aponta para modelos anteriores na lista); as tabelas
+# intermédias dos ManyToMany (User_groups, ...) entram como modelos à parte
+MODELOS = [
+    'auth.Group', 'auth.Group_permissions', 'auth.User', 'auth.User_groups', 'auth.User_user_permissions',
+    'stock.Produto', 'stock.Cliente', 'stock.DadosEmpresa', 'stock.Configuracao', 'stock.BackupConfig',
+    'stock.SequenciaDocumento', 'stock.Fatura', 'stock.ItemFatura', 'stock.GuiaTransporte', 'stock.ItemGuia',
+    'stock.MovimentoEstoque', 'stock.SaldoEstoque', 'stock.EnvioEmail', 'stock.TarefaAgendada', 'stock.ExecucaoTarefa',
+]
+# Tabelas que não são exportadas mas apontam para as de cima (ou para os seus ids): esvaziadas primeiro
+DEPENDENTES = ['admin.LogEntry', 'stock.VendaDiaria', 'stock.EntradaPesquisa', 'stock.TarefaPDF']
+
+
+class ImportacaoErro(ValueError):
+    pass
+
+
+def abrir(caminho, modo):
+    """Abre o ficheiro em texto, com gzip se o nome terminar em .gz."""
+    if str(caminho).endswith('.gz'):
+        return gzip.open(caminho, modo + 't', encoding='utf-8')
+    return open(caminho, modo, encoding='utf-8')
+
+
+class _Codificador(DjangoJSONEncoder):
+    """O DjangoJSONEncoder corta as datas aos milissegundos; aqui ficam com os microssegundos todos."""
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _campos(modelo):
+    return [campo.attname for campo in modelo._meta.concrete_fields]
+
+
+def _aponta_permissao(campo):
+    return campo.is_relation and campo.related_model is Permission
+
+
+def _chaves_permissoes():
+    """{id: [app_label, codename]} das permissões desta base de dados."""
+    return {p.id: [p.content_type.app_label, p.codename] for p in Permission.objects.select_related('content_type')}
+
+
+def exportar_dados(saida, lote=LOTE):
+    """Escreve todos os dados em NDJSON no ficheiro de texto `saida`. Devolve {modelo: registos}."""
+    codificador = _Codificador(ensure_ascii=False, separators=(',', ':'))
+    permissoes = _chaves_permissoes()
+    totais = {}
+    for nome in MODELOS:
+        modelo = apps.get_model(nome)
+        campos = _campos(modelo)
+        posicoes = [i for i, campo in enumerate(modelo._meta.concrete_fields) if _aponta_permissao(campo)]
+        saida.write(codificador.encode({'modelo': nome, 'campos': campos}) + '\n')
+        total = 0
+        for linha in modelo._base_manager.order_by('pk').values_list(*campos).iterator(chunk_size=lote):
+            if posicoes:
+                linha = list(linha)
+                for i in posicoes:
+                    linha[i] = permissoes[linha[i]]
+            saida.write(codificador.encode(linha) + '\n')
+            total += 1
+        totais[nome] = total
+    return totais
+
+
+def _gravar(modelo, objetos):
+    modelo._base_manager.bulk_create(objetos)
+    return len(objetos)
+
+
+@contextmanager
+def _sem_datas_automaticas(modelos):
+    """Desliga auto_now/auto_now_add durante a importação, para manter as datas originais (criado_em, etc.)."""
+    campos = [
+        (campo, campo.auto_now, campo.auto_now_add) for modelo in modelos for campo in modelo._meta.concrete_fields
+        if getattr(campo, 'auto_now', False) or getattr(campo, 'auto_now_add', False)
+    ]
+    for campo, _auto_now, _auto_now_add in campos:
+        campo.auto_now = campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, auto_now, auto_now_add in campos:
+            campo.auto_now, campo.auto_now_add = auto_now, auto_now_add
+
+
+def _repor_sequencias(modelos):
+    # Em PostgreSQL as sequências dos ids não avançam com ids explícitos; em MySQL e SQLite não é preciso
+    comandos = connection.ops.sequence_reset_sql(no_style(), modelos)
+    if comandos:
+        with connection.cursor() as cursor:
+            for sql in comandos:
+                cursor.execute(sql)
+
+
+def _esvaziar(modelos):
+    """Apaga as tabelas pela ordem dada, com um DELETE direto cada (sem cascatas em Python nem sinais)."""
+    for modelo in modelos:
+        modelo._base_manager.all()._raw_delete(connection.alias)
+
+
+def importar_dados(entrada, lote=LOTE, substituir=False):
+    """
+    Carrega um ficheiro de exportar_dados() para a base de dados atual, numa só transação.
+    Sem `substituir`, as tabelas de destino têm de estar vazias. Devolve {modelo: registos}.
+    """
+    modelos = [apps.get_model(nome) for nome in MODELOS]
+    permissoes = {tuple(chave): id_ for id_, chave in _chaves_permissoes().items()}
+    totais = {}
+    with transaction.atomic(), _sem_datas_automaticas(modelos):
+        if substituir:
+            _esvaziar([apps.get_model(nome) for nome in DEPENDENTES] + modelos[::-1])
+        else:
+            ocupados = [modelo._meta.label for modelo in modelos if modelo._base_manager.exists()]
+            if ocupados:
+                raise ImportacaoErro(_("A base de dados de destino já tem dados ({modelos}).").format(modelos=', '.join(ocupados)))
+        modelo = campos = None
+        objetos = []
+        for numero, linha in enumerate(entrada, 1):
+            registo = json.loads(linha)
+            if isinstance(registo, dict):
+                if objetos:
+                    totais[modelo._meta.label] += _gravar(modelo, objetos)
+                    objetos = []
+                if registo['modelo'] not in MODELOS:
+                    raise ImportacaoErro(_("Linha {numero}: modelo desconhecido {modelo}.").format(numero=numero, modelo=registo['modelo']))
+                modelo = apps.get_model(registo['modelo'])
+                campos = [modelo._meta.get_field(campo) for campo in registo['campos']]
+                totais[modelo._meta.label] = 0
+                continue
+            if modelo is None or len(registo) != len(campos):
+                raise ImportacaoErro(_("Linha {numero}: registo inválido.").format(numero=numero))
+            valores = {}
+            for campo, valor in zip(campos, registo):
+                if _aponta_permissao(campo):
+                    if tuple(valor) not in permissoes:
+                        raise ImportacaoErro(_("Linha {numero}: a permissão {permissao} não existe (falta correr o migrate?).").format(numero=numero, permissao='.'.join(valor)))
+                    valor = permissoes[tuple(valor)]
+                valores[campo.attname] = campo.to_python(valor)
+            objetos.append(modelo(**valores))
+            if len(objetos) >= lote:
+                totais[modelo._meta.label] += _gravar(modelo, objetos)
+                objetos = []
+        if objetos:
+            totais[modelo._meta.label] += _gravar(modelo, objetos)
+        _repor_sequencias(modelos)
+        reconstruir_vendas_diarias()
+        reconstruir_indice()
+        # Nem o DELETE direto nem o bulk_create emitem sinais: as configurações em memória dos processos e
+        # as caches do dashboard têm de ser invalidadas aqui
+        transaction.on_commit(invalidar_todos)
+        transaction.on_commit(invalidar_dashboard)
+    return totais
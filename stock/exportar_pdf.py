@@ -0,0 +1,66 @@
+# Ficheiro: stock/exportar_pdf.py
+# Exportação dos PDFs de muitas faturas (e das respetivas guias) num único ZIP, para o fecho do mês.
+#
+# Corre dentro do pedido HTTP, por isso não lança processos: os PDFs vêm da cache de stock/pdf.py (o
+# processar_pdfs já deixou prontos os das faturas gravadas) e só os que faltarem são renderizados aqui,
+# um de cada vez. O zipfile escreve para um destino não posicionável que o gerador esvazia a cada
+# ficheiro: a resposta sai em streaming e nunca há mais do que um PDF em memória.
+
+import shutil
+import zipfile
+
+from .models import GuiaTransporte
+from .pdf import abrir_pdf
+from .tarefas_pdf import MODELOS
+
+
+class _Saida:
+    """Destino do zipfile: guarda o que é escrito até o gerador o enviar ao cliente."""
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados, self.partes = b''.join(self.partes), []
+        return dados
+
+
+def documentos_das_faturas(faturas):
+    """Lista de (tipo, id, nome no ZIP) das faturas e das guias emitidas a partir delas."""
+    faturas = list(faturas.order_by('data_emissao', 'numero_fatura', 'id').values_list('id', 'numero_fatura'))
+    guias = GuiaTransporte.objects.filter(fatura_id__in=[fatura_id for fatura_id, numero in faturas]).order_by('numero_guia')
+    return (
+        [('fatura', fatura_id, f"faturas/fatura_{numero}.pdf") for fatura_id, numero in faturas]
+        + [('guia', guia_id, f"guias/guia_{numero}.pdf") for guia_id, numero in guias.values_list('id', 'numero_guia')]
+    )
+
+
+def gerar_zip(documentos):
+    """
+    Gerador com os bytes de um ZIP com os PDFs dos documentos indicados (ver documentos_das_faturas).
+    Os documentos que não for possível renderizar ficam listados em ERROS.txt dentro do próprio ZIP.
+    """
+    saida, erros = _Saida(), []
+    # Os PDFs já vêm comprimidos: guardá-los sem nova compressão poupa CPU e quase não aumenta o ZIP
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED) as arquivo:
+        for tipo, objeto_id, nome in documentos:
+            documento = MODELOS[tipo].objects.filter(pk=objeto_id).first()
+            if documento is None:
+                continue  # apagado entretanto
+            try:
+                origem = abrir_pdf(tipo, documento)
+            except Exception as e:
+                erros.append(f"{nome}: {e}")
+                continue
+            with origem, arquivo.open(nome, 'w') as destino:
+                shutil.copyfileobj(origem, destino)
+            yield saida.esvaziar()
+        if erros:
+            arquivo.writestr('ERROS.txt', '\n'.join(sorted(erros)) + '\n')
+    yield saida.esvaziar()
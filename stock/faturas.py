@@ -0,0 +1,54 @@
+# Ficheiro: stock/faturas.py
+# Gravação dos itens de uma fatura editada, escrevendo apenas o que mudou.
+
+from collections import defaultdict
+
+from .estoque import juntar_deltas, movimentar_estoque, somar_quantidades
+from .models import ItemFatura
+
+
+def sincronizar_itens_fatura(fatura, itens, utilizador=None):
+    """
+    Compara os itens atuais da fatura com a lista nova (dicionários produto_id/quantidade/preco_unitario)
+    e aplica só a diferença: linhas iguais ficam intactas, linhas do mesmo produto com outros valores são
+    atualizadas em bulk, as que sobram são apagadas ou criadas em bulk. O estoque recebe apenas o saldo
+    líquido por produto. Devolve True se algum item foi alterado.
+    """
+    antigos = list(fatura.itens.all())
+    devolvidos = somar_quantidades((i.produto_id, i.quantidade) for i in antigos)
+    livres = defaultdict(list)
+    for item in antigos:
+        livres[item.produto_id].append(item)
+
+    # 1.ª passagem: linhas exatamente iguais não precisam de escrita
+    por_casar = []
+    for novo in itens:
+        candidatos = livres[novo['produto_id']]
+        igual = next((i for i in candidatos if i.quantidade == novo['quantidade'] and i.preco_unitario == novo['preco_unitario']), None)
+        if igual:
+            candidatos.remove(igual)
+        else:
+            por_casar.append(novo)
+
+    # 2.ª passagem: reaproveitar uma linha antiga do mesmo produto; o resto é criado
+    a_atualizar, a_criar = [], []
+    for novo in por_casar:
+        candidatos = livres[novo['produto_id']]
+        if candidatos:
+            item = candidatos.pop(0)
+            item.quantidade, item.preco_unitario = novo['quantidade'], novo['preco_unitario']
+            a_atualizar.append(item)
+        else:
+            a_criar.append(ItemFatura(fatura=fatura, **novo))
+    a_apagar = [item.id for candidatos in livres.values() for item in candidatos]
+
+    vendidos = somar_quantidades(((i['produto_id'], i['quantidade']) for i in itens), sinal=-1)
+    movimentar_estoque(juntar_deltas(devolvidos, vendidos), 'AJUSTE_EDICAO', fatura=fatura, utilizador=utilizador)
+
+    if a_atualizar:
+        ItemFatura.objects.bulk_update(a_atualizar, ['quantidade', 'preco_unitario'])
+    if a_apagar:
+        ItemFatura.objects.filter(id__in=a_apagar).delete()
+    if a_criar:
+        ItemFatura.objects.bulk_create(a_criar)
+    return bool(a_atualizar or a_apagar or a_criar)
@@ -0,0 +1,58 @@
+# Ficheiro: stock/management/commands/agendador.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from stock.agendador import TAREFAS, executar, passagem, processo_atual, proxima_execucao, reservar, sincronizar
+
+
+class Command(BaseCommand):
+    help = ('Agendador das tarefas periódicas (backup, PDFs, emails, vendas diárias, saldos de estoque, cache do '
+            'dashboard). As horas e intervalos editam-se no admin (Tarefas Agendadas); pode correr em mais do que '
+            'um servidor, porque cada tarefa é reservada na base de dados antes de correr.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=30, help="Segundos entre cada passagem (por omissão 30).")
+        parser.add_argument('--uma-vez', action='store_true', help="Faz uma única passagem, espera pelas tarefas lançadas e termina (para usar no cron).")
+        parser.add_argument('--executar', metavar='TAREFA', help="Corre já a tarefa indicada, esteja ou não em atraso, e termina.")
+        parser.add_argument('--listar', action='store_true', help="Só lista as tarefas, a última e a próxima execução.")
+
+    def handle(self, *args, **options):
+        processo = processo_atual()
+        if options['listar']:
+            agora = timezone.now()
+            def formatar(momento):
+                return f"{timezone.localtime(momento):%Y-%m-%d %H:%M}" if momento else '-'
+            for linha in sincronizar():
+                estado = 'ativa' if linha.ativa else 'inativa'
+                self.stdout.write(f"{linha.nome:18} {estado:8} última: {formatar(linha.ultima_execucao):16}  próxima: {formatar(proxima_execucao(linha, agora)):16}  {TAREFAS[linha.nome].descricao}")
+            return
+
+        if options['executar']:
+            if options['executar'] not in TAREFAS:
+                raise CommandError(f"Tarefa desconhecida. Disponíveis: {', '.join(TAREFAS)}.")
+            linha = sincronizar().get(nome=options['executar'])
+            if not reservar(linha, timezone.now(), processo):
+                raise CommandError(f"A tarefa {linha.nome} já está a correr ({linha.em_curso_por}).")
+            estado = executar(linha, processo)
+            execucao = linha.execucoes.first()
+            self.stdout.write(f"{linha.nome}: {execucao.get_estado_display()}. {execucao.resultado}")
+            if estado == 'ERRO':
+                raise CommandError(f"A tarefa {linha.nome} falhou.")
+            return
+
+        self.stdout.write(f"Agendador iniciado ({processo}).")
+        a_correr = {}
+        try:
+            while True:
+                for thread in passagem(processo, a_correr):
+                    self.stdout.write(f"{timezone.localtime():%Y-%m-%d %H:%M:%S} {thread.name} lançada.")
+                if options['uma_vez']:
+                    break
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write("A terminar: à espera das tarefas em curso...")
+        for thread in a_correr.values():
+            thread.join()
+        self.stdout.write(self.style.SUCCESS("Agendador terminado."))
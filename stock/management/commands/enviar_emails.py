@@ -0,0 +1,27 @@
+# Ficheiro: stock/management/commands/enviar_emails.py
+
+import time
+from django.core.management.base import BaseCommand
+
+from stock.emails import enviar_pendentes, recuperar_envios_presos
+
+
+class Command(BaseCommand):
+    help = 'Envia os emails de faturas e guias em fila (EnvioEmail), incluindo as novas tentativas dos que falharam.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=30, help="Segundos entre cada passagem pela fila (por omissão 30).")
+        parser.add_argument('--uma-vez', action='store_true', help="Faz uma única passagem e termina (para usar no cron).")
+
+    def handle(self, *args, **options):
+        presos = recuperar_envios_presos()
+        if presos:
+            self.stdout.write(self.style.WARNING(f"{presos} emails presos voltaram à fila."))
+        while True:
+            enviados, falhados = enviar_pendentes()
+            if enviados or falhados:
+                self.stdout.write(f"{enviados} emails enviados, {falhados} falhados.")
+            if options['uma_vez']:
+                break
+            time.sleep(options['intervalo'])
+        self.stdout.write(self.style.SUCCESS("Envio de emails concluído."))
@@ -0,0 +1,29 @@
+# Ficheiro: stock/management/commands/exportar_dados.py
+
+import sys
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from stock.exportacao_dados import LOTE, abrir, exportar_dados
+
+
+class Command(BaseCommand):
+    help = ('Exporta todos os dados (utilizadores e modelos do stock) para um ficheiro NDJSON, independente do '
+            'motor de base de dados. Serve para backups em MySQL e para mudar de SQLite para MySQL (ver importar_dados).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ficheiro', nargs='?', help="Ficheiro de saída (.ndjson ou .ndjson.gz; '-' para o stdout). Por omissão dados_<data>.ndjson.gz.")
+        parser.add_argument('--lote', type=int, default=LOTE, help=f"Registos lidos de cada vez (por omissão {LOTE}).")
+
+    def handle(self, *args, **options):
+        ficheiro = options['ficheiro'] or f"dados_{timezone.localtime():%Y-%m-%d_%H-%M-%S}.ndjson.gz"
+        inicio = time.perf_counter()
+        if ficheiro == '-':
+            exportar_dados(sys.stdout, options['lote'])
+            return
+        with abrir(ficheiro, 'w') as saida:
+            totais = exportar_dados(saida, options['lote'])
+        for modelo, total in totais.items():
+            self.stdout.write(f"   - {modelo}: {total}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(totais.values())} registos exportados para {ficheiro} em {time.perf_counter() - inicio:.1f} s."))
@@ -0,0 +1,23 @@
+# Ficheiro: stock/management/commands/fotografar_estoque.py
+
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.estoque import fotografar_saldos
+
+
+class Command(BaseCommand):
+    help = 'Guarda a fotografia diária do saldo de cada produto (SaldoEstoque). Deve correr uma vez por dia, depois da meia-noite.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data', help="Dia a fotografar no formato AAAA-MM-DD (por omissão, ontem).")
+
+    def handle(self, *args, **options):
+        dia = None
+        if options['data']:
+            try:
+                dia = datetime.strptime(options['data'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("Data inválida. Use o formato AAAA-MM-DD.")
+        total = fotografar_saldos(dia)
+        self.stdout.write(self.style.SUCCESS(f"Saldo de {total} produtos registado."))
@@ -0,0 +1,27 @@
+# Ficheiro: stock/management/commands/importar_dados.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.exportacao_dados import LOTE, ImportacaoErro, abrir, importar_dados
+
+
+class Command(BaseCommand):
+    help = ('Carrega um ficheiro criado por exportar_dados para a base de dados atual (depois de "migrate"), '
+            'com bulk_create em lotes. No fim refaz as vendas diárias e o índice de pesquisa.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('ficheiro', help="Ficheiro .ndjson ou .ndjson.gz criado por exportar_dados.")
+        parser.add_argument('--lote', type=int, default=LOTE, help=f"Registos gravados de cada vez (por omissão {LOTE}).")
+        parser.add_argument('--substituir', action='store_true', help="Apaga os dados existentes antes de importar (por omissão, o destino tem de estar vazio).")
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with abrir(options['ficheiro'], 'r') as entrada:
+                totais = importar_dados(entrada, options['lote'], options['substituir'])
+        except (OSError, ImportacaoErro) as e:
+            raise CommandError(str(e))
+        for modelo, total in totais.items():
+            self.stdout.write(f"   - {modelo}: {total}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(totais.values())} registos importados em {time.perf_counter() - inicio:.1f} s."))
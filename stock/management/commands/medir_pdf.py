@@ -0,0 +1,50 @@
+# Ficheiro: stock/management/commands/medir_pdf.py
+
+import pathlib
+import time
+from statistics import median
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stock import pdf
+from stock.singletons import obter_dados_empresa
+from stock.tarefas_pdf import MODELOS
+
+
+class Command(BaseCommand):
+    help = ('Mede o tempo de renderização de um PDF por documento: a renderização isolada (estilos, fontes '
+            'e logotipo preparados de novo a cada PDF) contra a partilhada de stock/pdf.py. Não usa nem altera a cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=sorted(pdf.DOCUMENTOS), default='fatura')
+        parser.add_argument('--documentos', type=int, default=10, help="Número de documentos a renderizar (os mais recentes; por omissão 10).")
+
+    def handle(self, *args, **options):
+        if pdf.HTML is None:
+            raise CommandError("WeasyPrint não está instalado.")
+        tipo = options['tipo']
+        documentos = list(MODELOS[tipo].objects.order_by('-id')[:max(options['documentos'], 1)])
+        if not documentos:
+            raise CommandError("Não há documentos deste tipo para renderizar.")
+        dados_empresa = obter_dados_empresa()
+        htmls = [pdf.renderizar_html(tipo, documento, dados_empresa)[0] for documento in documentos]
+        base_url = pathlib.Path(settings.MEDIA_ROOT).as_uri()
+        folha = pdf.PASTA_CSS / pdf.DOCUMENTOS[tipo][2]
+
+        def isolado(html):
+            # O que acontecia antes: CSS interpretado, fontes resolvidas e logotipo lido do disco a cada PDF
+            fontes = pdf.FontConfiguration()
+            estilos = [pdf.CSS(filename=str(folha), font_config=fontes)]
+            return pdf.HTML(string=html, base_url=base_url).write_pdf(stylesheets=estilos, font_config=fontes)
+
+        def partilhado(html):
+            return pdf.escrever_pdf(tipo, html, dados_empresa, base_url)
+
+        partilhado(htmls[0])  # prepara estilos, fontes e logotipo, como no primeiro pedido do processo
+        for nome, funcao in (("isolado", isolado), ("partilhado", partilhado)):
+            tempos = []
+            for html in htmls:
+                inicio = time.perf_counter()
+                funcao(html)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            self.stdout.write(f"{nome:>10}: mediana {median(tempos):7.1f} ms/documento, total {sum(tempos) / 1000:6.2f} s ({len(tempos)} documentos)")
@@ -0,0 +1,52 @@
+# Ficheiro: stock/management/commands/processar_pdfs.py
+
+import multiprocessing
+import os
+import time
+import django
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+
+from stock.tarefas_pdf import (
+    concluir_tarefa, falhar_tarefa, limpar_tarefas_concluidas, recuperar_tarefas_presas, renderizar, reservar_tarefas,
+)
+
+
+class Command(BaseCommand):
+    help = 'Pré-renderiza os PDFs de faturas e guias pedidos na tabela TarefaPDF, num conjunto de processos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=os.cpu_count() or 2, help="Número de processos de renderização (por omissão, um por CPU).")
+        parser.add_argument('--lote', type=int, default=20, help="Número de tarefas reservadas de cada vez (por omissão 20).")
+        parser.add_argument('--intervalo', type=float, default=5, help="Segundos de espera quando a fila está vazia (por omissão 5).")
+        parser.add_argument('--uma-vez', action='store_true', help="Processa a fila até ficar vazia e termina (para usar no cron).")
+
+    def handle(self, *args, **options):
+        presas = recuperar_tarefas_presas()
+        if presas:
+            self.stdout.write(self.style.WARNING(f"{presas} tarefas presas voltaram à fila."))
+        apagadas = limpar_tarefas_concluidas()
+        if apagadas:
+            self.stdout.write(f"{apagadas} tarefas concluídas antigas apagadas.")
+        # 'spawn': cada processo arranca do zero (django.setup) e abre a sua própria ligação à base de
+        # dados, em vez de herdar por fork a ligação deste processo
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max(options['processos'], 1), mp_context=contexto, initializer=django.setup) as pool:
+            while True:
+                tarefas = reservar_tarefas(max(options['lote'], 1))
+                if not tarefas:
+                    if options['uma_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+                    continue
+                futuros = {pool.submit(renderizar, tarefa.tipo, tarefa.objeto_id): tarefa for tarefa in tarefas}
+                for futuro in as_completed(futuros):
+                    tarefa = futuros[futuro]
+                    try:
+                        futuro.result()
+                        concluir_tarefa(tarefa)
+                        self.stdout.write(f"{tarefa.get_tipo_display()} #{tarefa.objeto_id}: PDF pronto.")
+                    except Exception as e:
+                        falhar_tarefa(tarefa, e)
+                        self.stdout.write(self.style.ERROR(f"{tarefa.get_tipo_display()} #{tarefa.objeto_id}: {e}"))
+        self.stdout.write(self.style.SUCCESS("Fila de PDFs vazia."))
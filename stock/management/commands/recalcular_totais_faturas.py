@@ -0,0 +1,62 @@
+# Ficheiro: stock/management/commands/recalcular_totais_faturas.py
+
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from stock.dashboard import invalidar_dashboard
+from stock.models import Fatura, ItemFatura, calcular_totais_fatura
+from stock.pesquisa import indexar
+
+
+class Command(BaseCommand):
+    help = 'Preenche (ou verifica com --verificar) as colunas de totais guardadas em cada Fatura a partir dos seus itens.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true', help="Apenas compara os totais guardados com os calculados, sem gravar nada.")
+        parser.add_argument('--lote', type=int, default=500, help="Número de faturas processadas por lote (por omissão 500).")
+
+    def handle(self, *args, **options):
+        verificar = options['verificar']
+        lote = max(options['lote'], 1)
+        campos = list(Fatura.CAMPOS_TOTAIS)
+        total_faturas, divergentes = 0, 0
+
+        ids = list(Fatura.objects.order_by('id').values_list('id', flat=True))
+        for inicio in range(0, len(ids), lote):
+            ids_lote = ids[inicio:inicio + lote]
+            subtotais = {}
+            for fatura_id, quantidade, preco in ItemFatura.objects.filter(fatura_id__in=ids_lote).values_list('fatura_id', 'quantidade', 'preco_unitario'):
+                if quantidade and preco:
+                    subtotais[fatura_id] = subtotais.get(fatura_id, Decimal('0.00')) + quantidade * preco
+
+            a_corrigir = []
+            for fatura in Fatura.objects.select_related('cliente').filter(id__in=ids_lote):
+                total_faturas += 1
+                esperado = calcular_totais_fatura(subtotais.get(fatura.id, Decimal('0.00')), fatura.desconto, fatura.taxa_igv, fatura.adiantamento)
+                guardado = tuple(getattr(fatura, campo) for campo in campos)
+                if guardado == esperado:
+                    continue
+                divergentes += 1
+                if verificar:
+                    self.stdout.write(self.style.WARNING(f"Fatura {fatura.numero_fatura}: guardado {guardado} / esperado {esperado}"))
+                else:
+                    for campo, valor in zip(campos, esperado):
+                        setattr(fatura, campo, valor)
+                    a_corrigir.append(fatura)
+
+            if a_corrigir:
+                # O bulk_update não dispara os sinais: a pesquisa (que mostra o valor) é atualizada aqui
+                with transaction.atomic():
+                    Fatura.objects.bulk_update(a_corrigir, campos)
+                    indexar('fatura', a_corrigir)
+
+        if divergentes and not verificar:
+            invalidar_dashboard()
+
+        if verificar:
+            if divergentes:
+                raise CommandError(f"{divergentes} de {total_faturas} faturas têm totais desatualizados. Execute o comando sem --verificar.")
+            self.stdout.write(self.style.SUCCESS(f"Todas as {total_faturas} faturas têm os totais corretos."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{divergentes} de {total_faturas} faturas atualizadas."))
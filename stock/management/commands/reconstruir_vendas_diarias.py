@@ -0,0 +1,14 @@
+# Ficheiro: stock/management/commands/reconstruir_vendas_diarias.py
+
+from django.core.management.base import BaseCommand
+
+from stock.vendas_diarias import reconstruir_vendas_diarias
+
+
+class Command(BaseCommand):
+    help = 'Apaga e regenera a tabela de vendas diárias (VendaDiaria) a partir de todos os itens de fatura.'
+
+    def handle(self, *args, **options):
+        self.stdout.write("A reconstruir as vendas diárias...")
+        total = reconstruir_vendas_diarias()
+        self.stdout.write(self.style.SUCCESS(f"Vendas diárias reconstruídas: {total} linhas."))
@@ -0,0 +1,16 @@
+# Ficheiro: stock/management/commands/reindexar_pesquisa.py
+
+from django.core.management.base import BaseCommand
+
+from stock.pesquisa import reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice da pesquisa global (faturas, guias, clientes e produtos) a partir dos dados atuais.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help="Número de objetos processados por lote (por omissão 2000).")
+
+    def handle(self, *args, **options):
+        total = reconstruir_indice(chunk_size=max(options['lote'], 1))
+        self.stdout.write(self.style.SUCCESS(f"Índice de pesquisa reconstruído: {total} entradas."))
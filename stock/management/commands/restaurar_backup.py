@@ -0,0 +1,46 @@
+# Ficheiro: stock/management/commands/restaurar_backup.py
+
+import pathlib
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.backup import BackupErro, extrair_arquivos, listar_backups, pasta_backups, restaurar_backup
+
+
+class Command(BaseCommand):
+    help = ('Reconstrói a base de dados (db.sqlite3, ou dados.ndjson para o comando importar_dados) e a pasta media de um backup incremental numa pasta à escolha. '
+            'Não toca nos ficheiros em uso: depois de verificar o resultado, substitua-os à mão.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup', nargs='?', help="Nome do backup (ex.: 2025-07-31_23-00-00); por omissão, o mais recente.")
+        parser.add_argument('--destino', help="Pasta onde os ficheiros são reconstruídos (por omissão BASE_DIR/restauro_<backup>).")
+        parser.add_argument('--repositorio', help="Repositório de backups (por omissão settings.BACKUP_ROOT).")
+        parser.add_argument('--arquivos', nargs='+', help="Ficheiros .tar recebidos por email, a juntar antes de restaurar (todos até ao backup pretendido).")
+        parser.add_argument('--listar', action='store_true', help="Só lista os backups disponíveis.")
+
+    def handle(self, *args, **options):
+        repositorio = pathlib.Path(options['repositorio']) if options['repositorio'] else pasta_backups()
+        if options['arquivos']:
+            if not options['repositorio']:
+                repositorio = pathlib.Path(tempfile.mkdtemp(prefix='backups_'))
+            extrair_arquivos(options['arquivos'], repositorio)
+            self.stdout.write(f"{len(options['arquivos'])} arquivos extraídos para {repositorio}.")
+        disponiveis = listar_backups(repositorio)
+        if options['listar']:
+            for nome in disponiveis:
+                self.stdout.write(nome)
+            return
+        if not disponiveis:
+            raise CommandError(f"Não há backups em {repositorio}.")
+        nome = options['backup'] or disponiveis[-1]
+        destino = pathlib.Path(options['destino'] or settings.BASE_DIR / f"restauro_{nome}")
+        if destino.exists() and any(destino.iterdir()):
+            raise CommandError(f"A pasta de destino {destino} já existe e não está vazia.")
+        try:
+            manifesto = restaurar_backup(nome, destino, repositorio)
+        except BackupErro as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Backup {nome} restaurado em {destino}: {manifesto['base_dados']['nome']} e {len(manifesto['media'])} ficheiros de media."
+        ))
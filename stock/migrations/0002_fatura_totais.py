@@ -0,0 +1,71 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:05
+
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+# Cópias congeladas de stock.models.arredondar/calcular_totais_fatura: a migração tem de dar sempre o
+# mesmo resultado, mesmo que as regras de cálculo mudem mais tarde
+def arredondar(valor):
+    return Decimal(valor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def calcular_totais_fatura(subtotal, desconto, taxa_igv, adiantamento):
+    subtotal = arredondar(subtotal)
+    valor_desconto = arredondar(subtotal * (Decimal(desconto) / Decimal(100)))
+    valor_igv = arredondar((subtotal - valor_desconto) * (Decimal(taxa_igv) / Decimal(100)))
+    total_geral = subtotal - valor_desconto + valor_igv
+    valor_a_pagar = max(total_geral - Decimal(adiantamento), Decimal('0.00'))
+    return subtotal, valor_desconto, valor_igv, total_geral, valor_a_pagar
+
+
+def preencher_totais(apps, schema_editor):
+    Fatura = apps.get_model('stock', 'Fatura')
+    ItemFatura = apps.get_model('stock', 'ItemFatura')
+    subtotais = {}
+    for fatura_id, quantidade, preco in ItemFatura.objects.values_list('fatura_id', 'quantidade', 'preco_unitario').iterator():
+        if quantidade and preco:
+            subtotais[fatura_id] = subtotais.get(fatura_id, Decimal('0.00')) + quantidade * preco
+    campos = ['subtotal', 'valor_desconto', 'valor_igv', 'total_geral', 'valor_a_pagar']
+    faturas = list(Fatura.objects.all())
+    for fatura in faturas:
+        totais = calcular_totais_fatura(subtotais.get(fatura.id, Decimal('0.00')), fatura.desconto, fatura.taxa_igv, fatura.adiantamento)
+        for campo, valor in zip(campos, totais):
+            setattr(fatura, campo, valor)
+    Fatura.objects.bulk_update(faturas, campos, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatura',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='subtotal'),
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='total_geral',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='total geral'),
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='valor_a_pagar',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='valor a pagar'),
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='valor_desconto',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='valor do desconto'),
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='valor_igv',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14, verbose_name='valor do IGV'),
+        ),
+        migrations.RunPython(preencher_totais, migrations.RunPython.noop),
+    ]
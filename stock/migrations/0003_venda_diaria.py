@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:07
+
+import django.db.models.deletion
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+# Cópias congeladas de stock.models.arredondar e stock.vendas_diarias.agregar_itens: a migração não
+# pode depender do código atual da aplicação
+CAMPOS_ITEM = (
+    'fatura__data_emissao', 'produto_id', 'fatura__cliente_id', 'fatura__paga',
+    'quantidade', 'preco_unitario', 'fatura__desconto', 'fatura__taxa_igv',
+)
+
+
+def arredondar(valor):
+    return Decimal(valor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def agregar_itens(linhas):
+    totais = defaultdict(lambda: [Decimal('0'), Decimal('0'), Decimal('0')])
+    for data, produto_id, cliente_id, paga, quantidade, preco, desconto, taxa_igv in linhas:
+        if not quantidade or not preco:
+            continue
+        liquido = quantidade * preco * (Decimal(100) - desconto) / Decimal(100)
+        acumulado = totais[(data, produto_id, cliente_id, paga)]
+        acumulado[0] += quantidade
+        acumulado[1] += liquido
+        acumulado[2] += liquido * taxa_igv / Decimal(100)
+    return totais
+
+
+def preencher_vendas_diarias(apps, schema_editor):
+    ItemFatura = apps.get_model('stock', 'ItemFatura')
+    VendaDiaria = apps.get_model('stock', 'VendaDiaria')
+    totais = agregar_itens(ItemFatura.objects.values_list(*CAMPOS_ITEM).iterator())
+    VendaDiaria.objects.bulk_create([
+        VendaDiaria(data=data, produto_id=produto_id, cliente_id=cliente_id, paga=paga, quantidade=arredondar(quantidade),
+                    valor_liquido=arredondar(liquido), valor_igv=arredondar(igv), total=arredondar(liquido) + arredondar(igv))
+        for (data, produto_id, cliente_id, paga), (quantidade, liquido, igv) in totais.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0002_fatura_totais'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='data')),
+                ('paga', models.BooleanField(verbose_name='paga')),
+                ('quantidade', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='quantidade')),
+                ('valor_liquido', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='valor líquido')),
+                ('valor_igv', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='valor do IGV')),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='total')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendas_diarias', to='stock.cliente', verbose_name='cliente')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendas_diarias', to='stock.produto', verbose_name='produto')),
+            ],
+            options={
+                'verbose_name': 'Venda Diária',
+                'verbose_name_plural': 'Vendas Diárias',
+                'constraints': [models.UniqueConstraint(fields=('data', 'produto', 'cliente', 'paga'), name='venda_diaria_unica')],
+            },
+        ),
+        migrations.RunPython(preencher_vendas_diarias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0003_venda_diaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenciaDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('FATURA', 'Fatura'), ('GUIA', 'Guia de Transporte')], max_length=10, verbose_name='tipo de documento')),
+                ('ano', models.PositiveIntegerField(verbose_name='ano')),
+                ('ultimo_numero', models.PositiveIntegerField(default=0, verbose_name='último número')),
+            ],
+            options={
+                'verbose_name': 'Sequência de Documentos',
+                'verbose_name_plural': 'Sequências de Documentos',
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'ano'), name='sequencia_documento_unica')],
+            },
+        ),
+    ]
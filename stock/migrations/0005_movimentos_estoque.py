@@ -0,0 +1,62 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def registar_saldo_inicial(apps, schema_editor):
+    # O estoque que já existia entra no registo como um primeiro movimento, para o saldo poder ser reconstruído
+    Produto = apps.get_model('stock', 'Produto')
+    MovimentoEstoque = apps.get_model('stock', 'MovimentoEstoque')
+    MovimentoEstoque.objects.bulk_create([
+        MovimentoEstoque(produto_id=produto_id, tipo='CORRECAO_MANUAL', quantidade=estoque, saldo_apos=estoque, nota='Saldo inicial')
+        for produto_id, estoque in Produto.objects.exclude(estoque_atual=0).values_list('id', 'estoque_atual')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0004_sequencia_documento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimentoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('SAIDA_FATURA', 'Saída por fatura'), ('AJUSTE_EDICAO', 'Ajuste por edição de fatura'), ('CORRECAO_MANUAL', 'Correção manual'), ('DEVOLUCAO_RESET', 'Devolução por reset de numeração'), ('ENTRADA_PRODUCAO', 'Entrada de produção')], max_length=20, verbose_name='tipo')),
+                ('quantidade', models.DecimalField(decimal_places=2, help_text='Positiva para entradas, negativa para saídas.', max_digits=12, verbose_name='quantidade')),
+                ('saldo_apos', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='saldo após movimento')),
+                ('nota', models.CharField(blank=True, max_length=255, verbose_name='nota')),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='data')),
+                ('fatura', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimentos_estoque', to='stock.fatura', verbose_name='fatura')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimentos', to='stock.produto', verbose_name='produto')),
+                ('utilizador', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='utilizador')),
+            ],
+            options={
+                'verbose_name': 'Movimento de Estoque',
+                'verbose_name_plural': 'Movimentos de Estoque',
+                'indexes': [models.Index(fields=['produto', 'criado_em'], name='movimento_produto_data_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='data')),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='saldo')),
+                ('ultimo_movimento_id', models.BigIntegerField(default=0, verbose_name='último movimento incluído')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='stock.produto', verbose_name='produto')),
+            ],
+            options={
+                'verbose_name': 'Saldo de Estoque',
+                'verbose_name_plural': 'Saldos de Estoque',
+                'constraints': [models.UniqueConstraint(fields=('produto', 'data'), name='saldo_estoque_unico')],
+            },
+        ),
+        migrations.RunPython(registar_saldo_inicial, migrations.RunPython.noop),
+    ]
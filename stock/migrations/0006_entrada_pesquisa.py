@@ -0,0 +1,136 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:18
+
+import re
+import unicodedata
+from django.db import migrations, models
+
+
+# Cópias congeladas do índice de texto e dos construtores de stock/pesquisa.py, tal como estavam
+# quando esta migração foi escrita: a migração não pode depender do código atual da aplicação
+TABELA_FTS = 'stock_entradapesquisa_fts'
+
+SQL_CRIAR = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {TABELA_FTS} USING fts5(texto, content='stock_entradapesquisa', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER stock_entradapesquisa_ai AFTER INSERT ON stock_entradapesquisa BEGIN "
+        f"INSERT INTO {TABELA_FTS}(rowid, texto) VALUES (new.id, new.texto); END",
+        f"CREATE TRIGGER stock_entradapesquisa_ad AFTER DELETE ON stock_entradapesquisa BEGIN "
+        f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, texto) VALUES ('delete', old.id, old.texto); END",
+        f"CREATE TRIGGER stock_entradapesquisa_au AFTER UPDATE ON stock_entradapesquisa BEGIN "
+        f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, texto) VALUES ('delete', old.id, old.texto); "
+        f"INSERT INTO {TABELA_FTS}(rowid, texto) VALUES (new.id, new.texto); END",
+    ],
+    'mysql': ["ALTER TABLE stock_entradapesquisa ADD FULLTEXT INDEX stock_entradapesquisa_ft (texto)"],
+    'postgresql': ["CREATE INDEX stock_entradapesquisa_tsv ON stock_entradapesquisa USING GIN (to_tsvector('simple', texto))"],
+}
+SQL_APAGAR = {
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS stock_entradapesquisa_ai", "DROP TRIGGER IF EXISTS stock_entradapesquisa_ad",
+        "DROP TRIGGER IF EXISTS stock_entradapesquisa_au", f"DROP TABLE IF EXISTS {TABELA_FTS}",
+    ],
+    'mysql': ["ALTER TABLE stock_entradapesquisa DROP INDEX stock_entradapesquisa_ft"],
+    'postgresql': ["DROP INDEX IF EXISTS stock_entradapesquisa_tsv"],
+}
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def palavras(texto):
+    return re.findall(r'[^\W_]+', normalizar(texto))
+
+
+def _texto(*valores):
+    partes = []
+    for valor in valores:
+        if not valor:
+            continue
+        partes.append(normalizar(valor))
+        compacto = ''.join(palavras(valor))
+        if compacto != ' '.join(palavras(valor)):
+            partes.append(compacto)
+    return ' '.join(partes)
+
+
+def _entrada_fatura(f):
+    return dict(
+        tipo='fatura', objeto_id=f.id, titulo=f.numero_fatura or f"#{f.id}", data=f.data_emissao,
+        subtitulo=f"{f.cliente.nome} · {f.data_emissao:%d/%m/%Y} · {f.valor_a_pagar:,.2f} CFA",
+        texto=_texto(f.numero_fatura, f.cliente.nome, f.cliente.nif, f.cliente.telefone),
+    )
+
+
+def _entrada_guia(g):
+    cliente = g.fatura.cliente
+    return dict(
+        tipo='guia', objeto_id=g.id, titulo=g.numero_guia or f"#{g.id}", data=g.data_emissao,
+        subtitulo=f"{cliente.nome} · {g.data_emissao:%d/%m/%Y} · {g.matricula_veiculo}".rstrip(' ·'),
+        texto=_texto(g.numero_guia, g.fatura.numero_fatura, cliente.nome, g.matricula_veiculo, g.morada_carga, g.morada_descarga),
+    )
+
+
+def _entrada_cliente(c):
+    return dict(
+        tipo='cliente', objeto_id=c.id, titulo=c.nome, subtitulo=' · '.join(v for v in (c.nif, c.telefone, c.email) if v),
+        texto=_texto(c.nome, c.nif, c.telefone, c.email, c.endereco),
+    )
+
+
+def _entrada_produto(p):
+    return dict(
+        tipo='produto', objeto_id=p.id, titulo=f"{p.nome} ({p.calibre})" if p.calibre else p.nome, subtitulo=(p.descricao or '')[:255],
+        texto=_texto(p.nome, p.calibre, p.descricao),
+    )
+
+
+def criar_indice_texto(apps, schema_editor):
+    for sql in SQL_CRIAR.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def apagar_indice_texto(apps, schema_editor):
+    for sql in SQL_APAGAR.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def preencher_entradas(apps, schema_editor):
+    EntradaPesquisa = apps.get_model('stock', 'EntradaPesquisa')
+    origens = [
+        (_entrada_fatura, apps.get_model('stock', 'Fatura').objects.select_related('cliente')),
+        (_entrada_guia, apps.get_model('stock', 'GuiaTransporte').objects.select_related('fatura__cliente')),
+        (_entrada_cliente, apps.get_model('stock', 'Cliente').objects.all()),
+        (_entrada_produto, apps.get_model('stock', 'Produto').objects.all()),
+    ]
+    for construtor, queryset in origens:
+        EntradaPesquisa.objects.bulk_create((EntradaPesquisa(**construtor(obj)) for obj in queryset.iterator()), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0005_movimentos_estoque'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntradaPesquisa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('fatura', 'Fatura'), ('guia', 'Guia de Transporte'), ('cliente', 'Cliente'), ('produto', 'Produto')], max_length=10, verbose_name='tipo')),
+                ('objeto_id', models.PositiveIntegerField(verbose_name='id do objeto')),
+                ('titulo', models.CharField(max_length=255, verbose_name='título')),
+                ('subtitulo', models.CharField(blank=True, max_length=255, verbose_name='subtítulo')),
+                ('texto', models.TextField(verbose_name='texto pesquisável')),
+                ('data', models.DateField(blank=True, null=True, verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'Entrada de Pesquisa',
+                'verbose_name_plural': 'Entradas de Pesquisa',
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'objeto_id'), name='entrada_pesquisa_unica')],
+            },
+        ),
+        migrations.RunPython(criar_indice_texto, apagar_indice_texto),
+        migrations.RunPython(preencher_entradas, migrations.RunPython.noop),
+    ]
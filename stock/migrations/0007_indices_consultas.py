@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0006_entrada_pesquisa'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['nome', 'id'], name='cliente_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fatura',
+            index=models.Index(fields=['data_emissao', 'numero_fatura', 'id'], name='fatura_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fatura',
+            index=models.Index(fields=['data_emissao', 'numero_fatura', 'id'], condition=models.Q(paga=False), name='fatura_por_pagar_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fatura',
+            index=models.Index(fields=['cliente', 'data_emissao'], name='fatura_cliente_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guiatransporte',
+            index=models.Index(fields=['data_emissao', 'numero_guia', 'id'], name='guia_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['nome', 'id'], name='produto_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['estoque_atual'], name='produto_estoque_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0007_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaPDF',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('fatura', 'Fatura'), ('guia', 'Guia de Transporte')], max_length=10, verbose_name='tipo')),
+                ('objeto_id', models.PositiveIntegerField(verbose_name='id do documento')),
+                ('estado', models.CharField(choices=[('PENDENTE', 'Pendente'), ('EM_CURSO', 'Em curso'), ('CONCLUIDA', 'Concluída'), ('ERRO', 'Erro')], default='PENDENTE', max_length=10, verbose_name='estado')),
+                ('tentativas', models.PositiveSmallIntegerField(default=0, verbose_name='tentativas')),
+                ('erro', models.TextField(blank=True, verbose_name='último erro')),
+                ('pedido_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='pedido em')),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True, verbose_name='iniciado em')),
+                ('concluido_em', models.DateTimeField(blank=True, null=True, verbose_name='concluído em')),
+            ],
+            options={
+                'verbose_name': 'Tarefa de PDF',
+                'verbose_name_plural': 'Tarefas de PDF',
+                'indexes': [models.Index(fields=['estado', 'pedido_em'], name='tarefa_pdf_fila_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'objeto_id'), name='tarefa_pdf_unica')],
+            },
+        ),
+    ]
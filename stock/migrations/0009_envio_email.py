@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0008_tarefa_pdf'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvioEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destinatario', models.EmailField(max_length=254, verbose_name='destinatário')),
+                ('assunto', models.CharField(max_length=255, verbose_name='assunto')),
+                ('corpo', models.TextField(verbose_name='corpo')),
+                ('estado', models.CharField(choices=[('PENDENTE', 'Pendente'), ('EM_ENVIO', 'Em envio'), ('ENVIADO', 'Enviado'), ('ERRO', 'Erro')], default='PENDENTE', max_length=10, verbose_name='estado')),
+                ('tentativas', models.PositiveSmallIntegerField(default=0, verbose_name='tentativas')),
+                ('proxima_tentativa', models.DateTimeField(default=django.utils.timezone.now, verbose_name='próxima tentativa')),
+                ('erro', models.TextField(blank=True, verbose_name='último erro')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='criado em')),
+                ('enviado_em', models.DateTimeField(blank=True, null=True, verbose_name='enviado em')),
+                ('fatura', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='emails', to='stock.fatura', verbose_name='fatura')),
+                ('guia', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='emails', to='stock.guiatransporte', verbose_name='guia de transporte')),
+                ('utilizador', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='utilizador')),
+            ],
+            options={
+                'verbose_name': 'Envio de Email',
+                'verbose_name_plural': 'Envios de Email',
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['estado', 'proxima_tentativa'], name='envio_email_fila_idx')],
+            },
+        ),
+    ]
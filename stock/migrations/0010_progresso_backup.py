@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0009_envio_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupconfig',
+            name='backup_progress',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Progresso do Backup (%)'),
+        ),
+        migrations.AddField(
+            model_name='backupconfig',
+            name='backup_started_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Preenchido enquanto um backup está a correr em segundo plano.', null=True, verbose_name='Backup em Curso Desde'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0010_progresso_backup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaAgendada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True, verbose_name='nome')),
+                ('ativa', models.BooleanField(default=True, verbose_name='ativa')),
+                ('hora', models.TimeField(blank=True, help_text='Hora do dia a que a tarefa corre (tarefas diárias e backup).', null=True, verbose_name='hora')),
+                ('intervalo_minutos', models.PositiveIntegerField(blank=True, help_text='Para tarefas repetidas ao longo do dia.', null=True, verbose_name='intervalo (minutos)')),
+                ('ultima_execucao', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='última execução')),
+                ('proxima_execucao', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='próxima execução')),
+                ('em_curso_desde', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='em curso desde')),
+                ('em_curso_por', models.CharField(blank=True, editable=False, max_length=100, verbose_name='em curso por')),
+            ],
+            options={
+                'verbose_name': 'Tarefa Agendada',
+                'verbose_name_plural': 'Tarefas Agendadas',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExecucaoTarefa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField(default=django.utils.timezone.now, verbose_name='início')),
+                ('fim', models.DateTimeField(blank=True, null=True, verbose_name='fim')),
+                ('estado', models.CharField(choices=[('EM_CURSO', 'Em curso'), ('SUCESSO', 'Sucesso'), ('ERRO', 'Erro')], default='EM_CURSO', max_length=10, verbose_name='estado')),
+                ('resultado', models.TextField(blank=True, verbose_name='resultado')),
+                ('processo', models.CharField(blank=True, max_length=100, verbose_name='processo')),
+                ('tarefa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='execucoes', to='stock.tarefaagendada', verbose_name='tarefa')),
+            ],
+            options={
+                'verbose_name': 'Execução de Tarefa',
+                'verbose_name_plural': 'Execuções de Tarefas',
+                'ordering': ['-inicio'],
+                'indexes': [models.Index(fields=['tarefa', '-inicio'], name='execucao_tarefa_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0011_agendador'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fatura',
+            index=models.Index(fields=['paga', 'data_emissao', 'numero_fatura', 'id'], name='fatura_paga_data_idx'),
+        ),
+    ]
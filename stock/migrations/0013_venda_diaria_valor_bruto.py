@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:40
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def preencher_valor_bruto(apps, schema_editor):
+    # Uma query agrupada pelas mesmas chaves da tabela; não usa o código atual da aplicação
+    ItemFatura = apps.get_model('stock', 'ItemFatura')
+    VendaDiaria = apps.get_model('stock', 'VendaDiaria')
+    brutos = {
+        (linha['fatura__data_emissao'], linha['produto_id'], linha['fatura__cliente_id'], linha['fatura__paga']): linha['bruto']
+        for linha in ItemFatura.objects.values('fatura__data_emissao', 'produto_id', 'fatura__cliente_id', 'fatura__paga').annotate(bruto=Sum(F('quantidade') * F('preco_unitario')))
+    }
+    vendas = []
+    for venda in VendaDiaria.objects.iterator():
+        venda.valor_bruto = brutos.get((venda.data, venda.produto_id, venda.cliente_id, venda.paga)) or Decimal('0.0000')
+        vendas.append(venda)
+    VendaDiaria.objects.bulk_update(vendas, ['valor_bruto'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0012_indice_faturas_paga'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vendadiaria',
+            name='valor_bruto',
+            field=models.DecimalField(decimal_places=4, default=Decimal('0.0000'), max_digits=16, verbose_name='valor bruto'),
+        ),
+        migrations.RunPython(preencher_valor_bruto, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,26 @@
 # stock/models.py --- FICHEIRO COMPLETO E CORRIGIDO
 
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from datetime import date, timedelta
 
+def arredondar(valor):
+    return Decimal(valor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+def calcular_totais_fatura(subtotal, desconto, taxa_igv, adiantamento):
+    """Devolve os totais de uma fatura (arredondados ao cêntimo) pela ordem de Fatura.CAMPOS_TOTAIS."""
+    subtotal = arredondar(subtotal)
+    valor_desconto = arredondar(subtotal * (Decimal(desconto) / Decimal(100)))
+    valor_igv = arredondar((subtotal - valor_desconto) * (Decimal(taxa_igv) / Decimal(100)))
+    total_geral = subtotal - valor_desconto + valor_igv
+    valor_a_pagar = max(total_geral - Decimal(adiantamento), Decimal('0.00'))
+    return subtotal, valor_desconto, valor_igv, total_geral, valor_a_pagar
+
 class Produto(models.Model):
     UNIDADES = [('ton', _('Tonelada')), ('m3', _('Metro Cúbico')), ('un', _('Unidade'))]
     nome = models.CharField(_('nome'), max_length=100)
@@ -30,6 +42,10 @@ class Produto(models.Model):
     class Meta:
         verbose_name = _("Produto")
         verbose_name_plural = _("Produtos")
+        indexes = [
+            models.Index(fields=['nome', 'id'], name='produto_nome_idx'),
+            models.Index(fields=['estoque_atual'], name='produto_estoque_idx'),  # alerta de estoque baixo
+        ]
 
 class Cliente(models.Model):
     nome = models.CharField(_('nome'), max_length=200)
@@ -50,6 +66,7 @@ class Cliente(models.Model):
     class Meta:
         verbose_name = _("Cliente")
         verbose_name_plural = _("Clientes")
+        indexes = [models.Index(fields=['nome', 'id'], name='cliente_nome_idx')]
 
 class Fatura(models.Model):
     cliente = models.ForeignKey(Cliente, verbose_name=_('cliente'), on_delete=models.PROTECT)
@@ -63,19 +80,40 @@ class Fatura(models.Model):
     adiantamento = models.DecimalField(_('adiantamento (€)'), max_digits=10, decimal_places=2, default=0.00, help_text=_("Valor do adiantamento em euros"))
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
+    # Totais guardados na tabela (mantidos por recalcular_totais/save) para poderem ser filtrados, ordenados e somados em SQL
+    subtotal = models.DecimalField(_('subtotal'), max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+    valor_desconto = models.DecimalField(_('valor do desconto'), max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+    valor_igv = models.DecimalField(_('valor do IGV'), max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+    total_geral = models.DecimalField(_('total geral'), max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+    valor_a_pagar = models.DecimalField(_('valor a pagar'), max_digits=14, decimal_places=2, default=Decimal('0.00'), editable=False)
+
+    CAMPOS_TOTAIS = ('subtotal', 'valor_desconto', 'valor_igv', 'total_geral', 'valor_a_pagar')
 
-    @property
-    def subtotal(self): return sum(item.subtotal for item in self.itens.all()) if self.itens.all() else Decimal('0.00')
-    @property
-    def valor_desconto(self): return self.subtotal * (self.desconto / Decimal(100))
     @property
     def subtotal_apos_desconto(self): return self.subtotal - self.valor_desconto
-    @property
-    def valor_igv(self): return self.subtotal_apos_desconto * (self.taxa_igv / Decimal(100))
-    @property
-    def total_geral(self): return self.subtotal_apos_desconto + self.valor_igv
-    @property
-    def valor_a_pagar(self): return max(self.total_geral - self.adiantamento, Decimal('0.00'))
+
+    def somar_itens(self):
+        """Soma os itens numa única query (sem carregar os objetos ItemFatura)."""
+        return sum((q * p for q, p in self.itens.values_list('quantidade', 'preco_unitario') if q and p), Decimal('0.00'))
+
+    def recalcular_totais(self, save=True):
+        """Volta a somar os itens e atualiza as colunas de totais. Chamar sempre que os itens mudam."""
+        self.subtotal = self.somar_itens()
+        if save:
+            self.save(update_fields=self.CAMPOS_TOTAIS)
+        else:
+            self._aplicar_totais()
+
+    def _aplicar_totais(self):
+        for campo, valor in zip(self.CAMPOS_TOTAIS, calcular_totais_fatura(self.subtotal, self.desconto, self.taxa_igv, self.adiantamento)):
+            setattr(self, campo, valor)
+
+    def save(self, *args, **kwargs):
+        # O desconto, o IGV e o adiantamento podem mudar sem tocar nos itens: os totais derivam sempre do subtotal guardado
+        self._aplicar_totais()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(self.CAMPOS_TOTAIS)
+        return super().save(*args, **kwargs)
     @property
     def foi_modificada(self):
         if not self.criado_em or not self.atualizado_em: return False
@@ -85,6 +123,15 @@ class Fatura(models.Model):
     class Meta:
         verbose_name = _("Fatura")
         verbose_name_plural = _("Faturas")
+        # Ordenação da lista/keyset (data, número, id) e filtros por cliente dentro de um período. Para as faturas
+        # por pagar: no SQLite e no PostgreSQL o Django escreve paga=False como "NOT paga", que só o índice parcial
+        # serve; no MySQL escreve "paga = False", e o MySQL não tem índices parciais, por isso usa o (paga, ...)
+        indexes = [
+            models.Index(fields=['data_emissao', 'numero_fatura', 'id'], name='fatura_data_idx'),
+            models.Index(fields=['data_emissao', 'numero_fatura', 'id'], condition=models.Q(paga=False), name='fatura_por_pagar_idx'),
+            models.Index(fields=['paga', 'data_emissao', 'numero_fatura', 'id'], name='fatura_paga_data_idx'),
+            models.Index(fields=['cliente', 'data_emissao'], name='fatura_cliente_data_idx'),
+        ]
 
 class ItemFatura(models.Model):
     fatura = models.ForeignKey(Fatura, related_name='itens', on_delete=models.CASCADE)
@@ -138,6 +185,7 @@ class GuiaTransporte(models.Model):
         verbose_name = _("Guia de Transporte")
         verbose_name_plural = _("Guias de Transporte")
         ordering = ['-data_emissao', '-numero_guia']
+        indexes = [models.Index(fields=['data_emissao', 'numero_guia', 'id'], name='guia_data_idx')]
 
 class ItemGuia(models.Model):
     guia = models.ForeignKey(GuiaTransporte, related_name='itens', on_delete=models.CASCADE)
@@ -158,6 +206,8 @@ class BackupConfig(models.Model):
     recipient_email = models.EmailField(_('Email de Destino para Backups'), help_text=_("O endereço de email para onde os ficheiros de backup serão enviados."))
     last_backup_status = models.CharField(_('Estado do Último Backup'), max_length=255, default=_("Nunca executado"), editable=False)
     last_backup_time = models.DateTimeField(_('Data do Último Backup'), null=True, blank=True, editable=False)
+    backup_started_at = models.DateTimeField(_('Backup em Curso Desde'), null=True, blank=True, editable=False, help_text=_("Preenchido enquanto um backup está a correr em segundo plano."))
+    backup_progress = models.PositiveSmallIntegerField(_('Progresso do Backup (%)'), default=0, editable=False)
     def __str__(self): return str(_("Configuração de Backup por Email"))
     def save(self, *args, **kwargs):
         if not self.pk and BackupConfig.objects.exists():
@@ -165,4 +215,215 @@ class BackupConfig(models.Model):
         return super().save(*args, **kwargs)
     class Meta:
         verbose_name = _("Configuração de Backup")
-        verbose_name_plural = _("Configuração de Backup")
\ No newline at end of file
+        verbose_name_plural = _("Configuração de Backup")
+
+class VendaDiaria(models.Model):
+    """Vendas pré-agregadas por dia, produto, cliente e estado de pagamento (mantida por stock.vendas_diarias)."""
+    data = models.DateField(_('data'))
+    produto = models.ForeignKey(Produto, verbose_name=_('produto'), on_delete=models.CASCADE, related_name='vendas_diarias')
+    cliente = models.ForeignKey(Cliente, verbose_name=_('cliente'), on_delete=models.CASCADE, related_name='vendas_diarias')
+    paga = models.BooleanField(_('paga'))
+    quantidade = models.DecimalField(_('quantidade'), max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    # Quantidade × preço, antes do desconto e do IGV, sem arredondar (é o valor dos tops do dashboard)
+    valor_bruto = models.DecimalField(_('valor bruto'), max_digits=16, decimal_places=4, default=Decimal('0.0000'))
+    valor_liquido = models.DecimalField(_('valor líquido'), max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    valor_igv = models.DecimalField(_('valor do IGV'), max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    total = models.DecimalField(_('total'), max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    def __str__(self): return f"{self.data} - {self.produto_id} - {self.cliente_id}"
+    class Meta:
+        verbose_name = _("Venda Diária")
+        verbose_name_plural = _("Vendas Diárias")
+        constraints = [models.UniqueConstraint(fields=['data', 'produto', 'cliente', 'paga'], name='venda_diaria_unica')]
+
+
+
+class SequenciaDocumento(models.Model):
+    """Último número atribuído por tipo de documento e ano (ex: FATURA/2025 -> 37 => '2025-0037')."""
+    TIPOS = [('FATURA', _('Fatura')), ('GUIA', _('Guia de Transporte'))]
+    tipo = models.CharField(_('tipo de documento'), max_length=10, choices=TIPOS)
+    ano = models.PositiveIntegerField(_('ano'))
+    ultimo_numero = models.PositiveIntegerField(_('último número'), default=0)
+    def __str__(self): return f"{self.get_tipo_display()} {self.ano}: {self.ultimo_numero}"
+
+    @staticmethod
+    def formatar(ano, numero): return f"{ano}-{numero:04d}"
+
+    @classmethod
+    def maior_numero_existente(cls, tipo, ano):
+        """Maior sequencial já usado nos documentos do ano (só é lido ao criar a sequência ou ao reiniciá-la)."""
+        if tipo == 'FATURA':
+            numeros = Fatura.objects.filter(numero_fatura__startswith=f"{ano}-").values_list('numero_fatura', flat=True)
+        else:
+            numeros = GuiaTransporte.objects.filter(numero_guia__startswith=f"{ano}-").values_list('numero_guia', flat=True)
+        maior = 0
+        for numero in numeros:
+            try: maior = max(maior, int(numero.split('-')[-1]))
+            except ValueError: pass
+        return maior
+
+    @classmethod
+    def proximo_numero(cls, tipo, ano=None):
+        """
+        Reserva e devolve o próximo número do documento. O UPDATE com F() bloqueia a linha da sequência
+        até ao fim da transação do chamador, por isso dois pedidos simultâneos nunca recebem o mesmo número
+        (e, se a transação falhar, o número não fica gasto).
+        """
+        ano = ano or date.today().year
+        with transaction.atomic():
+            cls.objects.get_or_create(tipo=tipo, ano=ano, defaults={'ultimo_numero': cls.maior_numero_existente(tipo, ano)})
+            cls.objects.filter(tipo=tipo, ano=ano).update(ultimo_numero=models.F('ultimo_numero') + 1)
+            numero = cls.objects.filter(tipo=tipo, ano=ano).values_list('ultimo_numero', flat=True).get()
+        return cls.formatar(ano, numero)
+
+    @classmethod
+    def reiniciar(cls, tipo, ano):
+        """Volta a alinhar a sequência com o maior número existente (usado depois de apagar documentos)."""
+        cls.objects.update_or_create(tipo=tipo, ano=ano, defaults={'ultimo_numero': cls.maior_numero_existente(tipo, ano)})
+
+    class Meta:
+        verbose_name = _("Sequência de Documentos")
+        verbose_name_plural = _("Sequências de Documentos")
+        constraints = [models.UniqueConstraint(fields=['tipo', 'ano'], name='sequencia_documento_unica')]
+
+
+class MovimentoEstoque(models.Model):
+    """Registo (só de acrescentar) de cada entrada/saída de estoque, com o saldo do produto logo a seguir."""
+    TIPOS = [
+        ('SAIDA_FATURA', _('Saída por fatura')),
+        ('AJUSTE_EDICAO', _('Ajuste por edição de fatura')),
+        ('CORRECAO_MANUAL', _('Correção manual')),
+        ('DEVOLUCAO_RESET', _('Devolução por reset de numeração')),
+        ('ENTRADA_PRODUCAO', _('Entrada de produção')),
+    ]
+    produto = models.ForeignKey(Produto, verbose_name=_('produto'), on_delete=models.CASCADE, related_name='movimentos')
+    tipo = models.CharField(_('tipo'), max_length=20, choices=TIPOS)
+    quantidade = models.DecimalField(_('quantidade'), max_digits=12, decimal_places=2, help_text=_("Positiva para entradas, negativa para saídas."))
+    saldo_apos = models.DecimalField(_('saldo após movimento'), max_digits=12, decimal_places=2)
+    fatura = models.ForeignKey(Fatura, verbose_name=_('fatura'), on_delete=models.SET_NULL, null=True, blank=True, related_name='movimentos_estoque')
+    utilizador = models.ForeignKey(User, verbose_name=_('utilizador'), on_delete=models.SET_NULL, null=True, blank=True)
+    nota = models.CharField(_('nota'), max_length=255, blank=True)
+    criado_em = models.DateTimeField(_('data'), default=timezone.now)
+    def __str__(self): return f"{self.get_tipo_display()}: {self.quantidade} x {self.produto_id}"
+    class Meta:
+        verbose_name = _("Movimento de Estoque")
+        verbose_name_plural = _("Movimentos de Estoque")
+        indexes = [models.Index(fields=['produto', 'criado_em'], name='movimento_produto_data_idx')]
+
+
+class SaldoEstoque(models.Model):
+    """Fotografia do saldo de um produto no fim de um dia (ver stock.estoque.saldo_em)."""
+    produto = models.ForeignKey(Produto, verbose_name=_('produto'), on_delete=models.CASCADE, related_name='saldos')
+    data = models.DateField(_('data'))
+    saldo = models.DecimalField(_('saldo'), max_digits=12, decimal_places=2)
+    ultimo_movimento_id = models.BigIntegerField(_('último movimento incluído'), default=0)
+    def __str__(self): return f"{self.produto_id} @ {self.data}: {self.saldo}"
+    class Meta:
+        verbose_name = _("Saldo de Estoque")
+        verbose_name_plural = _("Saldos de Estoque")
+        constraints = [models.UniqueConstraint(fields=['produto', 'data'], name='saldo_estoque_unico')]
+
+
+class EntradaPesquisa(models.Model):
+    """
+    Uma linha por fatura, guia, cliente ou produto com o texto pesquisável já normalizado (minúsculas,
+    sem acentos). É mantida pelos signals em stock/signals.py e indexada pelo motor de texto da base de
+    dados (FTS5 no SQLite, FULLTEXT no MySQL, tsvector no PostgreSQL), ver stock.pesquisa.
+    """
+    TIPOS = [('fatura', _('Fatura')), ('guia', _('Guia de Transporte')), ('cliente', _('Cliente')), ('produto', _('Produto'))]
+    tipo = models.CharField(_('tipo'), max_length=10, choices=TIPOS)
+    objeto_id = models.PositiveIntegerField(_('id do objeto'))
+    titulo = models.CharField(_('título'), max_length=255)
+    subtitulo = models.CharField(_('subtítulo'), max_length=255, blank=True)
+    texto = models.TextField(_('texto pesquisável'))
+    data = models.DateField(_('data'), null=True, blank=True)
+    def __str__(self): return f"{self.get_tipo_display()}: {self.titulo}"
+    class Meta:
+        verbose_name = _("Entrada de Pesquisa")
+        verbose_name_plural = _("Entradas de Pesquisa")
+        constraints = [models.UniqueConstraint(fields=['tipo', 'objeto_id'], name='entrada_pesquisa_unica')]
+
+
+class TarefaPDF(models.Model):
+    """
+    Fila (na própria base de dados) dos PDFs a pré-renderizar pelo comando processar_pdfs.
+    Há no máximo uma linha por documento: voltar a pedir o mesmo documento só a repõe como pendente.
+    """
+    TIPOS = [('fatura', _('Fatura')), ('guia', _('Guia de Transporte'))]
+    ESTADOS = [('PENDENTE', _('Pendente')), ('EM_CURSO', _('Em curso')), ('CONCLUIDA', _('Concluída')), ('ERRO', _('Erro'))]
+    tipo = models.CharField(_('tipo'), max_length=10, choices=TIPOS)
+    objeto_id = models.PositiveIntegerField(_('id do documento'))
+    estado = models.CharField(_('estado'), max_length=10, choices=ESTADOS, default='PENDENTE')
+    tentativas = models.PositiveSmallIntegerField(_('tentativas'), default=0)
+    erro = models.TextField(_('último erro'), blank=True)
+    pedido_em = models.DateTimeField(_('pedido em'), default=timezone.now)
+    iniciado_em = models.DateTimeField(_('iniciado em'), null=True, blank=True)
+    concluido_em = models.DateTimeField(_('concluído em'), null=True, blank=True)
+    def __str__(self): return f"{self.get_tipo_display()} #{self.objeto_id} ({self.get_estado_display()})"
+    class Meta:
+        verbose_name = _("Tarefa de PDF")
+        verbose_name_plural = _("Tarefas de PDF")
+        constraints = [models.UniqueConstraint(fields=['tipo', 'objeto_id'], name='tarefa_pdf_unica')]
+        indexes = [models.Index(fields=['estado', 'pedido_em'], name='tarefa_pdf_fila_idx')]
+
+
+class EnvioEmail(models.Model):
+    """
+    Caixa de saída dos emails de faturas e guias. As views só criam a linha; o envio (com o PDF em anexo)
+    é feito por stock/emails.py, numa única ligação SMTP para todo o lote, com novas tentativas espaçadas.
+    """
+    ESTADOS = [('PENDENTE', _('Pendente')), ('EM_ENVIO', _('Em envio')), ('ENVIADO', _('Enviado')), ('ERRO', _('Erro'))]
+    fatura = models.ForeignKey(Fatura, verbose_name=_('fatura'), on_delete=models.SET_NULL, null=True, blank=True, related_name='emails')
+    guia = models.ForeignKey(GuiaTransporte, verbose_name=_('guia de transporte'), on_delete=models.SET_NULL, null=True, blank=True, related_name='emails')
+    destinatario = models.EmailField(_('destinatário'), max_length=254)
+    assunto = models.CharField(_('assunto'), max_length=255)
+    corpo = models.TextField(_('corpo'))
+    estado = models.CharField(_('estado'), max_length=10, choices=ESTADOS, default='PENDENTE')
+    tentativas = models.PositiveSmallIntegerField(_('tentativas'), default=0)
+    proxima_tentativa = models.DateTimeField(_('próxima tentativa'), default=timezone.now)
+    erro = models.TextField(_('último erro'), blank=True)
+    utilizador = models.ForeignKey(User, verbose_name=_('utilizador'), on_delete=models.SET_NULL, null=True, blank=True)
+    criado_em = models.DateTimeField(_('criado em'), auto_now_add=True)
+    enviado_em = models.DateTimeField(_('enviado em'), null=True, blank=True)
+    def __str__(self): return f"{self.assunto} -> {self.destinatario} ({self.get_estado_display()})"
+    class Meta:
+        verbose_name = _("Envio de Email")
+        verbose_name_plural = _("Envios de Email")
+        ordering = ['-criado_em']
+        indexes = [models.Index(fields=['estado', 'proxima_tentativa'], name='envio_email_fila_idx')]
+
+
+class TarefaAgendada(models.Model):
+    """
+    Estado de cada tarefa periódica do agendador (stock/agendador.py). A própria linha serve de lock entre
+    processos: só quem consegue marcar em_curso_desde corre a tarefa.
+    """
+    nome = models.CharField(_('nome'), max_length=50, unique=True)
+    ativa = models.BooleanField(_('ativa'), default=True)
+    hora = models.TimeField(_('hora'), null=True, blank=True, help_text=_("Hora do dia a que a tarefa corre (tarefas diárias e backup)."))
+    intervalo_minutos = models.PositiveIntegerField(_('intervalo (minutos)'), null=True, blank=True, help_text=_("Para tarefas repetidas ao longo do dia."))
+    ultima_execucao = models.DateTimeField(_('última execução'), null=True, blank=True, editable=False)
+    proxima_execucao = models.DateTimeField(_('próxima execução'), null=True, blank=True, editable=False)
+    em_curso_desde = models.DateTimeField(_('em curso desde'), null=True, blank=True, editable=False)
+    em_curso_por = models.CharField(_('em curso por'), max_length=100, blank=True, editable=False)
+    def __str__(self): return self.nome
+    class Meta:
+        verbose_name = _("Tarefa Agendada")
+        verbose_name_plural = _("Tarefas Agendadas")
+        ordering = ['nome']
+
+
+class ExecucaoTarefa(models.Model):
+    """Histórico das execuções das tarefas agendadas."""
+    ESTADOS = [('EM_CURSO', _('Em curso')), ('SUCESSO', _('Sucesso')), ('ERRO', _('Erro'))]
+    tarefa = models.ForeignKey(TarefaAgendada, verbose_name=_('tarefa'), on_delete=models.CASCADE, related_name='execucoes')
+    inicio = models.DateTimeField(_('início'), default=timezone.now)
+    fim = models.DateTimeField(_('fim'), null=True, blank=True)
+    estado = models.CharField(_('estado'), max_length=10, choices=ESTADOS, default='EM_CURSO')
+    resultado = models.TextField(_('resultado'), blank=True)
+    processo = models.CharField(_('processo'), max_length=100, blank=True)
+    def __str__(self): return f"{self.tarefa} {self.inicio:%Y-%m-%d %H:%M} ({self.get_estado_display()})"
+    class Meta:
+        verbose_name = _("Execução de Tarefa")
+        verbose_name_plural = _("Execuções de Tarefas")
+        ordering = ['-inicio']
+        indexes = [models.Index(fields=['tarefa', '-inicio'], name='execucao_tarefa_idx')]
@@ -0,0 +1,117 @@
+# Ficheiro: stock/paginacao.py
+# Paginação das listas. Por omissão usa o Paginator do Django (números de página, COUNT + OFFSET);
+# com ?paginacao=cursor usa paginação por keyset: cada página procura a partir da última linha da
+# anterior com um WHERE sobre as colunas de ordenação, por isso as páginas fundas custam o mesmo
+# que a primeira e não há COUNT(*).
+
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+POR_PAGINA = 15
+
+
+def _codificar_cursor(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores, cls=DjangoJSONEncoder).encode()).decode().rstrip('=')
+
+
+def _campo(modelo, caminho):
+    for parte in caminho.lstrip('-').split('__'):
+        campo = modelo._meta.get_field(parte)
+        modelo = campo.related_model
+    return campo
+
+
+def _descodificar_cursor(cursor, ordem, modelo):
+    """
+    Devolve a lista de valores do cursor, já convertidos para o tipo de cada coluna, ou None se o cursor
+    não for válido para esta ordenação (o cursor vem do URL e pode ter sido alterado à mão).
+    """
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(valores, list) or len(valores) != len(ordem):
+        return None
+    try:
+        valores = [_campo(modelo, campo).to_python(valor) for campo, valor in zip(ordem, valores)]
+    except (ValidationError, TypeError):
+        return None
+    return None if None in valores else valores  # as colunas de ordenação nunca são nulas
+
+
+def _valor(obj, campo):
+    for parte in campo.lstrip('-').split('__'):
+        obj = getattr(obj, parte)
+    return obj
+
+
+def _filtro_seek(ordem, valores, para_tras=False):
+    """
+    Equivalente a (a, b, id) < (va, vb, vid) respeitando a direção de cada coluna:
+    (a < va) OR (a = va AND b < vb) OR (a = va AND b = vb AND id < vid).
+    As colunas de ordenação não podem ser nulas e a última tem de ser única (normalmente o id).
+    """
+    filtro = Q()
+    for i, campo in enumerate(ordem):
+        descendente = campo.startswith('-') != para_tras
+        condicao = Q(**{f"{campo.lstrip('-')}__{'lt' if descendente else 'gt'}": valores[i]})
+        for anterior, valor in zip(ordem[:i], valores[:i]):
+            condicao &= Q(**{anterior.lstrip('-'): valor})
+        filtro |= condicao
+    return filtro
+
+
+def _inverter(campo):
+    return campo[1:] if campo.startswith('-') else '-' + campo
+
+
+class PaginaKeyset:
+    """Página de uma lista paginada por cursor, com a parte da interface de Page que os templates usam."""
+    keyset = True
+
+    def __init__(self, object_list, ordem, has_previous, has_next):
+        self.object_list = object_list
+        # Sem linhas não há cursor: os links só aparecem quando há para onde apontar
+        self.cursor_anterior = _codificar_cursor([_valor(object_list[0], c) for c in ordem]) if object_list and has_previous else None
+        self.cursor_seguinte = _codificar_cursor([_valor(object_list[-1], c) for c in ordem]) if object_list and has_next else None
+
+    def __iter__(self): return iter(self.object_list)
+    def __len__(self): return len(self.object_list)
+    def has_previous(self): return self.cursor_anterior is not None
+    def has_next(self): return self.cursor_seguinte is not None
+    def has_other_pages(self): return self.has_previous() or self.has_next()
+
+
+def paginar_keyset(queryset, ordem, apos=None, antes=None, por_pagina=POR_PAGINA):
+    """Página seguinte a `apos` (ou anterior a `antes`), ou a primeira página se não houver cursor válido."""
+    ordem = list(ordem)
+    if antes and (valores := _descodificar_cursor(antes, ordem, queryset.model)) is not None:
+        linhas = list(queryset.filter(_filtro_seek(ordem, valores, para_tras=True)).order_by(*map(_inverter, ordem))[:por_pagina + 1])
+        if len(linhas) > por_pagina:
+            return PaginaKeyset(linhas[:por_pagina][::-1], ordem, has_previous=True, has_next=True)
+        # Chegou ao início da lista (a página ficaria curta ou vazia): mostra a primeira página inteira
+        return paginar_keyset(queryset, ordem, por_pagina=por_pagina)
+    valores = _descodificar_cursor(apos, ordem, queryset.model) if apos else None
+    if valores is not None:
+        linhas = list(queryset.filter(_filtro_seek(ordem, valores)).order_by(*ordem)[:por_pagina + 1])
+        if not linhas:
+            # Depois do fim da lista (as linhas seguintes foram apagadas): não há cursor para voltar atrás
+            return paginar_keyset(queryset, ordem, por_pagina=por_pagina)
+    else:
+        linhas = list(queryset.order_by(*ordem)[:por_pagina + 1])
+    return PaginaKeyset(linhas[:por_pagina], ordem, has_previous=valores is not None, has_next=len(linhas) > por_pagina)
+
+
+def paginar(request, queryset, ordem, por_pagina=POR_PAGINA):
+    """
+    Pagina `queryset` pela `ordem` indicada (lista para order_by, terminada numa coluna única).
+    Usa cursores (?apos= / ?antes=) quando o pedido traz ?paginacao=cursor, ou o Paginator normal.
+    """
+    if request.GET.get('paginacao') == 'cursor':
+        return paginar_keyset(queryset, ordem, request.GET.get('apos'), request.GET.get('antes'), por_pagina)
+    return Paginator(queryset.order_by(*ordem), por_pagina).get_page(request.GET.get('page'))
@@ -0,0 +1,166 @@
+# Ficheiro: stock/pdf.py
+# Geração dos PDFs de faturas e guias, com cache em disco (MEDIA_ROOT/pdf_cache/<tipo>/).
+#
+# A chave de cada ficheiro é um hash do HTML que vai para o WeasyPrint, que já inclui os dados do
+# documento, a versão do template e os DadosEmpresa, mais a assinatura do ficheiro do logotipo. Renderizar
+# o template custa milissegundos; o WeasyPrint custa segundos, por isso só corre quando o HTML muda.
+# Um documento editado gera outro hash (o ficheiro antigo nunca volta a ser servido) e os signals
+# apagam os ficheiros antigos. O download e o email usam o mesmo ficheiro.
+# Os PDFs saem sempre na língua por omissão (settings.LANGUAGE_CODE), seja qual for a do pedido: assim o
+# ficheiro pré-renderizado pelo processar_pdfs é o mesmo que o download procura.
+#
+# Quando é mesmo preciso renderizar, o que não depende do documento é preparado uma vez por processo e
+# reutilizado: as folhas de estilo (stock/static/stock/css/*_pdf.css) já interpretadas, a configuração
+# de fontes do WeasyPrint e os bytes do logotipo, que só voltam a ser lidos quando o ficheiro muda.
+
+import hashlib
+import mimetypes
+import os
+import pathlib
+import shutil
+from functools import lru_cache
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import translation
+
+from .singletons import obter_dados_empresa
+
+try:
+    from weasyprint import CSS, HTML, default_url_fetcher
+    from weasyprint.text.fonts import FontConfiguration
+except ImportError:
+    HTML = None
+
+PASTA_CACHE = 'pdf_cache'
+PASTA_CSS = pathlib.Path(__file__).resolve().parent / 'static' / 'stock' / 'css'
+# tipo -> (template, nome do documento no contexto, folha de estilo)
+DOCUMENTOS = {
+    'fatura': ('stock/fatura_pdf.html', 'fatura', 'fatura_pdf.css'),
+    'guia': ('stock/guia_pdf.html', 'guia', 'guia_pdf.css'),
+}
+# Bytes do logotipo já lido: {assinatura: (bytes, mime_type)}
+_LOGOS = {}
+
+
+class PDFIndisponivel(RuntimeError):
+    """O WeasyPrint não está instalado e o PDF pedido ainda não está na cache."""
+
+
+def pasta_cache(tipo=None):
+    pasta = pathlib.Path(settings.MEDIA_ROOT) / PASTA_CACHE
+    return pasta / tipo if tipo else pasta
+
+
+def _logo(dados_empresa):
+    """URI file:// do logotipo e uma assinatura (caminho, tamanho, data) para a chave da cache."""
+    if not (dados_empresa and dados_empresa.logotipo and hasattr(dados_empresa.logotipo, 'path')):
+        return None, ''
+    caminho = pathlib.Path(dados_empresa.logotipo.path)
+    try:
+        estado = caminho.stat()
+    except OSError:
+        return None, ''
+    return caminho.as_uri(), f"{caminho}:{estado.st_size}:{estado.st_mtime_ns}"
+
+
+def _bytes_logo(caminho, assinatura):
+    """Conteúdo do logotipo, lido do disco só quando a assinatura (tamanho/data do ficheiro) muda."""
+    if assinatura not in _LOGOS:
+        _LOGOS.clear()
+        _LOGOS[assinatura] = (caminho.read_bytes(), mimetypes.guess_type(caminho.name)[0] or 'image/png')
+    return _LOGOS[assinatura]
+
+
+def esquecer_logo():
+    """Descarta o logotipo em memória (os dados da empresa mudaram)."""
+    _LOGOS.clear()
+
+
+@lru_cache(maxsize=None)
+def _css(tipo):
+    """Texto da folha de estilo do documento e o seu hash (entra na chave da cache)."""
+    texto = (PASTA_CSS / DOCUMENTOS[tipo][2]).read_text(encoding='utf-8')
+    return texto, hashlib.sha256(texto.encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _fontes():
+    return FontConfiguration()
+
+
+@lru_cache(maxsize=None)
+def _estilos(tipo):
+    """Folha de estilo já interpretada pelo WeasyPrint, partilhada por todas as renderizações do processo."""
+    return [CSS(string=_css(tipo)[0], font_config=_fontes())]
+
+
+def renderizar_html(tipo, documento, dados_empresa=None):
+    """Devolve (html, chave) do documento; a chave identifica o PDF na cache."""
+    template, nome = DOCUMENTOS[tipo][:2]
+    dados_empresa = dados_empresa or obter_dados_empresa()
+    logo_uri, assinatura_logo = _logo(dados_empresa)
+    with translation.override(settings.LANGUAGE_CODE):
+        html = render_to_string(template, {nome: documento, 'dados_empresa': dados_empresa, 'logo_uri': logo_uri})
+    return html, hashlib.sha256(f"{html}\0{_css(tipo)[1]}\0{assinatura_logo}".encode()).hexdigest()[:32]
+
+
+def escrever_pdf(tipo, html, dados_empresa=None, base_url=None):
+    """Bytes do PDF de um HTML já renderizado, com os estilos, as fontes e o logotipo partilhados."""
+    if HTML is None:
+        raise PDFIndisponivel("WeasyPrint não está instalado.")
+    logo_uri, assinatura_logo = _logo(dados_empresa)
+
+    def buscar(url, *args, **kwargs):
+        if logo_uri and url == logo_uri:
+            conteudo, mime_type = _bytes_logo(pathlib.Path(dados_empresa.logotipo.path), assinatura_logo)
+            return {'string': conteudo, 'mime_type': mime_type, 'redirected_url': url}
+        return default_url_fetcher(url, *args, **kwargs)
+
+    documento = HTML(string=html, base_url=base_url or pathlib.Path(settings.MEDIA_ROOT).as_uri(), url_fetcher=buscar)
+    return documento.write_pdf(stylesheets=_estilos(tipo), font_config=_fontes())
+
+
+def obter_pdf(tipo, documento, base_url=None, dados_empresa=None):
+    """
+    Caminho do PDF do documento, renderizado agora só se ainda não existir na cache.
+    Lança PDFIndisponivel se for preciso renderizar e o WeasyPrint não estiver instalado.
+    """
+    dados_empresa = dados_empresa or obter_dados_empresa()
+    html, chave = renderizar_html(tipo, documento, dados_empresa)
+    caminho = pasta_cache(tipo) / f"{documento.pk}-{chave}.pdf"
+    if caminho.exists():
+        return caminho
+    pdf = escrever_pdf(tipo, html, dados_empresa, base_url)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    # Escreve para um ficheiro temporário e renomeia, para nunca servir um PDF a meio de ser escrito
+    temporario = caminho.with_name(f"{caminho.name}.{os.getpid()}.tmp")
+    temporario.write_bytes(pdf)
+    os.replace(temporario, caminho)
+    apagar_pdfs(tipo, documento.pk, exceto=caminho)
+    return caminho
+
+
+def abrir_pdf(tipo, documento, base_url=None, dados_empresa=None, tentativas=3):
+    """
+    Ficheiro aberto (binário) com o PDF do documento, como obter_pdf. Depois de aberto continua legível
+    mesmo que os signals o apaguem; se for apagado entre obter_pdf e o open, obtém-se outra vez.
+    """
+    for tentativa in range(tentativas):
+        caminho = obter_pdf(tipo, documento, base_url, dados_empresa)
+        try:
+            return open(caminho, 'rb')
+        except FileNotFoundError:
+            if tentativa == tentativas - 1:
+                raise
+
+
+def apagar_pdfs(tipo, objeto_id, exceto=None):
+    """Apaga as versões em cache do PDF de um documento (todas, ou todas menos `exceto`)."""
+    for ficheiro in pasta_cache(tipo).glob(f"{objeto_id}-*.pdf"):
+        if ficheiro != exceto:
+            ficheiro.unlink(missing_ok=True)
+
+
+def limpar_cache():
+    """Apaga toda a cache de PDFs (ex.: quando os dados da empresa mudam)."""
+    shutil.rmtree(pasta_cache(), ignore_errors=True)
@@ -0,0 +1,188 @@
+# Ficheiro: stock/pesquisa.py
+# Pesquisa global (faturas, guias, clientes e produtos).
+#
+# Cada objeto tem uma EntradaPesquisa com o texto normalizado, atualizada pelos signals. Por cima dessa
+# tabela, cada base de dados usa o seu índice de texto (criado na migração 0006):
+#   - SQLite: tabela virtual FTS5 (stock_entradapesquisa_fts) sincronizada por triggers, ordenada por bm25;
+#   - MySQL: índice FULLTEXT, MATCH ... AGAINST em modo booleano;
+#   - PostgreSQL: índice GIN sobre to_tsvector('simple', texto), ordenado por ts_rank.
+# Noutros motores cai para um filtro com contains, que continua a funcionar, só que sem índice.
+
+import re
+import unicodedata
+from django.db import connection, transaction
+
+from .models import Cliente, EntradaPesquisa, Fatura, GuiaTransporte, Produto
+
+TABELA_FTS = 'stock_entradapesquisa_fts'
+CAMPOS_ATUALIZADOS = ['titulo', 'subtitulo', 'texto', 'data']
+URLS = {'fatura': 'detalhe_fatura', 'guia': 'detalhe_guia', 'cliente': 'editar_cliente', 'produto': 'movimentos_produto'}
+
+SQL_CRIAR = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {TABELA_FTS} USING fts5(texto, content='stock_entradapesquisa', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER stock_entradapesquisa_ai AFTER INSERT ON stock_entradapesquisa BEGIN "
+        f"INSERT INTO {TABELA_FTS}(rowid, texto) VALUES (new.id, new.texto); END",
+        f"CREATE TRIGGER stock_entradapesquisa_ad AFTER DELETE ON stock_entradapesquisa BEGIN "
+        f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, texto) VALUES ('delete', old.id, old.texto); END",
+        f"CREATE TRIGGER stock_entradapesquisa_au AFTER UPDATE ON stock_entradapesquisa BEGIN "
+        f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, texto) VALUES ('delete', old.id, old.texto); "
+        f"INSERT INTO {TABELA_FTS}(rowid, texto) VALUES (new.id, new.texto); END",
+    ],
+    'mysql': ["ALTER TABLE stock_entradapesquisa ADD FULLTEXT INDEX stock_entradapesquisa_ft (texto)"],
+    'postgresql': ["CREATE INDEX stock_entradapesquisa_tsv ON stock_entradapesquisa USING GIN (to_tsvector('simple', texto))"],
+}
+SQL_APAGAR = {
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS stock_entradapesquisa_ai", "DROP TRIGGER IF EXISTS stock_entradapesquisa_ad",
+        "DROP TRIGGER IF EXISTS stock_entradapesquisa_au", f"DROP TABLE IF EXISTS {TABELA_FTS}",
+    ],
+    'mysql': ["ALTER TABLE stock_entradapesquisa DROP INDEX stock_entradapesquisa_ft"],
+    'postgresql': ["DROP INDEX IF EXISTS stock_entradapesquisa_tsv"],
+}
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos, para o texto guardado e para os termos pesquisados ficarem iguais."""
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def palavras(texto):
+    return re.findall(r'[^\W_]+', normalizar(texto))
+
+
+def _texto(*valores):
+    # Também guarda cada valor sem espaços/traços, para "955123456" encontrar "955 123 456"
+    partes = []
+    for valor in valores:
+        if not valor:
+            continue
+        partes.append(normalizar(valor))
+        compacto = ''.join(palavras(valor))
+        if compacto != ' '.join(palavras(valor)):
+            partes.append(compacto)
+    return ' '.join(partes)
+
+
+# Os construtores devolvem só os campos da entrada e usam apenas atributos dos modelos (sem métodos).
+# A migração 0006 tem uma cópia própria: ao mudar o texto indexado, correr `manage.py reindexar_pesquisa`.
+def _entrada_fatura(f):
+    return dict(
+        tipo='fatura', objeto_id=f.id, titulo=f.numero_fatura or f"#{f.id}", data=f.data_emissao,
+        subtitulo=f"{f.cliente.nome} · {f.data_emissao:%d/%m/%Y} · {f.valor_a_pagar:,.2f} CFA",
+        texto=_texto(f.numero_fatura, f.cliente.nome, f.cliente.nif, f.cliente.telefone),
+    )
+
+
+def _entrada_guia(g):
+    cliente = g.fatura.cliente
+    return dict(
+        tipo='guia', objeto_id=g.id, titulo=g.numero_guia or f"#{g.id}", data=g.data_emissao,
+        subtitulo=f"{cliente.nome} · {g.data_emissao:%d/%m/%Y} · {g.matricula_veiculo}".rstrip(' ·'),
+        texto=_texto(g.numero_guia, g.fatura.numero_fatura, cliente.nome, g.matricula_veiculo, g.morada_carga, g.morada_descarga),
+    )
+
+
+def _entrada_cliente(c):
+    return dict(
+        tipo='cliente', objeto_id=c.id, titulo=c.nome, subtitulo=' · '.join(v for v in (c.nif, c.telefone, c.email) if v),
+        texto=_texto(c.nome, c.nif, c.telefone, c.email, c.endereco),
+    )
+
+
+def _entrada_produto(p):
+    return dict(
+        tipo='produto', objeto_id=p.id, titulo=f"{p.nome} ({p.calibre})" if p.calibre else p.nome, subtitulo=(p.descricao or '')[:255],
+        texto=_texto(p.nome, p.calibre, p.descricao),
+    )
+
+
+CONSTRUTORES = {
+    'fatura': (_entrada_fatura, lambda: Fatura.objects.select_related('cliente')),
+    'guia': (_entrada_guia, lambda: GuiaTransporte.objects.select_related('fatura__cliente')),
+    'cliente': (_entrada_cliente, lambda: Cliente.objects.all()),
+    'produto': (_entrada_produto, lambda: Produto.objects.all()),
+}
+
+
+def indexar(tipo, objetos):
+    """Cria ou atualiza (upsert) as entradas dos objetos indicados."""
+    construtor = CONSTRUTORES[tipo][0]
+    entradas = [EntradaPesquisa(**construtor(obj)) for obj in objetos]
+    if not entradas:
+        return 0
+    opcoes = {'update_conflicts': True, 'update_fields': CAMPOS_ATUALIZADOS}
+    if connection.features.supports_update_conflicts_with_target:
+        opcoes['unique_fields'] = ['tipo', 'objeto_id']
+    EntradaPesquisa.objects.bulk_create(entradas, batch_size=500, **opcoes)
+    return len(entradas)
+
+
+def remover(tipo, objeto_id):
+    EntradaPesquisa.objects.filter(tipo=tipo, objeto_id=objeto_id).delete()
+
+
+def reconstruir_indice(chunk_size=2000):
+    """Apaga e volta a gerar todas as entradas (e, no SQLite, o índice FTS5)."""
+    total = 0
+    with transaction.atomic():
+        EntradaPesquisa.objects.all().delete()
+        for tipo, (_construtor, queryset) in CONSTRUTORES.items():
+            lote = []
+            for obj in queryset().order_by('pk').iterator(chunk_size=chunk_size):
+                lote.append(obj)
+                if len(lote) >= chunk_size:
+                    total += indexar(tipo, lote)
+                    lote = []
+            total += indexar(tipo, lote)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {TABELA_FTS}({TABELA_FTS}) VALUES ('rebuild')")
+    return total
+
+
+def _ids_ordenados(termos, limite):
+    """Ids de EntradaPesquisa por relevância, usando o índice de texto da base de dados em uso."""
+    if connection.vendor == 'mysql':
+        # No InnoDB as palavras com menos de 3 letras não entram no índice FULLTEXT
+        termos = [t for t in termos if len(t) >= 3]
+    if not termos:
+        return None
+    consultas = {
+        'sqlite': (
+            f"SELECT rowid FROM {TABELA_FTS} WHERE {TABELA_FTS} MATCH %s ORDER BY bm25({TABELA_FTS}) LIMIT %s",
+            lambda: [' AND '.join(f'"{t}"*' for t in termos), limite],
+        ),
+        'mysql': (
+            "SELECT id FROM stock_entradapesquisa WHERE MATCH(texto) AGAINST (%s IN BOOLEAN MODE) "
+            "ORDER BY MATCH(texto) AGAINST (%s IN BOOLEAN MODE) DESC LIMIT %s",
+            lambda: [' '.join(f'+{t}*' for t in termos)] * 2 + [limite],
+        ),
+        'postgresql': (
+            "SELECT id FROM stock_entradapesquisa WHERE to_tsvector('simple', texto) @@ to_tsquery('simple', %s) "
+            "ORDER BY ts_rank(to_tsvector('simple', texto), to_tsquery('simple', %s)) DESC LIMIT %s",
+            lambda: [' & '.join(f'{t}:*' for t in termos)] * 2 + [limite],
+        ),
+    }
+    if connection.vendor not in consultas:
+        return None
+    sql, parametros = consultas[connection.vendor]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros())
+        return [linha[0] for linha in cursor.fetchall()]
+
+
+def pesquisar(termo, limite=50):
+    """Devolve até `limite` EntradaPesquisa que contêm todas as palavras do termo (como prefixo), as mais relevantes primeiro."""
+    termos = palavras(termo)
+    if not termos:
+        return []
+    ids = _ids_ordenados(termos, limite)
+    if ids is None:
+        entradas = EntradaPesquisa.objects.all()
+        for t in termos:
+            entradas = entradas.filter(texto__contains=t)
+        return list(entradas.order_by('-data', 'titulo')[:limite])
+    por_id = EntradaPesquisa.objects.in_bulk(ids)
+    return [por_id[i] for i in ids if i in por_id]
@@ -0,0 +1,82 @@
+# Ficheiro: stock/produtos.py
+# Atualização em massa de estoque e preços: todas as linhas são validadas em conjunto e aplicadas
+# numa única transação (bulk_update para os preços, registo de movimentos para o estoque).
+
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .estoque import definir_estoque
+from .models import Produto, arredondar
+
+CAMPOS_EDITAVEIS = ('estoque_atual', 'preco_por_unidade')
+# max_digits=10, decimal_places=2
+VALOR_MAXIMO = Decimal('99999999.99')
+
+
+def validar_alteracoes(linhas):
+    """
+    Lê linhas {'id', 'estoque_atual', 'preco_por_unidade'} (os campos em falta ou vazios ficam como estão)
+    e devolve ({produto_id: {campo: Decimal}}, erros). Nada é gravado.
+    """
+    alteracoes, erros = {}, []
+    for numero, linha in enumerate(linhas, start=1):
+        try:
+            produto_id = int(linha.get('id'))
+        except (AttributeError, TypeError, ValueError):
+            erros.append(_("Linha {numero}: produto inválido.").format(numero=numero))
+            continue
+        if produto_id in alteracoes:
+            erros.append(_("Linha {numero}: o produto {id} aparece mais de uma vez.").format(numero=numero, id=produto_id))
+            continue
+        valores = {}
+        for campo in CAMPOS_EDITAVEIS:
+            valor = linha.get(campo)
+            if valor is None or str(valor).strip() == '':
+                continue
+            try:
+                valor = Decimal(str(valor).strip().replace(',', '.'))
+                if not valor.is_finite():  # NaN e Infinity são lidos pelo Decimal mas não são comparáveis
+                    raise InvalidOperation
+                valor = arredondar(valor)
+            except InvalidOperation:
+                erros.append(_("Linha {numero}: valor inválido para {campo}.").format(numero=numero, campo=Produto._meta.get_field(campo).verbose_name))
+                continue
+            if not Decimal('0') <= valor <= VALOR_MAXIMO:
+                erros.append(_("Linha {numero}: {campo} fora dos limites.").format(numero=numero, campo=Produto._meta.get_field(campo).verbose_name))
+                continue
+            valores[campo] = valor
+        alteracoes[produto_id] = valores
+    return {produto_id: valores for produto_id, valores in alteracoes.items() if valores}, erros
+
+
+def atualizar_produtos_em_massa(alteracoes, utilizador):
+    """
+    Aplica {produto_id: {campo: valor}} tudo ou nada e devolve o número de produtos alterados.
+    Os produtos sem diferenças não são tocados; nos restantes, modificado_por e atualizado_em são
+    preenchidos à mão porque bulk_update não passa por save() (auto_now).
+    """
+    if not alteracoes:
+        return 0
+    with transaction.atomic():
+        produtos = Produto.objects.select_for_update().in_bulk(list(alteracoes))
+        em_falta = set(alteracoes) - set(produtos)
+        if em_falta:
+            raise Produto.DoesNotExist(_("Produto não encontrado (id {ids}).").format(ids=', '.join(str(i) for i in sorted(em_falta))))
+        agora = timezone.now()
+        alterados, estoques = [], {}
+        for produto_id, valores in alteracoes.items():
+            produto = produtos[produto_id]
+            novo_preco = valores.get('preco_por_unidade', produto.preco_por_unidade)
+            novo_estoque = valores.get('estoque_atual', produto.estoque_atual)
+            if novo_preco == produto.preco_por_unidade and novo_estoque == produto.estoque_atual:
+                continue
+            if novo_estoque != produto.estoque_atual:
+                estoques[produto_id] = novo_estoque
+            produto.preco_por_unidade, produto.modificado_por, produto.atualizado_em = novo_preco, utilizador, agora
+            alterados.append(produto)
+        Produto.objects.bulk_update(alterados, ['preco_por_unidade', 'modificado_por', 'atualizado_em'], batch_size=500)
+        # O estoque continua a passar pelo registo de movimentos (uma correção manual por produto)
+        definir_estoque(estoques, utilizador, nota=_("Atualização em massa"))
+    return len(alterados)
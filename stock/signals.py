@@ -0,0 +1,122 @@
+# Ficheiro: stock/signals.py
+# Receivers ligados em StockConfig.ready().
+
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .dashboard import invalidar_dashboard
+from .models import BackupConfig, Cliente, Configuracao, DadosEmpresa, Fatura, GuiaTransporte, ItemFatura, Produto, TarefaPDF
+from .pdf import apagar_pdfs, esquecer_logo, limpar_cache
+from .pesquisa import indexar, remover
+from .singletons import iniciar_pedido, invalidar, terminar_pedido
+from .tarefas_pdf import enfileirar_pdf
+
+
+@receiver([post_save, post_delete], sender=Fatura)
+@receiver([post_save, post_delete], sender=ItemFatura)
+@receiver([post_save, post_delete], sender=Cliente)
+@receiver([post_save, post_delete], sender=Produto)
+@receiver([post_save, post_delete], sender=Configuracao)
+def invalidar_cache_dashboard(sender, **kwargs):
+    # Só depois do commit: invalidar antes deixaria outro pedido voltar a guardar os dados antigos na cache
+    transaction.on_commit(invalidar_dashboard)
+
+
+# --- Índice de pesquisa (stock/pesquisa.py) ---
+
+@receiver(post_save, sender=Fatura)
+def indexar_fatura(sender, instance, raw=False, **kwargs):
+    if raw: return
+    indexar('fatura', [instance])
+    # A guia mostra o cliente da fatura, que pode ter mudado
+    indexar('guia', GuiaTransporte.objects.select_related('fatura__cliente').filter(fatura=instance))
+
+
+@receiver(post_save, sender=GuiaTransporte)
+def indexar_guia(sender, instance, raw=False, **kwargs):
+    if raw: return
+    indexar('guia', [instance])
+
+
+@receiver(post_save, sender=Cliente)
+def indexar_cliente(sender, instance, created=False, raw=False, **kwargs):
+    if raw: return
+    indexar('cliente', [instance])
+    if not created:
+        # O nome/NIF/telefone do cliente também entram no texto das suas faturas e guias
+        indexar('fatura', Fatura.objects.select_related('cliente').filter(cliente=instance))
+        indexar('guia', GuiaTransporte.objects.select_related('fatura__cliente').filter(fatura__cliente=instance))
+
+
+@receiver(post_save, sender=Produto)
+def indexar_produto(sender, instance, raw=False, **kwargs):
+    if raw: return
+    indexar('produto', [instance])
+
+
+@receiver(post_delete, sender=Fatura)
+@receiver(post_delete, sender=GuiaTransporte)
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Produto)
+def remover_da_pesquisa(sender, instance, **kwargs):
+    tipos = {Fatura: 'fatura', GuiaTransporte: 'guia', Cliente: 'cliente', Produto: 'produto'}
+    remover(tipos[sender], instance.pk)
+
+
+# --- Cache de PDFs (stock/pdf.py) ---
+# A chave da cache já muda quando o documento muda; aqui só se apagam os ficheiros que deixaram de servir.
+
+@receiver([post_save, post_delete], sender=Fatura)
+def apagar_pdfs_fatura(sender, instance, **kwargs):
+    fatura_id = instance.pk
+    transaction.on_commit(lambda: apagar_pdfs('fatura', fatura_id))
+
+
+@receiver([post_save, post_delete], sender=GuiaTransporte)
+def apagar_pdfs_guia(sender, instance, **kwargs):
+    guia_id = instance.pk
+    transaction.on_commit(lambda: apagar_pdfs('guia', guia_id))
+
+
+# --- Pré-renderização dos PDFs (stock/tarefas_pdf.py, comando processar_pdfs) ---
+
+@receiver(post_save, sender=Fatura)
+def enfileirar_pdf_fatura(sender, instance, raw=False, **kwargs):
+    if raw: return
+    transaction.on_commit(lambda: enfileirar_pdf('fatura', instance.pk))
+    # A guia mostra os dados da fatura, por isso também muda
+    for guia_id in GuiaTransporte.objects.filter(fatura=instance).values_list('id', flat=True):
+        transaction.on_commit(lambda guia_id=guia_id: enfileirar_pdf('guia', guia_id))
+
+
+@receiver(post_save, sender=GuiaTransporte)
+def enfileirar_pdf_guia(sender, instance, raw=False, **kwargs):
+    if raw: return
+    transaction.on_commit(lambda: enfileirar_pdf('guia', instance.pk))
+
+
+@receiver(post_delete, sender=Fatura)
+@receiver(post_delete, sender=GuiaTransporte)
+def remover_tarefa_pdf(sender, instance, **kwargs):
+    TarefaPDF.objects.filter(tipo='fatura' if sender is Fatura else 'guia', objeto_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=DadosEmpresa)
+def limpar_cache_pdfs(sender, **kwargs):
+    transaction.on_commit(limpar_cache)
+    transaction.on_commit(esquecer_logo)
+
+
+# --- Linhas únicas de configuração em memória (stock/singletons.py) ---
+
+@receiver([post_save, post_delete], sender=DadosEmpresa)
+@receiver([post_save, post_delete], sender=Configuracao)
+@receiver([post_save, post_delete], sender=BackupConfig)
+def invalidar_singleton(sender, **kwargs):
+    transaction.on_commit(lambda: invalidar(sender))
+
+
+request_started.connect(iniciar_pedido, dispatch_uid='singletons_iniciar_pedido')
+request_finished.connect(terminar_pedido, dispatch_uid='singletons_terminar_pedido')
@@ -0,0 +1,89 @@
+# Ficheiro: stock/singletons.py
+# Acesso às linhas únicas de configuração (DadosEmpresa, Configuracao, BackupConfig) sem uma query por uso.
+#
+# Cada processo guarda em memória a instância lida e a versão com que a leu. A versão vive na cache
+# partilhada (como a do dashboard) e muda sempre que a linha é gravada ou apagada (sinais em
+# stock/signals.py), por isso todos os processos do servidor voltam a ler a linha no acesso seguinte.
+# Durante um pedido HTTP a versão só é consultada uma vez por modelo; fora de pedidos (comandos,
+# threads), em cada acesso.
+
+import copy
+import threading
+import time
+from django.core.cache import cache
+
+from .models import BackupConfig, Configuracao, DadosEmpresa
+
+MODELOS = (DadosEmpresa, Configuracao, BackupConfig)
+# {label do modelo: (versão, instância ou None)}
+_INSTANCIAS = {}
+# Versões já consultadas no pedido em curso desta thread (None fora de pedidos)
+_pedido = threading.local()
+
+
+def _chave(modelo):
+    return f"singleton:{modelo._meta.label_lower}:versao"
+
+
+def _versao(modelo):
+    versoes = getattr(_pedido, 'versoes', None)
+    if versoes is not None and modelo in versoes:
+        return versoes[modelo]
+    versao = cache.get(_chave(modelo))
+    if versao is None:
+        versao = time.time_ns()
+        cache.set(_chave(modelo), versao, None)
+    if versoes is not None:
+        versoes[modelo] = versao
+    return versao
+
+
+def invalidar(modelo):
+    """Obriga todos os processos a reler a linha. Chamado pelos sinais, depois do commit."""
+    cache.set(_chave(modelo), time.time_ns(), None)
+    _INSTANCIAS.pop(modelo._meta.label, None)
+    versoes = getattr(_pedido, 'versoes', None)
+    if versoes is not None:
+        versoes.pop(modelo, None)
+
+
+def invalidar_todos():
+    for modelo in MODELOS:
+        invalidar(modelo)
+
+
+def iniciar_pedido(**kwargs):
+    _pedido.versoes = {}
+
+
+def terminar_pedido(**kwargs):
+    _pedido.versoes = None
+
+
+def obter(modelo, criar=False):
+    """
+    Cópia da linha única do modelo (ou None se não existir). Com `criar`, cria-a com os valores por
+    omissão se ainda não existir. As cópias podem ser alteradas à vontade sem afetar a versão em memória.
+    """
+    versao = _versao(modelo)
+    guardada = _INSTANCIAS.get(modelo._meta.label)
+    if guardada and guardada[0] == versao and (guardada[1] is not None or not criar):
+        instancia = guardada[1]
+    else:
+        instancia = modelo.objects.order_by('pk').first()
+        if instancia is None and criar:
+            instancia = modelo.objects.get_or_create(pk=1)[0]
+        _INSTANCIAS[modelo._meta.label] = (versao, instancia)
+    return copy.copy(instancia)
+
+
+def obter_dados_empresa():
+    return obter(DadosEmpresa)
+
+
+def obter_configuracao(criar=False):
+    return obter(Configuracao, criar)
+
+
+def obter_backup_config():
+    return obter(BackupConfig)
@@ -0,0 +1,79 @@
+// Ficheiro: stock/static/stock/js/autocomplete.js
+// Campo de texto com sugestões carregadas a pedido dos endpoints JSON (api/clientes/, api/produtos/),
+// em vez de meter todos os clientes e produtos no HTML da página.
+//
+// ligarAutocomplete(input, url, aoEscolher, formatar)
+//   aoEscolher(resultado) é chamado com o objeto escolhido, ou com null quando o texto é alterado à mão.
+//   formatar(resultado) devolve o texto de cada sugestão (por omissão, resultado.nome).
+function ligarAutocomplete(input, url, aoEscolher, formatar) {
+    const menu = document.createElement('div');
+    menu.className = 'dropdown-menu w-100';
+    menu.style.maxHeight = '320px';
+    menu.style.overflowY = 'auto';
+    input.parentNode.classList.add('position-relative');
+    input.setAttribute('autocomplete', 'off');
+    input.after(menu);
+
+    let temporizador = null;
+    let ultimoPedido = 0;
+
+    input.addEventListener('input', () => {
+        aoEscolher(null);
+        clearTimeout(temporizador);
+        temporizador = setTimeout(procurar, 200);
+    });
+    input.addEventListener('focus', procurar);
+    input.addEventListener('blur', () => setTimeout(() => menu.classList.remove('show'), 150));
+    input.addEventListener('keydown', (e) => {
+        if (!menu.classList.contains('show')) return;
+        const itens = Array.from(menu.querySelectorAll('button.dropdown-item'));
+        let atual = itens.findIndex(item => item.classList.contains('active'));
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            if (atual >= 0) itens[atual].classList.remove('active');
+            atual = e.key === 'ArrowDown' ? Math.min(atual + 1, itens.length - 1) : Math.max(atual - 1, 0);
+            if (itens[atual]) { itens[atual].classList.add('active'); itens[atual].scrollIntoView({block: 'nearest'}); }
+        } else if (e.key === 'Enter') {
+            e.preventDefault();
+            (itens[atual] || itens[0])?.click();
+        } else if (e.key === 'Escape') {
+            menu.classList.remove('show');
+        }
+    });
+
+    async function procurar() {
+        const pedido = ++ultimoPedido;
+        let dados;
+        try {
+            const resposta = await fetch(`${url}?q=${encodeURIComponent(input.value.trim())}`, {headers: {'Accept': 'application/json'}});
+            if (!resposta.ok) return;
+            dados = await resposta.json();
+        } catch (erro) {
+            return;
+        }
+        // Ignora respostas que chegam depois de uma pesquisa mais recente
+        if (pedido !== ultimoPedido) return;
+
+        menu.innerHTML = '';
+        dados.resultados.forEach(resultado => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'dropdown-item';
+            item.textContent = formatar ? formatar(resultado) : resultado.nome;
+            item.addEventListener('mousedown', e => e.preventDefault());
+            item.addEventListener('click', () => {
+                input.value = resultado.nome;
+                menu.classList.remove('show');
+                aoEscolher(resultado);
+            });
+            menu.appendChild(item);
+        });
+        if (!dados.resultados.length) {
+            const vazio = document.createElement('span');
+            vazio.className = 'dropdown-item-text text-muted';
+            vazio.textContent = input.dataset.semResultados || '—';
+            menu.appendChild(vazio);
+        }
+        menu.classList.add('show');
+    }
+}
@@ -0,0 +1,67 @@
+# Ficheiro: stock/tarefas_pdf.py
+# Pré-renderização dos PDFs em segundo plano. Os signals põem cada fatura/guia criada ou editada na
+# tabela TarefaPDF e o comando processar_pdfs renderiza-as num conjunto de processos, deixando o ficheiro
+# na cache de stock/pdf.py. As views continuam a usar obter_pdf(): se o PDF já estiver pronto é servido
+# logo, senão é renderizado no próprio pedido, como antes.
+# As tarefas concluídas ficam na tabela só durante PDF_TAREFAS_DIAS (por omissão 7) e depois são apagadas.
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Fatura, GuiaTransporte, TarefaPDF
+from .pdf import obter_pdf
+
+MAX_TENTATIVAS = 3
+MODELOS = {'fatura': Fatura, 'guia': GuiaTransporte}
+
+
+def enfileirar_pdf(tipo, objeto_id):
+    """Pede (ou volta a pedir) a renderização do PDF de um documento."""
+    TarefaPDF.objects.update_or_create(
+        tipo=tipo, objeto_id=objeto_id,
+        defaults={'estado': 'PENDENTE', 'pedido_em': timezone.now(), 'tentativas': 0, 'erro': ''},
+    )
+
+
+def reservar_tarefas(limite):
+    """Marca até `limite` tarefas pendentes como EM_CURSO e devolve-as (as mais antigas primeiro)."""
+    with transaction.atomic():
+        ids = list(TarefaPDF.objects.select_for_update().filter(estado='PENDENTE').order_by('pedido_em').values_list('id', flat=True)[:limite])
+        TarefaPDF.objects.filter(id__in=ids, estado='PENDENTE').update(estado='EM_CURSO', iniciado_em=timezone.now(), tentativas=F('tentativas') + 1)
+    return list(TarefaPDF.objects.filter(id__in=ids, estado='EM_CURSO'))
+
+
+def recuperar_tarefas_presas(minutos=30):
+    """Devolve à fila as tarefas EM_CURSO há demasiado tempo (o processo que as tinha morreu)."""
+    limite = timezone.now() - timedelta(minutes=minutos)
+    return TarefaPDF.objects.filter(estado='EM_CURSO', iniciado_em__lt=limite).update(estado='PENDENTE')
+
+
+def limpar_tarefas_concluidas(dias=None):
+    """Apaga as tarefas concluídas há mais de `dias` dias. Devolve quantas foram apagadas."""
+    if dias is None:
+        dias = getattr(settings, 'PDF_TAREFAS_DIAS', 7)
+    limite = timezone.now() - timedelta(days=dias)
+    return TarefaPDF.objects.filter(estado='CONCLUIDA', concluido_em__lt=limite).delete()[0]
+
+
+def renderizar(tipo, objeto_id):
+    """Corre num processo do pool: renderiza o PDF (se ainda não estiver na cache) e devolve o caminho do ficheiro."""
+    documento = MODELOS[tipo].objects.filter(pk=objeto_id).first()
+    if documento is None:
+        return None  # apagado entretanto
+    return str(obter_pdf(tipo, documento))
+
+
+def concluir_tarefa(tarefa):
+    # Se o documento foi editado durante a renderização (pedido_em mudou), a tarefa fica pendente
+    TarefaPDF.objects.filter(id=tarefa.id, estado='EM_CURSO', pedido_em=tarefa.pedido_em).update(estado='CONCLUIDA', concluido_em=timezone.now(), erro='')
+
+
+def falhar_tarefa(tarefa, erro):
+    estado = 'ERRO' if tarefa.tentativas >= MAX_TENTATIVAS else 'PENDENTE'
+    TarefaPDF.objects.filter(id=tarefa.id, estado='EM_CURSO', pedido_em=tarefa.pedido_em).update(estado=estado, erro=str(erro)[:2000])
+
@@ -4,12 +4,28 @@ from django import template
 
 register = template.Library()
 
+
 @register.simple_tag
-def url_params_minus_page(request_get):
+def url_params_minus_page(request_get, *remover):
     """
     Retorna os parâmetros da URL (Query String) do request.GET,
-    mas remove o parâmetro 'page' para evitar duplicação na paginação.
+    mas remove o parâmetro 'page' (e os cursores 'apos'/'antes') para evitar duplicação na paginação.
+    Parâmetros extra a remover podem ser passados a seguir, ex.: {% url_params_minus_page request.GET 'paginacao' %}
+    """
+    params = request_get.copy()
+    for chave in ('page', 'apos', 'antes') + remover:
+        params.pop(chave, None)  # Remove a chave de forma segura
+    return params.urlencode()
+
+
+@register.simple_tag
+def url_ordenar(request_get, campo):
+    """
+    Parâmetros atuais com 'ordenar' apontado para o campo indicado (invertendo a direção
+    se a lista já estiver ordenada por ele), sem 'page' para voltar à primeira página.
     """
     params = request_get.copy()
-    params.pop('page', None)  # Remove a chave 'page' de forma segura
-    return params.urlencode()
\ No newline at end of file
+    for chave in ('page', 'apos', 'antes'):
+        params.pop(chave, None)
+    params['ordenar'] = f'-{campo}' if params.get('ordenar') == campo else campo
+    return params.urlencode()
@@ -1,3 +1,1204 @@
-from django.test import TestCase
+import calendar
+import io
+import json
+import pathlib
+import random
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import Group, Permission, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.signals import post_delete
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+
+from . import pdf, singletons
+from .agendador import TAREFAS, executar, passagem, proxima_backup, reservar, seguinte, sincronizar
+from .backup import (
+    PAGINAS_POR_PASSO, TAMANHO_BLOCO, _blocos_por_linhas, _copiar_base_dados, _registar_progresso, correr_backup_reservado,
+    criar_backup, limpar_backups, listar_backups, marcar_enviado, reservar_backup, restaurar_backup,
+)
+from .dashboard import CHAVE_VERSAO, blocos_dashboard, resumo_faturas, serie_faturacao, top_clientes, top_produtos
+from .emails import ESPERA_INICIAL, MAX_TENTATIVAS as MAX_TENTATIVAS_EMAIL, enfileirar_email_fatura, enfileirar_email_guia, enviar_pendentes, recuperar_envios_presos
+from .estoque import EstoqueInsuficiente, definir_estoque, fotografar_saldos, movimentar_estoque, saldo_em
+from .exportacao_dados import ImportacaoErro, exportar_dados, importar_dados
+from .models import BackupConfig, Cliente, Configuracao, DadosEmpresa, EntradaPesquisa, EnvioEmail, ExecucaoTarefa, Fatura, GuiaTransporte, ItemFatura, MovimentoEstoque, Produto, SaldoEstoque, SequenciaDocumento, TarefaAgendada, TarefaPDF, VendaDiaria
+from .paginacao import _codificar_cursor, paginar_keyset
+from .pdf import renderizar_html
+from .pesquisa import indexar, pesquisar
+from .produtos import validar_alteracoes
+from .singletons import invalidar, invalidar_todos, obter_backup_config, obter_configuracao, obter_dados_empresa
+from .tarefas_pdf import (
+    MAX_TENTATIVAS, concluir_tarefa, enfileirar_pdf, falhar_tarefa, limpar_tarefas_concluidas, recuperar_tarefas_presas, reservar_tarefas,
+)
+from .vendas_diarias import reconstruir_vendas_diarias
+from .templatetags.stock_tags import url_ordenar
+from .views import LIMITE_AUTOCOMPLETE, ORDENACOES_FATURAS, filtrar_faturas
+
+
+class RecalcularTotaisTests(TestCase):
+    """O comando recalcular_totais_faturas volta a preencher as colunas de totais a partir dos itens."""
+
+    def setUp(self):
+        fatura = Fatura.objects.create(cliente=Cliente.objects.create(nome='Cliente Totais'), numero_fatura='2025-0001', desconto=Decimal('5.00'))
+        produto = Produto.objects.create(nome='Gravilha', preco_por_unidade=Decimal('10.00'), estoque_atual=Decimal('100.00'))
+        ItemFatura.objects.create(fatura=fatura, produto=produto, quantidade=Decimal('2.00'), preco_unitario=Decimal('10.00'))
+        fatura.recalcular_totais()
+        self.esperado = Fatura.objects.values_list(*Fatura.CAMPOS_TOTAIS).get()
+        Fatura.objects.update(subtotal=0, valor_desconto=0, valor_igv=0, total_geral=0, valor_a_pagar=0)
+
+    def test_verificar_nao_grava(self):
+        with self.assertRaises(CommandError):
+            call_command('recalcular_totais_faturas', '--verificar', stdout=io.StringIO())
+        self.assertEqual(Fatura.objects.get().valor_a_pagar, Decimal('0.00'))
+
+    def test_corrige_os_totais(self):
+        # O update() acima não passou pelos sinais: a entrada de pesquisa fica com o valor desatualizado
+        indexar('fatura', Fatura.objects.select_related('cliente'))
+        with mock.patch('stock.management.commands.recalcular_totais_faturas.invalidar_dashboard') as invalidar:
+            call_command('recalcular_totais_faturas', stdout=io.StringIO())
+        invalidar.assert_called_once_with()
+        self.assertEqual(Fatura.objects.values_list(*Fatura.CAMPOS_TOTAIS).get(), self.esperado)
+        self.assertEqual(self.esperado, (Decimal('20.00'), Decimal('1.00'), Decimal('3.23'), Decimal('22.23'), Decimal('22.23')))
+        self.assertIn('22.23 CFA', EntradaPesquisa.objects.get(tipo='fatura').subtitulo)
+        call_command('recalcular_totais_faturas', '--verificar', stdout=io.StringIO())
+
+
+class SequenciaDocumentoTests(TestCase):
+
+    def test_numeros_seguidos_e_novo_ano_recomeca(self):
+        numeros = [SequenciaDocumento.proximo_numero('FATURA', 2025) for _vez in range(3)]
+        self.assertEqual(numeros, ['2025-0001', '2025-0002', '2025-0003'])
+        self.assertEqual(SequenciaDocumento.proximo_numero('GUIA', 2025), '2025-0001')
+        self.assertEqual(SequenciaDocumento.proximo_numero('FATURA', 2026), '2026-0001')
+        self.assertEqual(SequenciaDocumento.proximo_numero('FATURA', 2025), '2025-0004')
+
+    def test_continua_a_partir_dos_documentos_existentes(self):
+        cliente = Cliente.objects.create(nome='Cliente Numeração')
+        for numero in ('2025-0007', '2025-0012', '2024-0090', 'manual'):
+            Fatura.objects.create(cliente=cliente, numero_fatura=numero)
+        self.assertEqual(SequenciaDocumento.proximo_numero('FATURA', 2025), '2025-0013')
+        # Depois de apagar as últimas, o reinício volta ao maior número que ficou
+        Fatura.objects.filter(numero_fatura__in=['2025-0012', '2025-0013']).delete()
+        SequenciaDocumento.reiniciar('FATURA', 2025)
+        self.assertEqual(SequenciaDocumento.proximo_numero('FATURA', 2025), '2025-0008')
+
+    def test_transacao_falhada_nao_gasta_o_numero(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            SequenciaDocumento.proximo_numero('FATURA', 2025)
+            raise RuntimeError
+        self.assertEqual(SequenciaDocumento.proximo_numero('FATURA', 2025), '2025-0001')
+
+
+class ItensFaturaTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        self.cliente = Cliente.objects.create(nome='Cliente Itens')
+        self.produto = Produto.objects.create(nome='Tout-venant', preco_por_unidade=Decimal('8.00'), estoque_atual=Decimal('50.00'))
+
+    def item(self, quantidade, preco='8.00', produto=None):
+        return json.dumps({'produto_id': (produto or self.produto).id, 'quantidade': quantidade, 'preco_unitario': preco})
+
+    def test_quantidade_ou_preco_invalidos_sao_recusados(self):
+        for quantidade, preco in (('-5', '8.00'), ('0', '8.00'), ('NaN', '8.00'), ('5', '-1'), ('5', 'Infinity')):
+            with self.subTest(quantidade=quantidade, preco=preco):
+                self.client.post('/faturas/nova/', {'cliente': self.cliente.id, 'items[]': [self.item(quantidade, preco)]})
+                self.assertFalse(Fatura.objects.exists())
+                self.assertEqual(Produto.objects.get().estoque_atual, Decimal('50.00'))
+                self.assertFalse(MovimentoEstoque.objects.exists())
+
+    def test_linhas_do_mesmo_produto_somadas_antes_da_validacao(self):
+        # 30 + 30 cabem cada uma no estoque, mas juntas não
+        self.client.post('/faturas/nova/', {'cliente': self.cliente.id, 'items[]': [self.item('30'), self.item('30')]})
+        self.assertFalse(Fatura.objects.exists())
+        self.assertEqual(Produto.objects.get().estoque_atual, Decimal('50.00'))
+        self.client.post('/faturas/nova/', {'cliente': self.cliente.id, 'items[]': [self.item('20'), self.item('25')]})
+        self.assertEqual(Fatura.objects.get().itens.count(), 2)
+        self.assertEqual(Produto.objects.get().estoque_atual, Decimal('5.00'))
+
+    def test_edicao_aplica_so_a_diferenca(self):
+        brita = Produto.objects.create(nome='Brita', preco_por_unidade=Decimal('12.00'), estoque_atual=Decimal('40.00'))
+        areia = Produto.objects.create(nome='Areia', preco_por_unidade=Decimal('6.00'), estoque_atual=Decimal('30.00'))
+        self.client.post('/faturas/nova/', {'cliente': self.cliente.id, 'items[]': [self.item('10', produto=self.produto), self.item('5', '12.00', brita)]})
+        fatura = Fatura.objects.get()
+        linha_igual = fatura.itens.get(produto=self.produto)
+        self.assertEqual(MovimentoEstoque.objects.filter(tipo='SAIDA_FATURA').count(), 2)
+
+        # Mesma linha do tout-venant, menos brita, areia nova
+        itens = [self.item('10', produto=self.produto), self.item('3', '12.00', brita), self.item('2', '6.00', areia)]
+        self.client.post(f'/faturas/{fatura.id}/editar/', {'cliente': self.cliente.id, 'items[]': itens})
+        estoques = dict(Produto.objects.values_list('nome', 'estoque_atual'))
+        self.assertEqual(estoques, {'Tout-venant': Decimal('40.00'), 'Brita': Decimal('37.00'), 'Areia': Decimal('28.00')})
+        ajustes = dict(MovimentoEstoque.objects.filter(tipo='AJUSTE_EDICAO').values_list('produto__nome', 'quantidade'))
+        self.assertEqual(ajustes, {'Brita': Decimal('2.00'), 'Areia': Decimal('-2.00')})
+        self.assertTrue(fatura.itens.filter(pk=linha_igual.pk, quantidade=Decimal('10.00')).exists())
+        self.assertEqual(Fatura.objects.get().subtotal, Decimal('128.00'))
+
+        # Tirar a brita devolve-a toda; gravar outra vez sem mudanças não escreve itens nem estoque
+        itens = [self.item('10', produto=self.produto), self.item('2', '6.00', areia)]
+        self.client.post(f'/faturas/{fatura.id}/editar/', {'cliente': self.cliente.id, 'items[]': itens})
+        self.assertEqual(Produto.objects.get(pk=brita.pk).estoque_atual, Decimal('40.00'))
+        self.assertEqual(fatura.itens.count(), 2)
+        self.assertEqual(MovimentoEstoque.objects.filter(tipo='AJUSTE_EDICAO').count(), 3)
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(f'/faturas/{fatura.id}/editar/', {'cliente': self.cliente.id, 'items[]': itens})
+        escritas = [q['sql'] for q in consultas if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) and any(t in q['sql'] for t in ('stock_itemfatura', 'stock_produto', 'stock_movimentoestoque'))]
+        self.assertEqual(escritas, [])
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN é específico do SQLite")
+class IndicesConsultasTests(TestCase):
+    """Confirma com EXPLAIN QUERY PLAN que as consultas das listas e do dashboard usam os índices da migração 0007."""
+
+    def plano(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' | '.join(linha[-1] for linha in cursor.fetchall())
+
+    def plano_queryset(self, queryset):
+        return self.plano(*queryset.query.get_compiler(connection=connection).as_sql())
+
+    def assertUsaIndice(self, queryset, indice):
+        plano = self.plano_queryset(queryset)
+        self.assertIn(indice, plano)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plano)
+
+    def test_lista_faturas_ordenada_por_data(self):
+        self.assertUsaIndice(Fatura.objects.order_by('-data_emissao', '-numero_fatura', '-id')[:16], 'fatura_data_idx')
+
+    def test_faturas_por_periodo(self):
+        self.assertIn('fatura_data_idx (data_emissao>? AND data_emissao<?)', self.plano_queryset(Fatura.objects.filter(data_emissao__year=2025)))
+        mes_atual = filtrar_faturas(Fatura.objects.all(), {'q_periodo': 'mes_atual'})
+        self.assertIn('fatura_data_idx (data_emissao>? AND data_emissao<?)', self.plano_queryset(mes_atual))
+
+    def test_faturas_por_estado(self):
+        self.assertUsaIndice(Fatura.objects.filter(paga=False).order_by('-data_emissao', '-numero_fatura', '-id')[:16], 'fatura_por_pagar_idx')
+        # O que o MySQL recebe (paga = False, sem índices parciais) usa o índice composto
+        sql = 'SELECT id FROM stock_fatura WHERE paga = %s ORDER BY data_emissao DESC, numero_fatura DESC, id DESC LIMIT 16'
+        plano = self.plano(sql, (False,))
+        self.assertIn('fatura_paga_data_idx (paga=?)', plano)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plano)
+
+    def test_faturas_do_cliente_num_periodo(self):
+        plano = self.plano_queryset(Fatura.objects.filter(cliente_id=1, data_emissao__gte=date(2025, 1, 1)))
+        self.assertIn('fatura_cliente_data_idx', plano)
+
+    def test_estoque_baixo(self):
+        self.assertUsaIndice(Produto.objects.filter(estoque_atual__lte=50).order_by('estoque_atual'), 'produto_estoque_idx')
+
+    def test_listas_por_nome(self):
+        self.assertUsaIndice(Cliente.objects.order_by('nome', 'id')[:16], 'cliente_nome_idx')
+        self.assertUsaIndice(Produto.objects.order_by('nome', 'id')[:16], 'produto_nome_idx')
+
+    def test_lista_guias(self):
+        self.assertUsaIndice(GuiaTransporte.objects.order_by('-data_emissao', '-numero_guia', '-id')[:16], 'guia_data_idx')
+
+    def test_paginas_das_listas_sem_varrimento_completo(self):
+        utilizador = User.objects.create_user('teste', password='teste')
+        self.client.force_login(utilizador)
+        for url in ('/faturas/', '/faturas/?q_paga=nao', '/faturas/?paginacao=cursor', '/clientes/', '/produtos/'):
+            with CaptureQueriesContext(connection) as contexto:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            for query in contexto.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or 'django_session' in sql or 'auth_user' in sql:
+                    continue
+                # Os parâmetros já vêm interpolados em captured_queries, por isso o SQL corre tal como está
+                plano = self.plano(sql)
+                with self.subTest(url=url, sql=sql):
+                    self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plano)
+                    self.assertNotRegex(plano, r'SCAN stock_(fatura|cliente|produto)( |$)(?!USING)')
+
+
+@skipUnless(connection.vendor == 'sqlite', "A cópia online só existe em SQLite")
+class CopiaBaseDadosTests(TestCase):
+    """A cópia online em passos tem de terminar com o progresso real a ser gravado pelo caminho."""
+
+    def setUp(self):
+        self.pasta = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.pasta)
+        self.config = BackupConfig.objects.create(recipient_email='backup@exemplo.pt')
+        # Ficheiro próprio com várias vezes PAGINAS_POR_PASSO páginas (a base de dados de teste está em memória)
+        self.origem = self.pasta / 'origem.sqlite3'
+        with sqlite3.connect(self.origem) as ligacao:
+            ligacao.execute(f'CREATE TABLE "{BackupConfig._meta.db_table}" (id integer PRIMARY KEY, backup_progress integer)')
+            ligacao.execute(f'INSERT INTO "{BackupConfig._meta.db_table}" VALUES (?, 0)', (self.config.pk,))
+            ligacao.execute('CREATE TABLE enchimento (texto text)')
+            ligacao.executemany('INSERT INTO enchimento VALUES (?)', [('x' * 1000,)] * 6000)
+            self.paginas = ligacao.execute('PRAGMA page_count').fetchone()[0]
+        ligacao.close()
+        self.assertGreater(self.paginas, 4 * PAGINAS_POR_PASSO)
+
+    def copiar(self, progresso):
+        destino = self.pasta / 'copia'
+        destino.mkdir()
+        with mock.patch.dict(settings.DATABASES['default'], NAME=str(self.origem)):
+            caminho = _copiar_base_dados(destino, progresso)
+        with sqlite3.connect(caminho) as copia:
+            self.assertGreaterEqual(copia.execute('SELECT count(*) FROM enchimento').fetchone()[0], 6000)
+        copia.close()
+
+    def progresso_gravado(self):
+        with sqlite3.connect(self.origem) as ligacao:
+            valor = ligacao.execute(f'SELECT backup_progress FROM "{BackupConfig._meta.db_table}"').fetchone()[0]
+        ligacao.close()
+        return valor
+
+    def test_progresso_real_nao_recomeca_a_copia(self):
+        passos = []
+        registar = _registar_progresso(self.config)
+        self.copiar(lambda percentagem: passos.append(percentagem) or registar(percentagem))
+        # Um passo por cada PAGINAS_POR_PASSO páginas: nenhuma escrita de progresso fez a cópia recomeçar
+        self.assertLessEqual(len(passos), self.paginas // PAGINAS_POR_PASSO + 1)
+        self.assertEqual(passos, sorted(passos))
+        self.assertEqual(self.progresso_gravado(), 100)
+
+    def test_backup_e_restauro_da_copia_em_passos(self):
+        repositorio, destino = self.pasta / 'backups', self.pasta / 'restauro'
+        with mock.patch.dict(settings.DATABASES['default'], NAME=str(self.origem)), self.settings(MEDIA_ROOT=str(self.pasta / 'media')):
+            manifesto = criar_backup(repositorio)
+        restaurar_backup(manifesto['nome'], destino, repositorio)
+        with sqlite3.connect(self.origem) as origem, sqlite3.connect(destino / 'db.sqlite3') as restaurada:
+            self.assertEqual(restaurada.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+            self.assertEqual(list(restaurada.iterdump()), list(origem.iterdump()))
+        origem.close()
+        restaurada.close()
+
+    def test_escritas_concorrentes_acabam_numa_copia_unica(self):
+        outra = sqlite3.connect(self.origem)
+        self.addCleanup(outra.close)
+        passos = []
+        def escrever(percentagem):
+            passos.append(percentagem)
+            with outra:
+                outra.execute('INSERT INTO enchimento VALUES (?)', ('y',))
+        self.copiar(escrever)
+        self.assertLess(len(passos), 100)
+
+
+class ExportacaoDadosTests(TestCase):
+    """Exportar e voltar a importar tem de devolver exatamente os mesmos dados."""
+
+    def setUp(self):
+        self.utilizador = User.objects.create_user('vendas', password='x')
+        grupo = Group.objects.create(name='Vendas')
+        grupo.permissions.set(Permission.objects.filter(codename__in=['add_fatura', 'change_fatura']))
+        self.utilizador.groups.add(grupo)
+        self.utilizador.user_permissions.set(Permission.objects.filter(codename='view_produto'))
+        User.objects.filter(pk=self.utilizador.pk).update(last_login=datetime(2025, 7, 1, 10, 30, 15, 123456, tzinfo=dt_timezone.utc))
+        cliente = Cliente.objects.create(nome='Cliente Exportação')
+        produto = Produto.objects.create(nome='Brita 0/15', preco_por_unidade=Decimal('12.50'), estoque_atual=Decimal('100.00'))
+        fatura = Fatura.objects.create(cliente=cliente, numero_fatura='2025-0001', data_emissao=date(2025, 7, 1))
+        ItemFatura.objects.create(fatura=fatura, produto=produto, quantidade=Decimal('3.00'), preco_unitario=Decimal('12.50'))
+        fatura.recalcular_totais()
+
+    def exportar(self):
+        saida = io.StringIO()
+        exportar_dados(saida)
+        return saida.getvalue()
+
+    def test_ida_e_volta_sem_perdas(self):
+        exportado = self.exportar()
+        importar_dados(io.StringIO(exportado), substituir=True)
+        self.assertEqual(self.exportar(), exportado)
+        utilizador = User.objects.get(username='vendas')
+        self.assertEqual(utilizador.last_login.microsecond, 123456)
+        self.assertEqual(list(utilizador.groups.values_list('name', flat=True)), ['Vendas'])
+        self.assertTrue(utilizador.has_perm('stock.change_fatura'))
+        self.assertTrue(utilizador.has_perm('stock.view_produto'))
+        # As tabelas derivadas são refeitas
+        self.assertEqual(VendaDiaria.objects.get().valor_liquido, Fatura.objects.get().subtotal)
+
+    def test_permissoes_com_outros_ids(self):
+        exportado = self.exportar()
+        # Noutra base de dados as permissões podem ter outros ids: vão pelo [app, codename]
+        permissao = Permission.objects.get(codename='view_produto')
+        Permission.objects.filter(pk=permissao.pk).update(id=permissao.pk + 10000)
+        importar_dados(io.StringIO(exportado), substituir=True)
+        self.assertTrue(User.objects.get(username='vendas').user_permissions.filter(pk=permissao.pk + 10000).exists())
+
+    def test_destino_com_dados_e_recusado(self):
+        with self.assertRaises(ImportacaoErro):
+            importar_dados(io.StringIO(self.exportar()))
+
+    def test_substituir_sem_sinais_por_registo(self):
+        exportado = self.exportar()
+        LogEntry.objects.create(user=self.utilizador, object_repr='x', action_flag=1)
+        apagados = []
+
+        def contar(sender, **kwargs):
+            apagados.append(sender)
+        post_delete.connect(contar)
+        try:
+            with mock.patch('stock.exportacao_dados.invalidar_dashboard') as invalidar, self.captureOnCommitCallbacks(execute=True):
+                importar_dados(io.StringIO(exportado), substituir=True)
+        finally:
+            post_delete.disconnect(contar)
+        self.assertEqual(apagados, [])
+        invalidar.assert_called_once_with()
+        self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(self.exportar(), exportado)
+        self.assertEqual([e.titulo for e in pesquisar('Brita')], ['Brita 0/15'])
+
+    def test_exportacao_logica_cortada_pelo_conteudo(self):
+        # Uma linha inserida no meio do NDJSON só muda o bloco em que fica, não os seguintes
+        linhas = [f'[{i},"Cliente {i}","Rua {i * 7}"]\n'.encode() for i in range(200000)]
+        antes = list(_blocos_por_linhas(io.BytesIO(b''.join(linhas))))
+        depois = list(_blocos_por_linhas(io.BytesIO(b''.join(linhas[:500] + [b'[0,"Novo"]\n'] + linhas[500:]))))
+        self.assertGreater(len(antes), 5)
+        self.assertLessEqual(len(set(depois) - set(antes)), 2)
+
+
+class AtualizacaoProdutosTests(TestCase):
+
+    def test_valores_nao_finitos_sao_recusados(self):
+        for valor in ('NaN', 'sNaN', 'Infinity', '-inf', float('nan')):
+            with self.subTest(valor=valor):
+                alteracoes, erros = validar_alteracoes([{'id': 1, 'preco_por_unidade': valor}])
+                self.assertEqual(alteracoes, {})
+                self.assertEqual(len(erros), 1)
+
+    def test_api_responde_400_a_nan(self):
+        produto = Produto.objects.create(nome='Areia', preco_por_unidade=Decimal('10.00'))
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        resposta = self.client.post('/api/produtos/atualizar/', {'produtos': [{'id': produto.id, 'preco_por_unidade': 'NaN'}]}, content_type='application/json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(Produto.objects.get().preco_por_unidade, Decimal('10.00'))
+
+
+class FiltrosFaturasTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+
+    def test_valores_nao_finitos_sao_ignorados(self):
+        for valor in ('NaN', 'Infinity', '-inf', '1e999999'):
+            for parametro in ('q_valor_min', 'q_valor_max'):
+                with self.subTest(parametro=parametro, valor=valor):
+                    self.assertEqual(self.client.get('/faturas/', {parametro: valor}).status_code, 200)
+                    # Sem faturas que correspondam, a exportação volta à lista com uma mensagem
+                    resposta = self.client.get('/faturas/exportar-pdf/', {parametro: valor, 'q_numero': 'nenhuma'})
+                    self.assertEqual(resposta.status_code, 302)
+
+    def test_mes_atual(self):
+        cliente = Cliente.objects.create(nome='Cliente Mês')
+        inicio = date(2025, 12, 1)
+        for numero, dia in (('antes', date(2025, 11, 30)), ('primeiro', inicio), ('ultimo', date(2025, 12, 31)), ('depois', date(2026, 1, 1))):
+            Fatura.objects.create(cliente=cliente, numero_fatura=numero, data_emissao=dia)
+        with mock.patch('stock.views.date', wraps=date) as data:
+            data.today.return_value = date(2025, 12, 15)
+            faturas = filtrar_faturas(Fatura.objects.all(), {'q_periodo': 'mes_atual'})
+            self.assertEqual(sorted(faturas.values_list('numero_fatura', flat=True)), ['primeiro', 'ultimo'])
+
+
+class PaginacaoKeysetTests(TestCase):
+    """Percorrer a lista por cursores, para a frente e para trás, dá as mesmas páginas que o OFFSET."""
+
+    def setUp(self):
+        clientes = [Cliente.objects.create(nome=nome) for nome in ('Alfa', 'Beta', 'Gama')]
+        for i in range(11):
+            Fatura.objects.create(cliente=clientes[i % 3], numero_fatura=f'2025-{i:04d}', data_emissao=date(2025, 1, 1 + i % 4), paga=i % 2 == 0)
+        # Valores repetidos, para os empates se resolverem pelas colunas seguintes
+        for fatura in Fatura.objects.all():
+            Fatura.objects.filter(pk=fatura.pk).update(valor_a_pagar=Decimal('10.50') * (fatura.pk % 3))
+
+    def test_para_a_frente_e_para_tras(self):
+        for chave, campos in ORDENACOES_FATURAS.items():
+            for prefixo in ('', '-'):
+                with self.subTest(ordenar=prefixo + chave):
+                    ordem = [prefixo + campo for campo in campos] + [prefixo + 'id']
+                    esperado = list(Fatura.objects.order_by(*ordem).values_list('pk', flat=True))
+                    paginas = [paginar_keyset(Fatura.objects.all(), ordem, por_pagina=3)]
+                    while paginas[-1].has_next():
+                        paginas.append(paginar_keyset(Fatura.objects.all(), ordem, apos=paginas[-1].cursor_seguinte, por_pagina=3))
+                    self.assertEqual([f.pk for pagina in paginas for f in pagina], esperado)
+                    # E de volta, a partir da última página, pelos cursores "antes"
+                    pagina, recuadas = paginas[-1], [[f.pk for f in paginas[-1]]]
+                    while pagina.has_previous():
+                        pagina = paginar_keyset(Fatura.objects.all(), ordem, antes=pagina.cursor_anterior, por_pagina=3)
+                        recuadas.insert(0, [f.pk for f in pagina])
+                    self.assertEqual([pk for pks in recuadas for pk in pks], esperado)
+
+    def test_cursor_alterado_volta_a_primeira_pagina(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        primeira = self.client.get('/faturas/', {'paginacao': 'cursor', 'ordenar': 'data'})
+        for valores in (['x', 'x', 'x'], [None, None, None], [{'a': 1}, 1, 1], ['2025-01-01', '2025-0001', 'x']):
+            cursor = _codificar_cursor(valores)
+            for direcao in ('apos', 'antes'):
+                with self.subTest(valores=valores, direcao=direcao):
+                    resposta = self.client.get('/faturas/', {'paginacao': 'cursor', 'ordenar': 'data', direcao: cursor})
+                    self.assertEqual(resposta.status_code, 200)
+                    self.assertEqual(list(resposta.context['page_obj']), list(primeira.context['page_obj']))
+
+    def cursor(self, fatura):
+        return _codificar_cursor([fatura.data_emissao, fatura.numero_fatura, fatura.pk])
+
+    def primeira_e_segunda(self):
+        ordem = ['-data_emissao', '-numero_fatura', '-id']
+        primeira = paginar_keyset(Fatura.objects.all(), ordem, por_pagina=3)
+        return ordem, primeira, paginar_keyset(Fatura.objects.all(), ordem, apos=primeira.cursor_seguinte, por_pagina=3)
+
+    def test_antes_da_segunda_pagina_e_a_primeira(self):
+        ordem, primeira, segunda = self.primeira_e_segunda()
+        pagina = paginar_keyset(Fatura.objects.all(), ordem, antes=segunda.cursor_anterior, por_pagina=3)
+        self.assertEqual(list(pagina), list(primeira))
+        self.assertFalse(pagina.has_previous())
+        self.assertEqual(pagina.cursor_seguinte, primeira.cursor_seguinte)
+
+    def test_pagina_vazia_ou_curta_volta_a_primeira(self):
+        ordem, primeira, segunda = self.primeira_e_segunda()
+        # Antes da primeira linha não há nada
+        pagina = paginar_keyset(Fatura.objects.all(), ordem, antes=self.cursor(primeira.object_list[0]), por_pagina=3)
+        self.assertEqual(list(pagina), list(primeira))
+        self.assertFalse(pagina.has_previous())
+        self.assertTrue(pagina.has_next())
+        # Uma linha apagada entretanto deixaria a página anterior com só duas
+        Fatura.objects.filter(pk=primeira.object_list[0].pk).delete()
+        pagina = paginar_keyset(Fatura.objects.all(), ordem, antes=segunda.cursor_anterior, por_pagina=3)
+        self.assertEqual(list(pagina), list(Fatura.objects.order_by(*ordem)[:3]))
+        self.assertFalse(pagina.has_previous())
+        # Depois da última linha
+        pagina = paginar_keyset(Fatura.objects.all(), ordem, apos=self.cursor(Fatura.objects.order_by(*ordem).last()), por_pagina=3)
+        self.assertEqual(list(pagina), list(Fatura.objects.order_by(*ordem)[:3]))
+
+    def test_links_nunca_apontam_para_none(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        for fatura in (Fatura.objects.order_by('-data_emissao', '-numero_fatura', '-id').first(), Fatura.objects.order_by('data_emissao', 'numero_fatura', 'id').first()):
+            for direcao in ('apos', 'antes'):
+                with self.subTest(fatura=fatura.numero_fatura, direcao=direcao):
+                    resposta = self.client.get('/faturas/', {'paginacao': 'cursor', 'ordenar': '-data', direcao: self.cursor(fatura)})
+                    self.assertEqual(resposta.status_code, 200)
+                    self.assertNotContains(resposta, '=None')
+
+
+class DownloadPDFTests(TestCase):
+
+    def test_pdf_apagado_antes_de_abrir_e_obtido_outra_vez(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        fatura = Fatura.objects.create(cliente=Cliente.objects.create(nome='Cliente PDF'), numero_fatura='2025-0001')
+        pasta = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, pasta)
+        novo = pasta / 'novo.pdf'
+        novo.write_bytes(b'%PDF-novo')
+        # Entre obter_pdf e o open, outro pedido apagou a versão em cache (apagar_pdfs)
+        with mock.patch('stock.pdf.obter_pdf', side_effect=[pasta / 'apagado.pdf', novo]) as obter:
+            resposta = self.client.get(f'/faturas/{fatura.id}/pdf/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(b''.join(resposta.streaming_content), b'%PDF-novo')
+        self.assertEqual(obter.call_count, 2)
+
+    def test_pdf_na_lingua_por_omissao(self):
+        fatura = Fatura.objects.create(cliente=Cliente.objects.create(nome='Cliente PDF'), numero_fatura='2025-0001')
+        with translation.override(settings.LANGUAGE_CODE):
+            esperado = renderizar_html('fatura', fatura)
+        for lingua, _nome in settings.LANGUAGES:
+            with self.subTest(lingua=lingua), translation.override(lingua):
+                # A mesma chave da cache que o processar_pdfs usou, e o pedido continua na sua língua
+                self.assertEqual(renderizar_html('fatura', fatura), esperado)
+                self.assertEqual(translation.get_language(), lingua)
+
+
+class ExportacaoPDFTests(TestCase):
+    """O ZIP com os PDFs sai em streaming, renderizado no próprio processo."""
+
+    def test_zip_com_faturas_guias_e_erros(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        cliente = Cliente.objects.create(nome='Cliente ZIP')
+        primeira = Fatura.objects.create(cliente=cliente, numero_fatura='2025-0001', data_emissao=date(2025, 7, 1))
+        Fatura.objects.create(cliente=cliente, numero_fatura='2025-0002', data_emissao=date(2025, 7, 2))
+        Fatura.objects.create(cliente=cliente, numero_fatura='2025-0003', data_emissao=date(2025, 7, 3))
+        GuiaTransporte.objects.create(fatura=primeira, numero_guia='2025-0001', morada_carga='Pedreira', morada_descarga='Obra')
+
+        def abrir(tipo, documento):
+            if tipo == 'fatura' and documento.numero_fatura == '2025-0003':
+                raise RuntimeError("falhou")
+            return io.BytesIO(f"%PDF-{tipo}-{documento.pk}".encode())
+
+        with mock.patch('stock.exportar_pdf.abrir_pdf', side_effect=abrir), \
+                mock.patch('concurrent.futures.ProcessPoolExecutor', side_effect=AssertionError("sem processos no pedido")):
+            resposta = self.client.get('/faturas/exportar-pdf/', {'q_cliente': 'Cliente ZIP'})
+            self.assertEqual(resposta['Content-Type'], 'application/zip')
+            partes = list(resposta.streaming_content)
+        self.assertGreater(len(partes), 3)
+        with zipfile.ZipFile(io.BytesIO(b''.join(partes))) as arquivo:
+            self.assertEqual(sorted(arquivo.namelist()), ['ERROS.txt', 'faturas/fatura_2025-0001.pdf', 'faturas/fatura_2025-0002.pdf', 'guias/guia_2025-0001.pdf'])
+            self.assertEqual(arquivo.read('faturas/fatura_2025-0001.pdf'), f"%PDF-fatura-{primeira.pk}".encode())
+            self.assertIn('fatura_2025-0003.pdf: falhou', arquivo.read('ERROS.txt').decode())
+
+
+class TarefasPDFTests(TestCase):
+    """A fila TarefaPDF: pedido ao gravar, reserva pelos processos e os estados de cada tarefa."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fatura = Fatura.objects.create(cliente=Cliente.objects.create(nome='Cliente Fila'), numero_fatura='2025-0001')
+            self.guia = GuiaTransporte.objects.create(fatura=self.fatura, numero_guia='2025-0001', morada_carga='Pedreira', morada_descarga='Obra')
+
+    def test_gravar_poe_na_fila(self):
+        self.assertEqual(set(TarefaPDF.objects.values_list('tipo', 'objeto_id', 'estado')), {('fatura', self.fatura.pk, 'PENDENTE'), ('guia', self.guia.pk, 'PENDENTE')})
+        TarefaPDF.objects.update(estado='CONCLUIDA', tentativas=2)
+        # Editar a fatura volta a pedir o PDF dela e o da guia, que mostra os dados da fatura
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fatura.save()
+        self.assertEqual(TarefaPDF.objects.count(), 2)
+        self.assertEqual(set(TarefaPDF.objects.values_list('estado', 'tentativas')), {('PENDENTE', 0)})
+        self.fatura.delete()
+        self.assertFalse(TarefaPDF.objects.exists())
+
+    def test_reserva_as_mais_antigas_uma_vez(self):
+        TarefaPDF.objects.filter(tipo='guia').update(pedido_em=timezone.now() - timedelta(minutes=5))
+        primeira, = reservar_tarefas(1)
+        self.assertEqual((primeira.tipo, primeira.estado, primeira.tentativas), ('guia', 'EM_CURSO', 1))
+        segunda, = reservar_tarefas(5)
+        self.assertEqual(segunda.tipo, 'fatura')
+        self.assertEqual(reservar_tarefas(5), [])
+
+    def test_concluir_e_falhar(self):
+        tarefa, outra = reservar_tarefas(2)
+        concluir_tarefa(tarefa)
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.estado, 'CONCLUIDA')
+        self.assertIsNotNone(tarefa.concluido_em)
+        # Pedido outra vez durante a renderização: o PDF feito já está desatualizado, fica pendente
+        enfileirar_pdf(outra.tipo, outra.objeto_id)
+        concluir_tarefa(outra)
+        self.assertEqual(TarefaPDF.objects.get(pk=outra.pk).estado, 'PENDENTE')
+        for tentativa in range(1, MAX_TENTATIVAS + 1):
+            outra, = reservar_tarefas(1)
+            self.assertEqual(outra.tentativas, tentativa)
+            falhar_tarefa(outra, RuntimeError("falhou"))
+        outra.refresh_from_db()
+        self.assertEqual((outra.estado, outra.erro), ('ERRO', 'falhou'))
+
+    def test_recuperar_presas_e_limpar_concluidas(self):
+        tarefa, outra = reservar_tarefas(2)
+        TarefaPDF.objects.filter(pk=tarefa.pk).update(iniciado_em=timezone.now() - timedelta(hours=1))
+        self.assertEqual(recuperar_tarefas_presas(), 1)
+        self.assertEqual(TarefaPDF.objects.get(pk=tarefa.pk).estado, 'PENDENTE')
+        concluir_tarefa(outra)
+        self.assertEqual(limpar_tarefas_concluidas(dias=7), 0)
+        TarefaPDF.objects.filter(pk=outra.pk).update(concluido_em=timezone.now() - timedelta(days=8))
+        self.assertEqual(limpar_tarefas_concluidas(dias=7), 1)
+        self.assertEqual(list(TarefaPDF.objects.values_list('pk', flat=True)), [tarefa.pk])
+
+
+class RecursosPDFTests(TestCase):
+    """Estilos, fontes e logotipo são preparados uma vez por processo e partilhados pelas renderizações."""
+
+    def setUp(self):
+        for funcao in (pdf._css, pdf._fontes, pdf._estilos):
+            funcao.cache_clear()
+            self.addCleanup(funcao.cache_clear)
+        pdf.esquecer_logo()
+        self.addCleanup(pdf.esquecer_logo)
+        pasta = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, pasta)
+        self.logo = pasta / 'logo.png'
+        self.logo.write_bytes(b'\x89PNG logotipo')
+
+    def test_duas_renderizacoes_carregam_tudo_uma_vez(self):
+        lidos = []
+
+        class HTMLFalso:
+            def __init__(self, string, base_url=None, url_fetcher=None):
+                self.url_fetcher = url_fetcher
+
+            def write_pdf(self, stylesheets=(), font_config=None):
+                lidos.append(self.url_fetcher(logo_uri)['string'])
+                return b'%PDF'
+
+        dados_empresa = SimpleNamespace(logotipo=SimpleNamespace(path=str(self.logo)))
+        logo_uri = self.logo.as_uri()
+        with mock.patch('stock.pdf.HTML', HTMLFalso), \
+                mock.patch('stock.pdf.CSS', create=True) as css, \
+                mock.patch('stock.pdf.FontConfiguration', create=True) as fontes, \
+                mock.patch('stock.pdf.default_url_fetcher', create=True) as buscar, \
+                mock.patch.object(pathlib.Path, 'read_text', autospec=True, side_effect=pathlib.Path.read_text) as ler_css, \
+                mock.patch.object(pathlib.Path, 'read_bytes', autospec=True, side_effect=pathlib.Path.read_bytes) as ler_logo:
+            for _vez in range(2):
+                pdf.escrever_pdf('fatura', '<html></html>', dados_empresa)
+        self.assertEqual(lidos, [b'\x89PNG logotipo'] * 2)
+        self.assertEqual(css.call_count, 1)
+        self.assertEqual(fontes.call_count, 1)
+        self.assertEqual(ler_css.call_count, 1)
+        self.assertEqual(ler_logo.call_count, 1)
+        buscar.assert_not_called()
+
+
+def _antigo_top_clientes(hoje):
+    # Cálculo do dashboard antes da tabela VendaDiaria, sobre os itens das faturas
+    desde = hoje - timedelta(days=30)
+    return [(c.nome, c.total_gasto) for c in Cliente.objects.annotate(total_gasto=Sum(F('fatura__itens__quantidade') * F('fatura__itens__preco_unitario'), filter=Q(fatura__data_emissao__gte=desde))).order_by('-total_gasto').filter(total_gasto__gt=0)[:10]]
+
+
+def _antigo_top_produtos(hoje):
+    desde = hoje - timedelta(days=30)
+    return [(p.nome, p.total_vendido) for p in Produto.objects.annotate(total_vendido=Sum(F('itemfatura__quantidade') * F('itemfatura__preco_unitario'), filter=Q(itemfatura__fatura__data_emissao__gte=desde))).order_by('-total_vendido').filter(total_vendido__gt=0)[:10]]
+
+
+class VendasDiariasTests(TestCase):
+    """A tabela VendaDiaria, mantida pelas views, dá os mesmos tops que a soma dos itens."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        self.alfa, self.beta = Cliente.objects.create(nome='Alfa'), Cliente.objects.create(nome='Beta')
+        self.brita = Produto.objects.create(nome='Brita', preco_por_unidade=Decimal('10.33'), estoque_atual=Decimal('1000.00'))
+        self.areia = Produto.objects.create(nome='Areia', preco_por_unidade=Decimal('7.77'), estoque_atual=Decimal('1000.00'))
+
+    def criar(self, cliente, *itens, desconto='3.50'):
+        self.client.post('/faturas/nova/', {'cliente': cliente.pk, 'taxa_igv': '17.00', 'desconto': desconto, 'items[]': [self.item(*item) for item in itens]})
+        return Fatura.objects.latest('id')
+
+    def item(self, produto, quantidade, preco):
+        return json.dumps({'produto_id': produto.pk, 'quantidade': quantidade, 'preco_unitario': preco})
+
+    def verificar(self):
+        hoje = date.today()
+        self.assertEqual([(c['nome'], c['total_gasto']) for c in top_clientes(hoje)], _antigo_top_clientes(hoje))
+        self.assertEqual([(p['nome'], p['total_vendido']) for p in top_produtos(hoje)], _antigo_top_produtos(hoje))
+        # O que as views mantêm é igual a voltar a agregar tudo
+        campos = ('data', 'produto_id', 'cliente_id', 'paga', 'quantidade', 'valor_bruto', 'valor_liquido', 'valor_igv', 'total')
+        incremental = sorted(VendaDiaria.objects.values_list(*campos))
+        reconstruir_vendas_diarias()
+        self.assertEqual(incremental, sorted(VendaDiaria.objects.values_list(*campos)))
+
+    def test_criar_editar_e_apagar(self):
+        primeira = self.criar(self.alfa, (self.brita, '1.50', '10.33'), (self.areia, '2.25', '7.77'))
+        self.criar(self.beta, (self.brita, '3.00', '10.33'))
+        self.criar(self.alfa, (self.areia, '1.00', '7.77'), desconto='0.00')
+        self.verificar()
+        # Editar muda o cliente e os itens: as linhas do cliente antigo também têm de ser refeitas
+        self.client.post(f'/faturas/{primeira.pk}/editar/', {'cliente': self.beta.pk, 'taxa_igv': '17.00', 'desconto': '5.00', 'items[]': [self.item(self.brita, '9.99', '11.11')]})
+        self.assertEqual(Fatura.objects.get(pk=primeira.pk).cliente, self.beta)
+        self.verificar()
+        self.client.post(f'/faturas/{primeira.pk}/toggle_paga/')
+        self.verificar()
+        self.client.post(f'/admin/stock/fatura/{primeira.pk}/delete/', {'post': 'yes'})
+        self.assertFalse(Fatura.objects.filter(pk=primeira.pk).exists())
+        self.verificar()
+
+    def test_grafico_igual_a_soma_das_faturas(self):
+        for i in range(6):
+            self.criar(self.alfa if i % 2 else self.beta, (self.brita, f'1.{i}5', '10.33'), (self.areia, '2.25', f'7.7{i}'))
+        hoje = date.today()
+        labels, dados = serie_faturacao('1m_daily', hoje=hoje)
+        antigo = [float(sum(f.total_geral for f in Fatura.objects.filter(data_emissao=date(hoje.year, hoje.month, int(dia))))) for dia in labels]
+        self.assertEqual(dados, antigo)
+
+
+class DashboardTests(TestCase):
+    """Os números do dashboard, calculados em SQL, são os mesmos que a soma fatura a fatura que se fazia antes."""
+
+    def setUp(self):
+        self.hoje = date(2025, 7, 15)
+        clientes = [Cliente.objects.create(nome=nome) for nome in ('Alfa', 'Beta')]
+        produto = Produto.objects.create(nome='Brita', preco_por_unidade=Decimal('10.33'), estoque_atual=Decimal('1000.00'))
+        for i in range(24):
+            fatura = Fatura.objects.create(cliente=clientes[i % 2], numero_fatura=f'2025-{i:04d}', data_emissao=date(2025, 2 + i % 6, 1 + i), paga=i % 3 == 0, desconto=Decimal('3.50'), adiantamento=Decimal(i))
+            ItemFatura.objects.create(fatura=fatura, produto=produto, quantidade=Decimal(f'1.{i:02d}'), preco_unitario=Decimal('10.33'))
+            fatura.recalcular_totais()
+
+    def antigo_grafico(self, periodo, status_fatura, start_date=None, end_date=None):
+        faturas = Fatura.objects.all()
+        if status_fatura == 'pagas':
+            faturas = faturas.filter(paga=True)
+        elif status_fatura == 'nao_pagas':
+            faturas = faturas.filter(paga=False)
+        if periodo == 'custom':
+            mes, meses = start_date.replace(day=1), []
+            while mes <= end_date:
+                meses.append(mes)
+                mes += relativedelta(months=1)
+        elif periodo == '1m_daily':
+            dias = calendar.monthrange(self.hoje.year, self.hoje.month)[1]
+            return [float(sum(f.total_geral for f in faturas.filter(data_emissao=self.hoje.replace(day=dia)))) for dia in range(1, dias + 1)]
+        else:
+            meses = [self.hoje - relativedelta(months=i) for i in reversed(range(3 if periodo == '3m' else 6))]
+        return [float(sum(f.total_geral for f in faturas.filter(data_emissao__year=mes.year, data_emissao__month=mes.month))) for mes in meses]
+
+    def test_cartoes(self):
+        faturas = Fatura.objects.all()
+        do_mes = faturas.filter(data_emissao__year=self.hoje.year, data_emissao__month=self.hoje.month)
+        antigo = {
+            'num_pagas': faturas.filter(paga=True).count(), 'total_recebido': sum(f.total_geral for f in faturas.filter(paga=True)),
+            'num_nao_pagas': faturas.filter(paga=False).count(), 'valor_em_divida': sum(f.valor_a_pagar for f in faturas.filter(paga=False)),
+            'num_faturas_mes': do_mes.count(), 'total_faturado_mes': sum(f.total_geral for f in do_mes),
+            'num_clientes': Cliente.objects.count(),
+        }
+        with self.assertNumQueries(2):
+            self.assertEqual(resumo_faturas(self.hoje), antigo)
+        self.assertGreater(antigo['num_faturas_mes'], 0)
+        # Sem faturas os totais são zero e não None
+        Fatura.objects.all().delete()
+        self.assertEqual(resumo_faturas(self.hoje)['total_recebido'], Decimal('0.00'))
+
+    def test_grafico(self):
+        for periodo, start_date, end_date in (('1m_daily', None, None), ('3m', None, None), ('6m', None, None), ('custom', date(2025, 1, 20), date(2025, 6, 2))):
+            for status_fatura in ('todas', 'pagas', 'nao_pagas'):
+                with self.subTest(periodo=periodo, status_fatura=status_fatura):
+                    _labels, dados = serie_faturacao(periodo, status_fatura, start_date, end_date, hoje=self.hoje)
+                    self.assertEqual(dados, self.antigo_grafico(periodo, status_fatura, start_date, end_date))
+        # Todos os meses do gráfico de 6 meses têm faturas, por isso a comparação não é entre zeros
+        self.assertTrue(all(self.antigo_grafico('6m', 'todas')))
+
+
+class ResultadoBackupTests(TestCase):
+    """A data do último backup só muda quando um backup é feito; depois de uma falha o agendador tenta outra vez."""
+
+    def setUp(self):
+        self.config = BackupConfig.objects.create(recipient_email='backup@exemplo.pt', schedule='DIARIO')
+
+    def correr(self, **kwargs):
+        reservar_backup(self.config)
+        with mock.patch('stock.backup.executar_backup', **kwargs):
+            try:
+                correr_backup_reservado(self.config)
+            except RuntimeError:
+                pass
+        return BackupConfig.objects.get()
+
+    def test_so_o_sucesso_conta(self):
+        config = self.correr(return_value={'nome': 'x'})
+        feito = config.last_backup_time
+        self.assertIsNotNone(feito)
+        config = self.correr(side_effect=RuntimeError("SMTP em baixo"))
+        self.assertEqual(config.last_backup_time, feito)
+        self.assertIn("SMTP em baixo", config.last_backup_status)
+        self.assertIsNone(config.backup_started_at)
+
+    def test_agendador_espera_antes_de_repetir(self):
+        agora = timezone.now()
+        BackupConfig.objects.update(last_backup_time=agora - timedelta(days=3))
+        sincronizar()
+        self.assertEqual(proxima_backup(time(2, 0), agora), seguinte(time(2, 0), agora - timedelta(days=3)))
+        # Uma tentativa do agendador depois do último backup feito falhou
+        TarefaAgendada.objects.filter(nome='backup').update(ultima_execucao=agora - timedelta(minutes=10))
+        self.assertEqual(proxima_backup(time(2, 0), agora), agora + timedelta(minutes=50))
+
+
+class BackupIncrementalTests(TestCase):
+    """Os blocos iguais são guardados uma vez, e só os últimos BACKUP_MANTER backups ficam no repositório."""
+
+    def setUp(self):
+        pasta = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, pasta)
+        self.repositorio, self.media = pasta / 'backups', pasta / 'media'
+        (self.media / 'logos').mkdir(parents=True)
+        (self.media / 'logos' / 'logo.png').write_bytes(b'\x89PNG logotipo')
+        self.base = bytearray(random.Random(0).randbytes(3 * TAMANHO_BLOCO))
+        copiar = mock.patch('stock.backup._copiar_base_dados', side_effect=self.copiar)
+        copiar.start()
+        self.addCleanup(copiar.stop)
+        definicoes = self.settings(MEDIA_ROOT=str(self.media))
+        definicoes.enable()
+        self.addCleanup(definicoes.disable)
+
+    def copiar(self, pasta, progresso):
+        destino = pasta / 'db.sqlite3'
+        destino.write_bytes(self.base)
+        return destino
+
+    def objetos(self):
+        return len(list((self.repositorio / 'objetos').glob('*/*.gz')))
+
+    def restaurar(self, nome):
+        destino = self.repositorio.parent / f'restauro-{nome}'
+        restaurar_backup(nome, destino, self.repositorio)
+        return (destino / 'db.sqlite3').read_bytes(), (destino / 'media' / 'logos' / 'logo.png').read_bytes()
+
+    def test_so_grava_os_blocos_que_mudaram(self):
+        primeiro = criar_backup(self.repositorio)
+        self.assertEqual(primeiro['blocos_novos'], 4)
+        self.assertEqual(criar_backup(self.repositorio)['blocos_novos'], 0)
+        self.base[TAMANHO_BLOCO + 10] ^= 0xFF
+        terceiro = criar_backup(self.repositorio)
+        self.assertEqual(terceiro['blocos_novos'], 1)
+        self.assertEqual(self.objetos(), 5)
+        self.assertEqual(terceiro['media'], primeiro['media'])
+        self.assertEqual(self.restaurar(terceiro['nome']), (bytes(self.base), b'\x89PNG logotipo'))
+        self.base[TAMANHO_BLOCO + 10] ^= 0xFF
+        self.assertEqual(self.restaurar(primeiro['nome']), (bytes(self.base), b'\x89PNG logotipo'))
+
+    def test_limpar_mantem_os_ultimos(self):
+        nomes = []
+        for posicao in (0, TAMANHO_BLOCO, 2 * TAMANHO_BLOCO):
+            self.base[posicao] ^= 0xFF
+            nomes.append(criar_backup(self.repositorio)['nome'])
+            marcar_enviado(nomes[-1], self.repositorio)
+        self.assertEqual(self.objetos(), 6)
+        # O primeiro backup é o único com a versão original do segundo bloco
+        self.assertEqual(limpar_backups(2, self.repositorio), (1, 1))
+        self.assertEqual(listar_backups(self.repositorio), nomes[1:])
+        self.assertEqual((self.repositorio / 'enviados.txt').read_text().split(), nomes[1:])
+        self.assertEqual(self.restaurar(nomes[-1])[0], bytes(self.base))
+        self.assertEqual(limpar_backups(2, self.repositorio), (0, 0))
+
+
+class OrdenacaoTests(TestCase):
+
+    def test_url_ordenar(self):
+        casos = [
+            ('', 'data', {'ordenar': ['data']}),
+            ('ordenar=data', 'data', {'ordenar': ['-data']}),
+            ('ordenar=-data', 'data', {'ordenar': ['data']}),
+            ('ordenar=data', 'cliente', {'ordenar': ['cliente']}),
+            # Os filtros ficam; a página e os cursores não (volta-se à primeira página)
+            ('q_cliente=Alfa&q_estado=pagas&ordenar=valor&page=3&paginacao=cursor&apos=abc&antes=def', 'valor',
+             {'q_cliente': ['Alfa'], 'q_estado': ['pagas'], 'ordenar': ['-valor'], 'paginacao': ['cursor']}),
+        ]
+        for atual, campo, esperado in casos:
+            with self.subTest(atual=atual, campo=campo):
+                self.assertEqual(dict(QueryDict(url_ordenar(QueryDict(atual), campo)).lists()), esperado)
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        for i in range(60):
+            Cliente.objects.create(nome=f'Construtora {i:02d}')
+            Produto.objects.create(nome=f'Brita {i:02d}', preco_por_unidade=Decimal('10.00'))
+        Cliente.objects.create(nome='Outra Construtora')
+        Produto.objects.create(nome='Areia Brita', preco_por_unidade=Decimal('8.00'))
+
+    def nomes(self, url, **params):
+        resposta = self.client.get(url, params)
+        self.assertEqual(resposta.status_code, 200)
+        return [r['nome'] for r in resposta.json()['resultados']]
+
+    def test_limite(self):
+        for url in ('/api/clientes/', '/api/produtos/'):
+            for limite, esperado in (('0', 1), ('7', 7), ('999', 50), ('abc', LIMITE_AUTOCOMPLETE), ('', LIMITE_AUTOCOMPLETE)):
+                with self.subTest(url=url, limite=limite):
+                    self.assertEqual(len(self.nomes(url, limite=limite)), esperado)
+            with self.subTest(url=url, limite=None):
+                self.assertEqual(len(self.nomes(url)), LIMITE_AUTOCOMPLETE)
+
+    def test_prefixo(self):
+        self.assertEqual(self.nomes('/api/clientes/', q=' construtora 0', limite=50), [f'Construtora {i:02d}' for i in range(10)])
+        self.assertEqual(self.nomes('/api/produtos/', q='brita 5', limite=50), [f'Brita {i:02d}' for i in range(50, 60)])
+        # Só no início do nome
+        self.assertNotIn('Outra Construtora', self.nomes('/api/clientes/', q='Construtora', limite=50))
+        self.assertEqual(self.nomes('/api/produtos/', q='areia'), ['Areia Brita'])
+
+    def test_login_e_so_get(self):
+        for url in ('/api/clientes/', '/api/produtos/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url, {'q': 'a'}).status_code, 405)
+                self.client.logout()
+                self.assertEqual(self.client.get(url, {'q': 'a'}).status_code, 302)
+                self.client.force_login(User.objects.get(username='teste'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'dashboard-testes'}})
+class CacheDashboardTests(TestCase):
+    """Os blocos do dashboard vêm da cache até uma escrita mudar a versão, e só depois do commit."""
+
+    def setUp(self):
+        cache.clear()
+        self.hoje = date.today()
+        self.cliente = Cliente.objects.create(nome='Cliente Cache')
+        self.produto = Produto.objects.create(nome='Brita', preco_por_unidade=Decimal('10.00'), estoque_atual=Decimal('5.00'))
+
+    def blocos(self):
+        return blocos_dashboard('1m_daily', 'todas', None, None, hoje=self.hoje)
+
+    def test_cache_ate_a_escrita(self):
+        self.assertEqual(self.blocos()['num_nao_pagas'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.blocos()['num_nao_pagas'], 0)
+        with self.captureOnCommitCallbacks() as depois_do_commit:
+            Fatura.objects.create(cliente=self.cliente, numero_fatura='2025-0001', data_emissao=self.hoje)
+            # Antes do commit continua a valer a versão antiga
+            self.assertEqual(self.blocos()['num_nao_pagas'], 0)
+        for funcao in depois_do_commit:
+            funcao()
+        self.assertEqual(self.blocos()['num_nao_pagas'], 1)
+
+    def test_produto_e_configuracao_invalidam(self):
+        self.assertEqual([p.nome for p in self.blocos()['produtos_estoque_baixo']], ['Brita'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.estoque_atual = Decimal('500.00')
+            self.produto.save()
+        self.assertEqual(self.blocos()['produtos_estoque_baixo'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Configuracao.objects.update_or_create(pk=1, defaults={'limite_alerta_estoque': 1000})
+        self.assertEqual([p.nome for p in self.blocos()['produtos_estoque_baixo']], ['Brita'])
+
+    def test_versao_perdida_nao_reutiliza_blocos_antigos(self):
+        self.blocos()
+        versao = cache.get(CHAVE_VERSAO)
+        cache.delete(CHAVE_VERSAO)
+        Fatura.objects.create(cliente=self.cliente, numero_fatura='2025-0001', data_emissao=self.hoje)
+        self.assertEqual(self.blocos()['num_nao_pagas'], 1)
+        self.assertGreater(cache.get(CHAVE_VERSAO), versao)
+
+
+class MovimentosEstoqueTests(TestCase):
+    """Cada alteração de estoque fica no kardex, e o saldo de um dia sai da fotografia mais os movimentos seguintes."""
+
+    def setUp(self):
+        self.brita = Produto.objects.create(nome='Brita', preco_por_unidade=Decimal('10.00'), estoque_atual=Decimal('0.00'))
+        self.areia = Produto.objects.create(nome='Areia', preco_por_unidade=Decimal('8.00'), estoque_atual=Decimal('0.00'))
+
+    def movimentar(self, dia, deltas, tipo='ENTRADA_PRODUCAO'):
+        with transaction.atomic():
+            movimentar_estoque(deltas, tipo)
+        # Os movimentos acabados de criar passam para o meio-dia do dia indicado
+        MovimentoEstoque.objects.filter(criado_em__gt=timezone.now() - timedelta(minutes=1)).update(criado_em=timezone.make_aware(datetime.combine(dia, time(12, 0))))
+
+    def test_kardex_e_recusa_sem_estoque(self):
+        self.movimentar(date(2025, 3, 1), {self.brita.pk: Decimal('100.00'), self.areia.pk: Decimal('20.00')})
+        self.movimentar(date(2025, 3, 2), {self.brita.pk: Decimal('-30.00')}, 'SAIDA_FATURA')
+        with self.assertRaises(EstoqueInsuficiente), transaction.atomic():
+            movimentar_estoque({self.brita.pk: Decimal('-10.00'), self.areia.pk: Decimal('-21.00')}, 'SAIDA_FATURA')
+        # Tudo ou nada: a saída de brita, que tinha estoque, também não foi feita
+        self.assertEqual(list(MovimentoEstoque.objects.filter(produto=self.brita).order_by('id').values_list('quantidade', 'saldo_apos')), [(Decimal('100.00'), Decimal('100.00')), (Decimal('-30.00'), Decimal('70.00'))])
+        self.assertEqual(Produto.objects.get(pk=self.brita.pk).estoque_atual, Decimal('70.00'))
+        with transaction.atomic():
+            definir_estoque({self.areia.pk: Decimal('18.50')})
+        self.assertEqual(MovimentoEstoque.objects.filter(produto=self.areia).latest('id').quantidade, Decimal('-1.50'))
+
+    def test_fotografia_e_saldo_em(self):
+        dias = [date(2025, 3, 1), date(2025, 3, 2), date(2025, 3, 3)]
+        self.movimentar(dias[0], {self.brita.pk: Decimal('100.00')})
+        self.movimentar(dias[1], {self.brita.pk: Decimal('-30.00')}, 'SAIDA_FATURA')
+        call_command('fotografar_estoque', '--data', '2025-03-02', stdout=io.StringIO())
+        self.movimentar(dias[2], {self.brita.pk: Decimal('5.00')})
+        self.movimentar(dias[2], {self.brita.pk: Decimal('-10.00')}, 'SAIDA_FATURA')
+        foto = SaldoEstoque.objects.get(produto=self.brita)
+        self.assertEqual((foto.data, foto.saldo), (dias[1], Decimal('70.00')))
+        # Igual à soma do kardex até ao fim de cada dia
+        for dia in dias:
+            with self.subTest(dia=dia):
+                esperado = sum(MovimentoEstoque.objects.filter(produto=self.brita, criado_em__date__lte=dia).values_list('quantidade', flat=True))
+                with self.assertNumQueries(2):
+                    self.assertEqual(saldo_em(self.brita.pk, dia), esperado)
+        self.assertEqual(saldo_em(self.brita.pk, dias[2]), Produto.objects.get(pk=self.brita.pk).estoque_atual)
+        # Voltar a fotografar o mesmo dia substitui a fotografia
+        self.assertEqual(fotografar_saldos(dias[2]), 2)
+        self.assertEqual(fotografar_saldos(dias[2]), 2)
+        self.assertEqual(SaldoEstoque.objects.get(produto=self.brita, data=dias[2]).saldo, Decimal('65.00'))
+        self.assertEqual(SaldoEstoque.objects.count(), 4)
+
+
+class PesquisaTests(TestCase):
+    """A pesquisa global encontra por prefixo, sem acentos, e o índice acompanha as escritas."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nome='José Conceição', nif='123 456 789', telefone='955-123-456')
+        self.fatura = Fatura.objects.create(cliente=self.cliente, numero_fatura='2025-0042', data_emissao=date(2025, 7, 1))
+        self.guia = GuiaTransporte.objects.create(fatura=self.fatura, numero_guia='2025-0007', matricula_veiculo='AB-12-CD', morada_carga='Pedreira', morada_descarga='Obra')
+        Produto.objects.create(nome='Gravilha', calibre='4/8', preco_por_unidade=Decimal('10.00'))
+
+    def encontrados(self, termo):
+        return {(e.tipo, e.objeto_id) for e in pesquisar(termo)}
+
+    def test_prefixo_sem_acentos_e_numeros_compactos(self):
+        todos = {('cliente', self.cliente.pk), ('fatura', self.fatura.pk), ('guia', self.guia.pk)}
+        self.assertEqual(self.encontrados('jose conceicao'), todos)
+        self.assertEqual(self.encontrados('CONCEI'), todos)
+        # O NIF entra no texto do cliente e das faturas (a guia não o mostra)
+        self.assertEqual(self.encontrados('123456789'), todos - {('guia', self.guia.pk)})
+        self.assertEqual(self.encontrados('2025-0042'), {('fatura', self.fatura.pk), ('guia', self.guia.pk)})
+        self.assertEqual(self.encontrados('pedreira obra'), {('guia', self.guia.pk)})
+        self.assertEqual([e.titulo for e in pesquisar('gravi')], ['Gravilha (4/8)'])
+        self.assertEqual(pesquisar('inexistente'), [])
+        self.assertEqual(pesquisar('  '), [])
+
+    def test_escritas_atualizam_o_indice(self):
+        self.cliente.nome = 'Construções Silva'
+        self.cliente.save()
+        # O nome do cliente também está nas faturas e guias dele
+        self.assertEqual(self.encontrados('silva'), {('cliente', self.cliente.pk), ('fatura', self.fatura.pk), ('guia', self.guia.pk)})
+        self.assertEqual(self.encontrados('conceicao'), set())
+        self.guia.delete()
+        self.assertEqual(self.encontrados('silva'), {('cliente', self.cliente.pk), ('fatura', self.fatura.pk)})
+
+    def test_reindexar(self):
+        # update() não passa pelos sinais: o índice fica desatualizado até ser reconstruído
+        Cliente.objects.update(nome='Pedras Unidas')
+        EntradaPesquisa.objects.filter(tipo='produto').delete()
+        self.assertEqual(pesquisar('unidas'), [])
+        saida = io.StringIO()
+        call_command('reindexar_pesquisa', '--lote', '1', stdout=saida)
+        self.assertIn('4 entradas', saida.getvalue())
+        self.assertEqual(EntradaPesquisa.objects.count(), 4)
+        self.assertEqual(self.encontrados('unidas'), {('cliente', self.cliente.pk), ('fatura', self.fatura.pk), ('guia', self.guia.pk)})
+        self.assertEqual([e.titulo for e in pesquisar('gravilha')], ['Gravilha (4/8)'])
+
+    def test_pagina_de_resultados(self):
+        self.client.force_login(User.objects.create_user('teste', password='teste'))
+        resposta = self.client.get('/pesquisa/', {'q': 'conceicao'})
+        self.assertContains(resposta, f'/faturas/{self.fatura.pk}/')
+        self.assertContains(resposta, '2025-0007')
+
+
+@override_settings(EMAIL_ENVIO_IMEDIATO=False)
+class CaixaSaidaEmailsTests(TestCase):
+    """Os emails ficam na fila EnvioEmail e são enviados num lote, com novas tentativas cada vez mais espaçadas."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Configuracao.objects.update_or_create(pk=1, defaults={'email_remetente': 'pedreira@exemplo.pt', 'password_remetente': 'x'})
+        cliente = Cliente.objects.create(nome='Cliente Email', email='cliente@exemplo.pt')
+        self.fatura = Fatura.objects.create(cliente=cliente, numero_fatura='2025-0001')
+        self.guia = GuiaTransporte.objects.create(fatura=self.fatura, numero_guia='2025-0001', morada_carga='Pedreira', morada_descarga='Obra')
+        abrir = mock.patch('stock.emails.abrir_pdf', side_effect=lambda tipo, documento: io.BytesIO(b'%PDF'))
+        self.abrir = abrir.start()
+        self.addCleanup(abrir.stop)
+
+    def test_lote_numa_ligacao(self):
+        enfileirar_email_fatura(self.fatura)
+        enfileirar_email_guia(self.guia)
+        self.assertEqual(len(mail.outbox), 0)
+        with mock.patch('stock.emails.get_connection', wraps=get_connection) as ligacoes:
+            self.assertEqual(enviar_pendentes(), (2, 0))
+        ligacoes.assert_called_once()
+        self.assertEqual(sorted(m.attachments[0][0] for m in mail.outbox), ['Fatura-2025-0001.pdf', 'Guia-2025-0001.pdf'])
+        self.assertEqual(set(EnvioEmail.objects.values_list('estado', 'tentativas')), {('ENVIADO', 1)})
+        self.assertEqual(enviar_pendentes(), (0, 0))
+
+    def test_novas_tentativas_com_espera_crescente(self):
+        envio = enfileirar_email_fatura(self.fatura)
+        self.abrir.side_effect = RuntimeError("sem PDF")
+        for tentativa in range(1, MAX_TENTATIVAS_EMAIL + 1):
+            self.assertEqual(enviar_pendentes(), (0, 1))
+            envio.refresh_from_db()
+            self.assertEqual((envio.tentativas, envio.erro), (tentativa, 'sem PDF'))
+            if tentativa < MAX_TENTATIVAS_EMAIL:
+                self.assertEqual(envio.estado, 'PENDENTE')
+                espera = envio.proxima_tentativa - timezone.now()
+                self.assertAlmostEqual(espera.total_seconds(), (ESPERA_INICIAL * 2 ** (tentativa - 1)).total_seconds(), delta=5)
+                # Antes da hora marcada não volta a ser tentado
+                self.assertEqual(enviar_pendentes(), (0, 0))
+                EnvioEmail.objects.filter(pk=envio.pk).update(proxima_tentativa=timezone.now())
+        self.assertEqual(envio.estado, 'ERRO')
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_sucesso_depois_de_uma_falha(self):
+        envio = enfileirar_email_guia(self.guia)
+        self.abrir.side_effect = [RuntimeError("sem PDF"), io.BytesIO(b'%PDF')]
+        self.assertEqual(enviar_pendentes(), (0, 1))
+        EnvioEmail.objects.filter(pk=envio.pk).update(proxima_tentativa=timezone.now())
+        self.assertEqual(enviar_pendentes(), (1, 0))
+        envio.refresh_from_db()
+        self.assertEqual((envio.estado, envio.tentativas, envio.erro), ('ENVIADO', 2, ''))
+        self.assertIsNotNone(envio.enviado_em)
+
+    def test_sem_credenciais_e_envios_presos(self):
+        envio = enfileirar_email_fatura(self.fatura)
+        with self.captureOnCommitCallbacks(execute=True):
+            Configuracao.objects.filter(pk=1).update(password_remetente='')
+            invalidar(Configuracao)
+        self.assertEqual(enviar_pendentes(), (0, 0))
+        self.assertEqual(EnvioEmail.objects.get().estado, 'PENDENTE')
+        EnvioEmail.objects.filter(pk=envio.pk).update(estado='EM_ENVIO', proxima_tentativa=timezone.now() - timedelta(hours=1))
+        self.assertEqual(recuperar_envios_presos(), 1)
+        self.assertEqual(EnvioEmail.objects.get().estado, 'PENDENTE')
+
+
+class AgendadorTests(TestCase):
+    """A reserva de uma tarefa é um update condicional: dois processos nunca correm a mesma tarefa."""
+
+    def setUp(self):
+        sincronizar()
+
+    def test_so_um_processo_reserva(self):
+        agora = timezone.now()
+        primeiro, segundo = TarefaAgendada.objects.get(nome='emails'), TarefaAgendada.objects.get(nome='emails')
+        self.assertTrue(reservar(primeiro, agora, 'servidor-a:1'))
+        self.assertFalse(reservar(segundo, agora, 'servidor-b:2'))
+        self.assertEqual(TarefaAgendada.objects.get(nome='emails').em_curso_por, 'servidor-a:1')
+        # Uma reserva presa (processo morto) expira ao fim da duração máxima da tarefa
+        self.assertTrue(reservar(segundo, agora + TAREFAS['emails'].duracao_maxima + timedelta(seconds=1), 'servidor-b:2'))
+
+    def test_linha_lida_antes_de_outra_execucao_nao_reserva(self):
+        linha = TarefaAgendada.objects.get(nome='emails')
+        lida_antes = TarefaAgendada.objects.get(nome='emails')
+        self.assertTrue(reservar(linha, timezone.now(), 'servidor-a:1'))
+        with mock.patch.dict(TAREFAS, emails=TAREFAS['emails']._replace(funcao=lambda: "feito")):
+            self.assertEqual(executar(linha, 'servidor-a:1'), 'SUCESSO')
+        # A reserva foi libertada, mas quem leu a linha antes desta execução não a volta a correr
+        self.assertFalse(reservar(lida_antes, timezone.now(), 'servidor-b:2'))
+        execucao = ExecucaoTarefa.objects.get()
+        self.assertEqual((execucao.estado, execucao.resultado, execucao.processo), ('SUCESSO', 'feito', 'servidor-a:1'))
+
+    def test_duas_passagens_em_simultaneo(self):
+        lancadas = []
+        with mock.patch('stock.agendador.executar_em_thread', side_effect=lambda linha, processo: lancadas.append((linha.nome, processo)) or mock.Mock()):
+            linhas = list(sincronizar())
+            with mock.patch('stock.agendador.sincronizar', return_value=linhas):
+                passagem('servidor-a:1')
+                passagem('servidor-b:2')
+        nomes = [nome for nome, _processo in lancadas]
+        self.assertEqual(len(nomes), len(set(nomes)))
+        self.assertIn(('emails', 'servidor-a:1'), lancadas)
+        self.assertEqual({processo for _nome, processo in lancadas}, {'servidor-a:1'})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'singletons-testes'}})
+class SingletonsTests(TestCase):
+    """As linhas únicas de configuração ficam em memória até serem gravadas ou apagadas."""
+
+    def setUp(self):
+        invalidar_todos()
+        self.addCleanup(invalidar_todos)
+
+    def test_gravar_configuracao_invalida(self):
+        self.assertEqual(obter_configuracao(criar=True).limite_alerta_estoque, 10)
+        with self.assertNumQueries(0):
+            configuracao = obter_configuracao()
+        configuracao.limite_alerta_estoque = 3
+        # As cópias devolvidas podem ser alteradas sem afetar a instância em memória
+        self.assertEqual(obter_configuracao().limite_alerta_estoque, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            configuracao.save()
+        self.assertEqual(obter_configuracao().limite_alerta_estoque, 3)
+        with self.assertNumQueries(0):
+            obter_configuracao()
+
+    def test_gravar_e_apagar_dados_empresa(self):
+        self.assertIsNone(obter_dados_empresa())
+        with self.captureOnCommitCallbacks(execute=True):
+            empresa = DadosEmpresa.objects.create(nome_empresa="Pedreira", endereco="Rua 1", nif="500", telefone="1", email="a@b.pt", dados_pagamento="IBAN")
+        self.assertEqual(obter_dados_empresa().nome_empresa, "Pedreira")
+        with self.captureOnCommitCallbacks(execute=True):
+            empresa.nome_empresa = "Pedreira Nova"
+            empresa.save()
+        self.assertEqual(obter_dados_empresa().nome_empresa, "Pedreira Nova")
+        with self.captureOnCommitCallbacks(execute=True):
+            empresa.delete()
+        self.assertIsNone(obter_dados_empresa())
+
+    def test_gravacao_noutro_processo(self):
+        BackupConfig.objects.create(schedule='MANUAL', recipient_email='backup@exemplo.pt')
+        self.assertEqual(obter_backup_config().schedule, 'MANUAL')
+        lida_neste_processo = dict(singletons._INSTANCIAS)
+        with self.captureOnCommitCallbacks(execute=True):
+            config = BackupConfig.objects.get()
+            config.schedule = 'DIARIO'
+            config.save()
+        # Este processo ainda tem a instância antiga em memória; só a versão na cache partilhada mudou
+        singletons._INSTANCIAS.update(lida_neste_processo)
+        self.assertEqual(obter_backup_config().schedule, 'DIARIO')
+        # Sem sinal (update direto) a instância em memória mantém-se até à próxima invalidação
+        BackupConfig.objects.update(schedule='SEMANAL')
+        self.assertEqual(obter_backup_config().schedule, 'DIARIO')
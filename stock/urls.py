@@ -5,10 +5,14 @@ from . import views
 
 urlpatterns = [
     path('', views.home_view, name='home'),
+    path('pesquisa/', views.pesquisa_view, name='pesquisa'),
+    path('api/clientes/', views.api_clientes_view, name='api_clientes'),
+    path('api/produtos/', views.api_produtos_view, name='api_produtos'),
     
     # URLs de Faturas
     path('faturas/nova/', views.criar_fatura_view, name='criar_fatura'),
     path('faturas/', views.lista_faturas_view, name='lista_faturas'),
+    path('faturas/exportar-pdf/', views.exportar_faturas_pdf_view, name='exportar_faturas_pdf'),
     path('faturas/<int:fatura_id>/', views.detalhe_fatura_view, name='detalhe_fatura'),
     path('faturas/<int:fatura_id>/editar/', views.editar_fatura_view, name='editar_fatura'),
     path('faturas/<int:fatura_id>/toggle_paga/', views.toggle_fatura_paga_view, name='toggle_fatura_paga'),
@@ -26,8 +30,11 @@ urlpatterns = [
     # URLs de Produtos
     path('produtos/', views.lista_produtos_view, name='lista_produtos'),
     path('produtos/adicionar/', views.adicionar_produto_view, name='adicionar_produto'),
+    path('produtos/atualizar/', views.atualizar_produtos_view, name='atualizar_produtos'),
+    path('api/produtos/atualizar/', views.api_atualizar_produtos_view, name='api_atualizar_produtos'),
     path('produtos/<int:produto_id>/editar/', views.editar_produto_view, name='editar_produto'),
     path('produtos/<int:produto_id>/apagar/', views.apagar_produto_view, name='apagar_produto'),
+    path('produtos/<int:produto_id>/movimentos/', views.movimentos_produto_view, name='movimentos_produto'),
 
     # URLs PARA GUIAS DE TRANSPORTE
     path('guias/', views.lista_guias_view, name='lista_guias'),
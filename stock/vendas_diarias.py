@@ -0,0 +1,85 @@
+# Ficheiro: stock/vendas_diarias.py
+# Manutenção da tabela VendaDiaria (vendas agregadas por dia/produto/cliente/estado de pagamento).
+#
+# A unidade de atualização é o par (data, cliente): sempre que uma fatura é criada, editada, marcada
+# como paga ou apagada, as linhas desse par são apagadas e voltam a ser agregadas a partir dos itens.
+# Assim a tabela nunca acumula erros, e cada atualização custa poucas queries sobre um único dia.
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ItemFatura, VendaDiaria, arredondar
+
+CAMPOS_ITEM = (
+    'fatura__data_emissao', 'produto_id', 'fatura__cliente_id', 'fatura__paga',
+    'quantidade', 'preco_unitario', 'fatura__desconto', 'fatura__taxa_igv',
+)
+
+
+def chaves_faturas(faturas):
+    """Pares (data, cliente_id) afetados por uma lista/queryset de faturas."""
+    return {(f.data_emissao, f.cliente_id) for f in faturas}
+
+
+def agregar_itens(linhas):
+    """Soma linhas de CAMPOS_ITEM num dicionário {(data, produto, cliente, paga): [qtd, bruto, líquido, igv]}."""
+    totais = defaultdict(lambda: [Decimal('0'), Decimal('0'), Decimal('0'), Decimal('0')])
+    for data, produto_id, cliente_id, paga, quantidade, preco, desconto, taxa_igv in linhas:
+        if not quantidade or not preco:
+            continue
+        bruto = quantidade * preco
+        liquido = bruto * (Decimal(100) - desconto) / Decimal(100)
+        acumulado = totais[(data, produto_id, cliente_id, paga)]
+        acumulado[0] += quantidade
+        acumulado[1] += bruto
+        acumulado[2] += liquido
+        acumulado[3] += liquido * taxa_igv / Decimal(100)
+    return totais
+
+
+def _criar_linhas(totais):
+    linhas = []
+    for (data, produto_id, cliente_id, paga), (quantidade, bruto, liquido, igv) in totais.items():
+        valor_liquido, valor_igv = arredondar(liquido), arredondar(igv)
+        linhas.append(VendaDiaria(
+            data=data, produto_id=produto_id, cliente_id=cliente_id, paga=paga, quantidade=arredondar(quantidade),
+            valor_bruto=bruto, valor_liquido=valor_liquido, valor_igv=valor_igv, total=valor_liquido + valor_igv,
+        ))
+    VendaDiaria.objects.bulk_create(linhas, batch_size=500)
+    return len(linhas)
+
+
+def refrescar_vendas_diarias(chaves):
+    """Volta a agregar as vendas dos pares (data, cliente_id) indicados."""
+    por_data = defaultdict(set)
+    for data, cliente_id in chaves:
+        por_data[data].add(cliente_id)
+    if not por_data:
+        return
+    filtro_vendas, filtro_itens = Q(), Q()
+    for data, clientes in por_data.items():
+        filtro_vendas |= Q(data=data, cliente_id__in=clientes)
+        filtro_itens |= Q(fatura__data_emissao=data, fatura__cliente_id__in=clientes)
+    with transaction.atomic():
+        VendaDiaria.objects.filter(filtro_vendas).delete()
+        _criar_linhas(agregar_itens(ItemFatura.objects.filter(filtro_itens).values_list(*CAMPOS_ITEM)))
+
+
+def reconstruir_vendas_diarias(chunk_size=2000):
+    """Apaga e regenera a tabela inteira, dia a dia, sem carregar todos os itens em memória."""
+    total = 0
+    with transaction.atomic():
+        VendaDiaria.objects.all().delete()
+        itens = ItemFatura.objects.order_by('fatura__data_emissao').values_list(*CAMPOS_ITEM).iterator(chunk_size=chunk_size)
+        dia, linhas_dia = None, []
+        for linha in itens:
+            if linha[0] != dia and linhas_dia:
+                total += _criar_linhas(agregar_itens(linhas_dia))
+                linhas_dia = []
+            dia = linha[0]
+            linhas_dia.append(linha)
+        if linhas_dia:
+            total += _criar_linhas(agregar_itens(linhas_dia))
+    return total
@@ -1,132 +1,78 @@
 # --- Ficheiro 100% Completo: stock/views.py ---
 import json
 from decimal import Decimal
-import pathlib # Importar a biblioteca pathlib
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.db import transaction, models
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.translation import gettext as _
 from .models import (
-    Produto, Cliente, Fatura, ItemFatura, DadosEmpresa, Configuracao,
-    GuiaTransporte, ItemGuia
+    Produto, Cliente, Fatura, ItemFatura, Configuracao,
+    GuiaTransporte, ItemGuia, SequenciaDocumento
 )
+from .dashboard import blocos_dashboard
+from .emails import EmailNaoConfigurado, enfileirar_email_fatura, enfileirar_email_guia
+from .exportar_pdf import documentos_das_faturas, gerar_zip
+from .estoque import definir_estoque, movimentar_estoque, saldo_em, somar_quantidades
+from .faturas import sincronizar_itens_fatura
+from .paginacao import paginar
+from .pdf import PDFIndisponivel, abrir_pdf
+from .pesquisa import URLS as URLS_PESQUISA, pesquisar
+from .produtos import atualizar_produtos_em_massa, validar_alteracoes
+from .singletons import obter_dados_empresa
+from .vendas_diarias import chaves_faturas, refrescar_vendas_diarias
 from datetime import date, datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import calendar
 from django.core.paginator import Paginator
 from django.db.models import Sum, F, Q
 
-from django.http import HttpResponse
-from django.core.mail import EmailMessage, get_connection
-from django.template.loader import render_to_string
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET, require_POST
 from django.conf import settings
 from django.contrib.auth import views as auth_views
 
-try:
-    from weasyprint import HTML
-except ImportError:
-    HTML = None
-
 # ... (O resto das suas views permanece exatamente igual) ...
 @login_required
 def home_view(request):
-    hoje = date.today()
-    
-    todas_as_faturas = Fatura.objects.all()
-    faturas_pagas = todas_as_faturas.filter(paga=True)
-    num_pagas = faturas_pagas.count()
-    total_recebido = sum(f.total_geral for f in faturas_pagas)
-
-    faturas_nao_pagas = todas_as_faturas.filter(paga=False)
-    num_nao_pagas = faturas_nao_pagas.count()
-    valor_em_divida = sum(f.valor_a_pagar for f in faturas_nao_pagas)
-
-    faturas_mes_atual = todas_as_faturas.filter(data_emissao__year=hoje.year, data_emissao__month=hoje.month)
-    num_faturas_mes = faturas_mes_atual.count()
-    total_faturado_mes = sum(f.total_geral for f in faturas_mes_atual)
-
-    num_clientes = Cliente.objects.count()
-    
     periodo = request.GET.get('periodo', '1m_daily')
     start_date_str = request.GET.get('start_date')
     end_date_str = request.GET.get('end_date')
     status_fatura = request.GET.get('status_fatura', 'todas')
     
-    faturas_grafico = Fatura.objects.all()
-    if status_fatura == 'pagas':
-        faturas_grafico = faturas_grafico.filter(paga=True)
-    elif status_fatura == 'nao_pagas':
-        faturas_grafico = faturas_grafico.filter(paga=False)
-    
-    labels_grafico, dados_grafico = [], []
-    
+    start_date = end_date = None
     if periodo == 'custom' and start_date_str and end_date_str:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
         end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        mes_atual_iter = date(start_date.year, start_date.month, 1)
-        while mes_atual_iter <= end_date:
-            labels_grafico.append(mes_atual_iter.strftime('%b/%y'))
-            faturas_do_mes = faturas_grafico.filter(data_emissao__year=mes_atual_iter.year, data_emissao__month=mes_atual_iter.month)
-            total_com_igv = sum(f.total_geral for f in faturas_do_mes)
-            dados_grafico.append(float(total_com_igv))
-            mes_atual_iter += relativedelta(months=1)
-            
-    elif periodo == '1m_daily':
-        mes_atual, ano_atual = hoje.month, hoje.year
-        _, num_dias = calendar.monthrange(ano_atual, mes_atual)
-        
-        for dia in range(1, num_dias + 1):
-            labels_grafico.append(str(dia))
-            data_especifica = date(ano_atual, mes_atual, dia)
-            faturas_do_dia = faturas_grafico.filter(data_emissao=data_especifica)
-            total_do_dia = sum(f.total_geral for f in faturas_do_dia)
-            dados_grafico.append(float(total_do_dia))
-
-    else:
-        num_meses = 3 if periodo == '3m' else 6
-        for i in range(num_meses):
-            mes_calculo = hoje - relativedelta(months=i)
-            labels_grafico.append(mes_calculo.strftime('%b/%y'))
-            faturas_do_mes = faturas_grafico.filter(data_emissao__year=mes_calculo.year, data_emissao__month=mes_calculo.month)
-            total_do_mes = sum(f.total_geral for f in faturas_do_mes)
-            dados_grafico.append(float(total_do_mes))
-        labels_grafico.reverse()
-        dados_grafico.reverse()
-    
-    config, created = Configuracao.objects.get_or_create(pk=1)
-    limite_estoque_baixo = config.limite_alerta_estoque
-    produtos_estoque_baixo = Produto.objects.filter(estoque_atual__lte=limite_estoque_baixo).order_by('estoque_atual')
-    
-    data_limite_30_dias = hoje - timedelta(days=30)
-    top_clientes = Cliente.objects.annotate(total_gasto=Sum(F('fatura__itens__quantidade') * F('fatura__itens__preco_unitario'), filter=Q(fatura__data_emissao__gte=data_limite_30_dias))).order_by('-total_gasto').filter(total_gasto__gt=0)[:10]
-    top_produtos = Produto.objects.annotate(total_vendido=Sum(F('itemfatura__quantidade') * F('itemfatura__preco_unitario'), filter=Q(itemfatura__fatura__data_emissao__gte=data_limite_30_dias))).order_by('-total_vendido').filter(total_vendido__gt=0)[:10]
+    blocos = blocos_dashboard(periodo, status_fatura, start_date, end_date)
     
     contexto = {
-        'total_faturado_mes': total_faturado_mes, 'num_faturas_mes': num_faturas_mes,
-        'num_clientes': num_clientes, 'produtos_estoque_baixo': produtos_estoque_baixo,
-        'limite_estoque_baixo': limite_estoque_baixo, 'labels_grafico': json.dumps(labels_grafico),
-        'dados_grafico': json.dumps(dados_grafico), 'periodo_selecionado': periodo,
+        **blocos, 'labels_grafico': json.dumps(blocos['labels_grafico']),
+        'dados_grafico': json.dumps(blocos['dados_grafico']), 'periodo_selecionado': periodo,
         'start_date': start_date_str, 'end_date': end_date_str,
-        'status_fatura_selecionado': status_fatura, 'top_clientes': top_clientes,
-        'top_produtos': top_produtos, 'num_pagas': num_pagas,
-        'total_recebido': total_recebido, 'num_nao_pagas': num_nao_pagas,
-        'valor_em_divida': valor_em_divida,
+        'status_fatura_selecionado': status_fatura,
     }
     return render(request, 'stock/home.html', contexto)
 
+@login_required
+def pesquisa_view(request):
+    termo = request.GET.get('q', '').strip()
+    resultados = [
+        {'entrada': entrada, 'url': reverse(URLS_PESQUISA[entrada.tipo], args=[entrada.objeto_id])}
+        for entrada in pesquisar(termo)
+    ] if termo else []
+    return render(request, 'stock/pesquisa.html', {'termo': termo, 'resultados': resultados})
+
 @login_required
 def lista_clientes_view(request):
     q_nome = request.GET.get('q_nome', '')
     q_telefone = request.GET.get('q_telefone', '')
-    clientes = Cliente.objects.all().order_by('nome')
+    clientes = Cliente.objects.all()
     if q_nome:
         clientes = clientes.filter(nome__icontains=q_nome)
     if q_telefone:
         clientes = clientes.filter(telefone__icontains=q_telefone)
-    paginator = Paginator(clientes, 15)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginar(request, clientes, ('nome', 'id'))
     return render(request, 'stock/lista_clientes.html', {'page_obj': page_obj})
 
 @login_required
@@ -175,23 +121,59 @@ def apagar_cliente_view(request, cliente_id):
 
 @login_required
 def lista_produtos_view(request):
-    produtos_list = Produto.objects.all().order_by('nome')
-    paginator = Paginator(produtos_list, 15)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginar(request, Produto.objects.select_related('utilizador', 'modificado_por'), ('nome', 'id'))
     return render(request, 'stock/lista_produtos.html', {'page_obj': page_obj})
 
+@login_required
+def atualizar_produtos_view(request):
+    produtos = Produto.objects.order_by('nome', 'id')
+    if request.method == 'POST':
+        linhas = [
+            {'id': produto_id, 'estoque_atual': request.POST.get(f'estoque_{produto_id}'), 'preco_por_unidade': request.POST.get(f'preco_{produto_id}')}
+            for produto_id in request.POST.getlist('produto_id')
+        ]
+        alteracoes, erros = validar_alteracoes(linhas)
+        if not erros:
+            try:
+                total = atualizar_produtos_em_massa(alteracoes, request.user)
+                messages.success(request, _("{total} produto(s) atualizado(s) com sucesso!").format(total=total))
+                return redirect('lista_produtos')
+            except Produto.DoesNotExist as e:
+                erros = [str(e)]
+        for erro in erros:
+            messages.error(request, erro)
+    return render(request, 'stock/atualizar_produtos.html', {'produtos': produtos})
+
+@login_required
+@require_POST
+def api_atualizar_produtos_view(request):
+    """Recebe {"produtos": [{"id": 1, "estoque_atual": "10.00", "preco_por_unidade": "2500.00"}, ...]}."""
+    try:
+        linhas = json.loads(request.body).get('produtos')
+        if not isinstance(linhas, list): raise ValueError
+    except (ValueError, AttributeError):
+        return JsonResponse({'erros': [_("Pedido inválido: é esperado um objeto JSON com a lista 'produtos'.")]}, status=400)
+    alteracoes, erros = validar_alteracoes(linhas)
+    if erros:
+        return JsonResponse({'erros': erros}, status=400)
+    try:
+        total = atualizar_produtos_em_massa(alteracoes, request.user)
+    except Produto.DoesNotExist as e:
+        return JsonResponse({'erros': [str(e)]}, status=400)
+    return JsonResponse({'atualizados': total})
+
 @login_required
 def adicionar_produto_view(request):
     if request.method == 'POST':
         nome = request.POST.get('nome')
-        Produto.objects.create(
-            nome=nome, calibre=request.POST.get('calibre'), descricao=request.POST.get('descricao'), 
-            unidade_medida=request.POST.get('unidade_medida'), 
-            estoque_atual=Decimal(request.POST.get('estoque_atual', '0.00')), 
-            preco_por_unidade=Decimal(request.POST.get('preco_por_unidade', '0.00')),
-            utilizador=request.user
-        )
+        with transaction.atomic():
+            produto = Produto.objects.create(
+                nome=nome, calibre=request.POST.get('calibre'), descricao=request.POST.get('descricao'), 
+                unidade_medida=request.POST.get('unidade_medida'), 
+                preco_por_unidade=Decimal(request.POST.get('preco_por_unidade', '0.00')),
+                utilizador=request.user
+            )
+            definir_estoque({produto.id: Decimal(request.POST.get('estoque_atual', '0.00'))}, request.user, tipo='ENTRADA_PRODUCAO', nota=_("Estoque inicial"))
         messages.success(request, _("O produto '{nome}' foi adicionado com sucesso!").format(nome=nome))
         return redirect('lista_produtos')
     return render(request, 'stock/adicionar_produto.html', {'unidades': Produto.UNIDADES})
@@ -204,14 +186,46 @@ def editar_produto_view(request, produto_id):
         produto.calibre = request.POST.get('calibre')
         produto.descricao = request.POST.get('descricao')
         produto.unidade_medida = request.POST.get('unidade_medida')
-        produto.estoque_atual = Decimal(request.POST.get('estoque_atual', '0.00'))
         produto.preco_por_unidade = Decimal(request.POST.get('preco_por_unidade', '0.00'))
         produto.modificado_por = request.user
-        produto.save()
+        with transaction.atomic():
+            # O estoque não é gravado com o resto do produto: a diferença fica registada como correção manual
+            produto.save(update_fields=['nome', 'calibre', 'descricao', 'unidade_medida', 'preco_por_unidade', 'modificado_por', 'atualizado_em'])
+            definir_estoque({produto.id: Decimal(request.POST.get('estoque_atual', '0.00'))}, request.user)
         messages.success(request, _("O produto '{nome}' foi atualizado com sucesso!").format(nome=produto.nome))
         return redirect('lista_produtos')
     return render(request, 'stock/editar_produto.html', {'produto': produto, 'unidades': Produto.UNIDADES})
 
+@login_required
+def movimentos_produto_view(request, produto_id):
+    produto = get_object_or_404(Produto, id=produto_id)
+    if request.method == 'POST':
+        try:
+            quantidade = Decimal(request.POST.get('quantidade', '0'))
+            if quantidade <= 0: raise ValueError(_("A quantidade de entrada deve ser positiva."))
+            with transaction.atomic():
+                movimentar_estoque({produto.id: quantidade}, 'ENTRADA_PRODUCAO', utilizador=request.user, nota=request.POST.get('nota', ''))
+            messages.success(request, _("Entrada de {quantidade} registada para '{nome}'.").format(quantidade=quantidade, nome=produto.nome))
+        except Exception as e:
+            messages.error(request, _("Ocorreu um erro ao registar a entrada: {erro}").format(erro=e))
+        return redirect('movimentos_produto', produto_id=produto.id)
+    movimentos = produto.movimentos.select_related('fatura', 'utilizador').order_by('-criado_em', '-id')
+    data_inicio, data_fim = request.GET.get('data_inicio'), request.GET.get('data_fim')
+    saldo_inicial = saldo_final = None
+    try:
+        if data_inicio:
+            inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date()
+            movimentos = movimentos.filter(criado_em__date__gte=inicio)
+            saldo_inicial = saldo_em(produto.id, inicio - timedelta(days=1))
+        if data_fim:
+            fim = datetime.strptime(data_fim, '%Y-%m-%d').date()
+            movimentos = movimentos.filter(criado_em__date__lte=fim)
+            saldo_final = saldo_em(produto.id, fim)
+    except ValueError:
+        messages.error(request, _("Datas inválidas."))
+    page_obj = Paginator(movimentos, 25).get_page(request.GET.get('page'))
+    return render(request, 'stock/movimentos_produto.html', {'produto': produto, 'page_obj': page_obj, 'saldo_inicial': saldo_inicial, 'saldo_final': saldo_final})
+
 @login_required
 def apagar_produto_view(request, produto_id):
     produto = get_object_or_404(Produto, id=produto_id)
@@ -225,10 +239,53 @@ def apagar_produto_view(request, produto_id):
         return redirect('lista_produtos')
     return render(request, 'stock/produto_confirm_delete.html', {'produto': produto})
 
+def _ler_itens_fatura(itens_json):
+    """Converte a lista 'items[]' (JSON por linha) do formulário da fatura em dicionários prontos para ItemFatura."""
+    itens = []
+    for item_str in itens_json:
+        item_data = json.loads(item_str)
+        quantidade, preco = Decimal(str(item_data['quantidade'])), Decimal(str(item_data['preco_unitario']))
+        # Uma quantidade negativa seria tratada como devolução e faria entrar estoque
+        if not quantidade.is_finite() or quantidade <= 0: raise ValueError(_("A quantidade de cada item deve ser positiva."))
+        if not preco.is_finite() or preco < 0: raise ValueError(_("O preço unitário não pode ser negativo."))
+        itens.append({'produto_id': int(item_data['produto_id']), 'quantidade': quantidade, 'preco_unitario': preco})
+    return itens
+
+LIMITE_AUTOCOMPLETE = 20
+
+def _limite_autocomplete(request):
+    """Número de resultados pedido em ?limite=, entre 1 e 50 (LIMITE_AUTOCOMPLETE se não for um número)."""
+    try:
+        limite = int(request.GET.get('limite', LIMITE_AUTOCOMPLETE))
+    except ValueError:
+        return LIMITE_AUTOCOMPLETE
+    return max(1, min(limite, 50))
+
+@login_required
+@require_GET
+@cache_control(private=True, max_age=60)
+def api_clientes_view(request):
+    """Clientes cujo nome começa pelo texto em ?q= (para os campos de cliente das faturas e guias)."""
+    clientes = Cliente.objects.filter(nome__istartswith=request.GET.get('q', '').strip()).order_by('nome', 'id')
+    resultados = list(clientes.values('id', 'nome', 'nif', 'endereco')[:_limite_autocomplete(request)])
+    return JsonResponse({'resultados': resultados})
+
+@login_required
+@require_GET
+@cache_control(private=True, max_age=60)
+def api_produtos_view(request):
+    """Produtos cujo nome começa pelo texto em ?q=, com preço e estoque atuais."""
+    produtos = Produto.objects.filter(nome__istartswith=request.GET.get('q', '').strip()).order_by('nome', 'id')
+    resultados = [
+        {'id': p.id, 'nome': str(p), 'preco': str(p.preco_por_unidade), 'estoque': str(p.estoque_atual), 'unidade': p.get_unidade_medida_display()}
+        for p in produtos.only('id', 'nome', 'calibre', 'preco_por_unidade', 'estoque_atual', 'unidade_medida')[:_limite_autocomplete(request)]
+    ]
+    return JsonResponse({'resultados': resultados})
+
 @login_required
 def criar_fatura_view(request):
     if request.method == 'GET':
-        return render(request, 'stock/criar_fatura.html', { 'clientes': Cliente.objects.all(), 'produtos': Produto.objects.all().order_by('nome') })
+        return render(request, 'stock/criar_fatura.html')
     if request.method == 'POST':
         try:
             with transaction.atomic():
@@ -237,32 +294,20 @@ def criar_fatura_view(request):
                 taxa_igv = Decimal(request.POST.get('taxa_igv', '17.00'))
                 desconto = Decimal(request.POST.get('desconto', '0.00'))
                 adiantamento = Decimal(request.POST.get('adiantamento', '0.00'))
-                itens_json = request.POST.getlist('items[]')
-                if not itens_json: raise ValueError(_("A fatura deve ter pelo menos um item."))
+                itens = _ler_itens_fatura(request.POST.getlist('items[]'))
+                if not itens: raise ValueError(_("A fatura deve ter pelo menos um item."))
                 cliente = Cliente.objects.get(id=cliente_id)
-                ano_atual = date.today().year
-                ultima_fatura_ano = Fatura.objects.filter(data_emissao__year=ano_atual).order_by('numero_fatura').last()
-                novo_numero_seq = 1
-                if ultima_fatura_ano and ultima_fatura_ano.numero_fatura:
-                    try:
-                        novo_numero_seq = int(ultima_fatura_ano.numero_fatura.split('-')[-1]) + 1
-                    except (ValueError, IndexError):
-                        novo_numero_seq = Fatura.objects.filter(data_emissao__year=ano_atual).count() + 1
-                numero_final_fatura = f"{ano_atual}-{novo_numero_seq:04d}"
+                numero_final_fatura = SequenciaDocumento.proximo_numero('FATURA')
                 nova_fatura = Fatura.objects.create(cliente=cliente, numero_fatura=numero_final_fatura, taxa_igv=taxa_igv, desconto=desconto, adiantamento=adiantamento, utilizador=request.user)
-                for item_str in itens_json:
-                    item_data = json.loads(item_str)
-                    produto = Produto.objects.get(id=item_data['produto_id'])
-                    quantidade = Decimal(item_data['quantidade'])
-                    if produto.estoque_atual < quantidade: raise ValueError(_("Estoque insuficiente para {produto_nome}. Disponível: {estoque}").format(produto_nome=produto.nome, estoque=produto.estoque_atual))
-                    ItemFatura.objects.create(fatura=nova_fatura, produto=produto, quantidade=quantidade, preco_unitario=Decimal(item_data['preco_unitario']))
-                    produto.estoque_atual -= quantidade
-                    produto.save()
+                movimentar_estoque(somar_quantidades(((i['produto_id'], i['quantidade']) for i in itens), sinal=-1), 'SAIDA_FATURA', fatura=nova_fatura, utilizador=request.user)
+                ItemFatura.objects.bulk_create([ItemFatura(fatura=nova_fatura, **item) for item in itens])
+                nova_fatura.recalcular_totais()
+                refrescar_vendas_diarias(chaves_faturas([nova_fatura]))
                 messages.success(request, _("Fatura {numero} criada com sucesso!").format(numero=nova_fatura.numero_fatura))
                 return redirect('detalhe_fatura', fatura_id=nova_fatura.id)
         except Exception as e:
             messages.error(request, _("Ocorreu um erro ao gerar a fatura: {erro}").format(erro=e))
-            return render(request, 'stock/criar_fatura.html', { 'clientes': Cliente.objects.all(), 'produtos': Produto.objects.all().order_by('nome') })
+            return render(request, 'stock/criar_fatura.html')
     return redirect('home')
 
 @login_required
@@ -271,44 +316,44 @@ def editar_fatura_view(request, fatura_id):
     if request.method == 'POST':
         try:
             with transaction.atomic():
-                for item_antigo in fatura.itens.all():
-                    item_antigo.produto.estoque_atual += item_antigo.quantidade
-                    item_antigo.produto.save()
-                fatura.itens.all().delete()
+                chaves_vendas = chaves_faturas([fatura])
                 cliente_id = request.POST.get('cliente')
                 if not cliente_id: raise ValueError(_("O campo cliente não pode estar vazio."))
-                itens_json = request.POST.getlist('items[]')
-                if not itens_json: raise ValueError(_("A fatura deve ter pelo menos um item."))
+                itens = _ler_itens_fatura(request.POST.getlist('items[]'))
+                if not itens: raise ValueError(_("A fatura deve ter pelo menos um item."))
                 fatura.cliente = Cliente.objects.get(id=cliente_id)
                 fatura.taxa_igv = Decimal(request.POST.get('taxa_igv', '17.00'))
                 fatura.desconto = Decimal(request.POST.get('desconto', '0.00'))
                 fatura.adiantamento = Decimal(request.POST.get('adiantamento', '0.00'))
                 fatura.modificado_por = request.user
+                if sincronizar_itens_fatura(fatura, itens, utilizador=request.user):
+                    fatura.recalcular_totais(save=False)
                 fatura.save()
-                for item_str in itens_json:
-                    item_data = json.loads(item_str)
-                    produto = Produto.objects.get(id=item_data['produto_id'])
-                    quantidade = Decimal(item_data['quantidade'])
-                    if produto.estoque_atual < quantidade: raise ValueError(_("Estoque insuficiente para {produto_nome}. Disponível: {estoque}").format(produto_nome=produto.nome, estoque=produto.estoque_atual))
-                    ItemFatura.objects.create(fatura=fatura, produto=produto, quantidade=quantidade, preco_unitario=Decimal(item_data['preco_unitario']))
-                    produto.estoque_atual -= quantidade
-                    produto.save()
+                refrescar_vendas_diarias(chaves_vendas | chaves_faturas([fatura]))
                 messages.success(request, _("Fatura {numero} atualizada com sucesso!").format(numero=fatura.numero_fatura))
                 return redirect('detalhe_fatura', fatura_id=fatura.id)
         except Exception as e:
             messages.error(request, _("Ocorreu um erro ao salvar as alterações: {erro}").format(erro=e))
             return redirect('editar_fatura', fatura_id=fatura.id)
-    itens_atuais = [{'produto_id': item.produto.id, 'produto_nome': f"{item.produto.nome} ({item.produto.calibre})" if item.produto.calibre else item.produto.nome, 'quantidade': str(item.quantidade), 'preco_unitario': str(item.preco_unitario), 'subtotal': str(item.subtotal)} for item in fatura.itens.all()]
-    return render(request, 'stock/editar_fatura.html', {'fatura': fatura, 'clientes': Cliente.objects.all(), 'produtos': Produto.objects.all().order_by('nome'), 'itens_atuais_json': json.dumps(itens_atuais)})
-
-@login_required
-def lista_faturas_view(request):
-    q_numero = request.GET.get('q_numero', '')
-    q_cliente = request.GET.get('q_cliente', '')
-    q_data = request.GET.get('q_data', '')
-    q_paga = request.GET.get('q_paga', '')
-    q_periodo = request.GET.get('q_periodo', '')
-    faturas = Fatura.objects.all().order_by('-data_emissao', '-numero_fatura')
+    itens_atuais = [{'produto_id': item.produto.id, 'produto_nome': f"{item.produto.nome} ({item.produto.calibre})" if item.produto.calibre else item.produto.nome, 'quantidade': str(item.quantidade), 'preco_unitario': str(item.preco_unitario), 'subtotal': str(item.subtotal)} for item in fatura.itens.select_related('produto')]
+    return render(request, 'stock/editar_fatura.html', {'fatura': fatura, 'itens_atuais_json': json.dumps(itens_atuais)})
+
+# Ordenações aceites em ?ordenar= (com '-' à frente para ordem descendente)
+ORDENACOES_FATURAS = {
+    'numero': ('numero_fatura',),
+    'data': ('data_emissao', 'numero_fatura'),
+    'cliente': ('cliente__nome',),
+    'valor': ('valor_a_pagar',),
+    'paga': ('paga', 'data_emissao'),
+}
+
+def filtrar_faturas(faturas, parametros):
+    """Aplica os filtros da lista de faturas (parâmetros q_* do GET); também usado na exportação em ZIP."""
+    q_numero = parametros.get('q_numero', '')
+    q_cliente = parametros.get('q_cliente', '')
+    q_data = parametros.get('q_data', '')
+    q_paga = parametros.get('q_paga', '')
+    q_periodo = parametros.get('q_periodo', '')
     if q_numero: faturas = faturas.filter(numero_fatura__icontains=q_numero)
     if q_cliente: faturas = faturas.filter(cliente__nome__icontains=q_cliente)
     if q_data:
@@ -317,16 +362,47 @@ def lista_faturas_view(request):
     if q_paga == 'sim': faturas = faturas.filter(paga=True)
     if q_paga == 'nao': faturas = faturas.filter(paga=False)
     if q_periodo == 'mes_atual':
-        hoje = date.today()
-        faturas = faturas.filter(data_emissao__year=hoje.year, data_emissao__month=hoje.month)
-    paginator = Paginator(faturas, 15)
-    page_obj = paginator.get_page(request.GET.get('page'))
-    return render(request, 'stock/lista_faturas.html', {'page_obj': page_obj})
+        # Intervalo de datas (e não __month, que é um EXTRACT) para o filtro usar o índice da data
+        inicio = date.today().replace(day=1)
+        faturas = faturas.filter(data_emissao__gte=inicio, data_emissao__lt=(inicio + timedelta(days=32)).replace(day=1))
+    # Intervalos de data e de valor a pagar (valor_a_pagar é uma coluna, por isso o filtro corre em SQL)
+    for parametro, filtro in (('q_data_inicio', 'data_emissao__gte'), ('q_data_fim', 'data_emissao__lte')):
+        try: faturas = faturas.filter(**{filtro: datetime.strptime(parametros[parametro], '%Y-%m-%d').date()})
+        except (KeyError, ValueError): pass
+    for parametro, filtro in (('q_valor_min', 'valor_a_pagar__gte'), ('q_valor_max', 'valor_a_pagar__lte')):
+        try: valor = Decimal(parametros[parametro].replace(',', '.'))
+        except (KeyError, ArithmeticError): continue
+        # NaN/Infinity (e valores sem lugar na coluna) são ignorados, como as datas inválidas
+        if valor.is_finite() and abs(valor) < Decimal('1e12'): faturas = faturas.filter(**{filtro: valor})
+    return faturas
+
+@login_required
+def lista_faturas_view(request):
+    ordenar = request.GET.get('ordenar', '-data')
+    if ordenar.lstrip('-') not in ORDENACOES_FATURAS: ordenar = '-data'
+    prefixo = '-' if ordenar.startswith('-') else ''
+    ordem = [prefixo + campo for campo in ORDENACOES_FATURAS[ordenar.lstrip('-')]] + [prefixo + 'id']
+    faturas = filtrar_faturas(Fatura.objects.select_related('cliente', 'utilizador', 'modificado_por'), request.GET)
+    page_obj = paginar(request, faturas, ordem)
+    return render(request, 'stock/lista_faturas.html', {'page_obj': page_obj, 'ordenar': ordenar})
+
+@login_required
+def exportar_faturas_pdf_view(request):
+    """ZIP com os PDFs das faturas (e guias) que correspondem aos filtros da lista, enviado em streaming."""
+    faturas = filtrar_faturas(Fatura.objects.all(), request.GET)
+    documentos = documentos_das_faturas(faturas)
+    if not documentos:
+        messages.warning(request, _("Nenhuma fatura corresponde aos filtros escolhidos."))
+        return redirect(f"{reverse('lista_faturas')}?{request.GET.urlencode()}")
+    resposta = StreamingHttpResponse(gerar_zip(documentos), content_type='application/zip')
+    resposta['Content-Disposition'] = f'attachment; filename="faturas_{date.today():%Y%m%d}.zip"'
+    return resposta
 
 @login_required
 def detalhe_fatura_view(request, fatura_id):
     fatura = get_object_or_404(Fatura, id=fatura_id)
-    return render(request, 'stock/detalhe_fatura.html', {'fatura': fatura})
+    emails = fatura.emails.select_related('utilizador')[:5]
+    return render(request, 'stock/detalhe_fatura.html', {'fatura': fatura, 'emails': emails})
 
 @login_required
 def toggle_fatura_paga_view(request, fatura_id):
@@ -334,7 +410,9 @@ def toggle_fatura_paga_view(request, fatura_id):
         fatura = get_object_or_404(Fatura, id=fatura_id)
         fatura.paga = not fatura.paga
         fatura.modificado_por = request.user
-        fatura.save()
+        with transaction.atomic():
+            fatura.save()
+            refrescar_vendas_diarias(chaves_faturas([fatura]))
         messages.success(request, _("A fatura {numero} foi marcada como PAGA.").format(numero=fatura.numero_fatura) if fatura.paga else _("A fatura {numero} foi marcada como NÃO PAGA.").format(numero=fatura.numero_fatura))
     return redirect('lista_faturas')
 
@@ -345,20 +423,12 @@ def fatura_print_view(request, fatura_id):
 
 @login_required
 def fatura_pdf_view(request, fatura_id):
-    if HTML is None:
-        return HttpResponse("WeasyPrint não está instalado.", status=501)
     fatura = get_object_or_404(Fatura, id=fatura_id)
-    dados_empresa = DadosEmpresa.objects.first()
-    logo_uri = None
-    if dados_empresa and dados_empresa.logotipo and hasattr(dados_empresa.logotipo, 'path'):
-        logo_path = pathlib.Path(dados_empresa.logotipo.path)
-        logo_uri = logo_path.as_uri()
-    contexto = {'fatura': fatura, 'dados_empresa': dados_empresa, 'logo_uri': logo_uri}
-    html_string = render_to_string('stock/fatura_pdf.html', contexto)
-    pdf = HTML(string=html_string, base_url=request.build_absolute_uri('/')).write_pdf()
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="fatura_{fatura.numero_fatura}.pdf"'
-    return response
+    try:
+        ficheiro = abrir_pdf('fatura', fatura, base_url=request.build_absolute_uri('/'))
+    except PDFIndisponivel:
+        return HttpResponse("WeasyPrint não está instalado.", status=501)
+    return FileResponse(ficheiro, as_attachment=True, filename=f"fatura_{fatura.numero_fatura}.pdf", content_type='application/pdf')
 
 # --- VIEW ATUALIZADA ---
 @login_required
@@ -368,64 +438,17 @@ def enviar_fatura_email_view(request, fatura_id):
         if not fatura.cliente.email:
             messages.error(request, _("O cliente '{nome}' não tem um endereço de email associado.").format(nome=fatura.cliente.nome))
             return redirect('detalhe_fatura', fatura_id=fatura.id)
-        if HTML is None:
-            messages.error(request, "A biblioteca WeasyPrint não está instalada. O PDF não pode ser gerado.")
-            return redirect('detalhe_fatura', fatura_id=fatura.id)
         try:
-            config = Configuracao.objects.first()
-            if not config or not config.email_remetente or not config.password_remetente:
-                messages.error(request, _("As credenciais de email não estão configuradas na área de administração."))
-                return redirect('detalhe_fatura', fatura_id=fatura.id)
-            dados_empresa = DadosEmpresa.objects.first()
-
-            # Corpo do email em texto simples
-            corpo_email = _("""
-            Caro(a) {cliente_nome},
-
-            Segue em anexo a fatura com o número {numero_fatura}.
-
-            Com os melhores cumprimentos,
-            {nome_empresa}
-            """).format(
-                cliente_nome=fatura.cliente.nome,
-                numero_fatura=fatura.numero_fatura,
-                nome_empresa=dados_empresa.nome_empresa if dados_empresa else 'A nossa empresa'
-            )
-            
-            # Lógica para gerar o PDF para o anexo
-            logo_uri = None
-            if dados_empresa and dados_empresa.logotipo and hasattr(dados_empresa.logotipo, 'path'):
-                logo_path = pathlib.Path(dados_empresa.logotipo.path)
-                logo_uri = logo_path.as_uri()
-            contexto_pdf = {'fatura': fatura, 'dados_empresa': dados_empresa, 'logo_uri': logo_uri}
-            html_string = render_to_string('stock/fatura_pdf.html', contexto_pdf)
-            pdf_em_memoria = HTML(string=html_string, base_url=request.build_absolute_uri('/')).write_pdf()
-            
-            assunto = _("Fatura Nº {numero_fatura} da {nome_empresa}").format(
-                numero_fatura=fatura.numero_fatura, 
-                nome_empresa=dados_empresa.nome_empresa if dados_empresa else ''
-            )
-            
-            email = EmailMessage(
-                assunto,
-                corpo_email, # Usar o corpo em texto simples
-                config.email_remetente,
-                [fatura.cliente.email]
-            )
-            email.attach(f'Fatura-{fatura.numero_fatura}.pdf', pdf_em_memoria, 'application/pdf')
-
-            connection = get_connection(host=settings.EMAIL_HOST, port=settings.EMAIL_PORT, username=config.email_remetente, password=config.password_remetente, use_tls=settings.EMAIL_USE_TLS)
-            connection.send_messages([email])
-            messages.success(request, _("Fatura enviada com sucesso para {email}.").format(email=fatura.cliente.email))
-        except Exception as e:
-            messages.error(request, _("Ocorreu um erro ao enviar o email: {erro}").format(erro=e))
+            enfileirar_email_fatura(fatura, request.user)
+            messages.success(request, _("A fatura vai ser enviada para {email}. O estado do envio aparece abaixo.").format(email=fatura.cliente.email))
+        except EmailNaoConfigurado as e:
+            messages.error(request, str(e))
     return redirect('detalhe_fatura', fatura_id=fatura.id)
 
 @login_required
 def lista_guias_view(request):
-    todas_as_guias_list = GuiaTransporte.objects.all()
-    paginator = Paginator(todas_as_guias_list, 15)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    guias = GuiaTransporte.objects.select_related('fatura__cliente')
+    page_obj = paginar(request, guias, ('-data_emissao', '-numero_guia', '-id'))
     return render(request, 'stock/lista_guias.html', {'page_obj': page_obj})
 
 @login_required
@@ -437,13 +460,7 @@ def criar_guia_desde_fatura_view(request, fatura_id):
     if request.method == 'POST':
         try:
             with transaction.atomic():
-                ano_atual = date.today().year
-                ultima_guia_ano = GuiaTransporte.objects.filter(data_emissao__year=ano_atual).order_by('numero_guia').last()
-                novo_numero_seq = 1
-                if ultima_guia_ano and ultima_guia_ano.numero_guia:
-                    try: novo_numero_seq = int(ultima_guia_ano.numero_guia.split('-')[-1]) + 1
-                    except (ValueError, IndexError): novo_numero_seq = GuiaTransporte.objects.filter(data_emissao__year=ano_atual).count() + 1
-                numero_final_guia = f"{ano_atual}-{novo_numero_seq:04d}"
+                numero_final_guia = SequenciaDocumento.proximo_numero('GUIA')
                 nova_guia = GuiaTransporte.objects.create(fatura=fatura, numero_guia=numero_final_guia, morada_carga=request.POST.get('morada_carga', ''), morada_descarga=request.POST.get('morada_descarga', ''), matricula_veiculo=request.POST.get('matricula_veiculo', ''), utilizador=request.user)
                 for item_fatura in fatura.itens.all(): ItemGuia.objects.create(guia=nova_guia, produto=item_fatura.produto, quantidade=item_fatura.quantidade)
                 messages.success(request, _("Guia de Transporte {numero} criada com sucesso a partir da fatura {fatura_num}.").format(numero=nova_guia.numero_guia, fatura_num=fatura.numero_fatura))
@@ -451,12 +468,13 @@ def criar_guia_desde_fatura_view(request, fatura_id):
         except Exception as e:
             messages.error(request, _("Ocorreu um erro ao gerar a guia: {erro}").format(erro=e))
             return redirect('detalhe_fatura', fatura_id=fatura.id)
-    return render(request, 'stock/criar_guia_desde_fatura.html', {'fatura': fatura, 'dados_empresa': DadosEmpresa.objects.first()})
+    return render(request, 'stock/criar_guia_desde_fatura.html', {'fatura': fatura, 'dados_empresa': obter_dados_empresa()})
 
 @login_required
 def detalhe_guia_view(request, guia_id):
     guia = get_object_or_404(GuiaTransporte, id=guia_id)
-    return render(request, 'stock/detalhe_guia.html', {'guia': guia})
+    emails = guia.emails.select_related('utilizador')[:5]
+    return render(request, 'stock/detalhe_guia.html', {'guia': guia, 'emails': emails})
 
 @login_required
 def editar_guia_view(request, guia_id):
@@ -478,28 +496,16 @@ def editar_guia_view(request, guia_id):
 @login_required
 def guia_print_view(request, guia_id):
     guia = get_object_or_404(GuiaTransporte, id=guia_id)
-    return render(request, 'stock/guia_print.html', {'guia': guia, 'dados_empresa': DadosEmpresa.objects.first()})
+    return render(request, 'stock/guia_print.html', {'guia': guia, 'dados_empresa': obter_dados_empresa()})
 
 @login_required
 def guia_pdf_view(request, guia_id):
-    if HTML is None:
-        return HttpResponse("WeasyPrint não está instalado.", status=501)
     guia = get_object_or_404(GuiaTransporte, id=guia_id)
-    dados_empresa = DadosEmpresa.objects.first()
-    logo_uri = None
-    if dados_empresa and dados_empresa.logotipo and hasattr(dados_empresa.logotipo, 'path'):
-        logo_path = pathlib.Path(dados_empresa.logotipo.path)
-        logo_uri = logo_path.as_uri()
-    contexto = {
-        'guia': guia,
-        'dados_empresa': dados_empresa,
-        'logo_uri': logo_uri,
-    }
-    html_string = render_to_string('stock/guia_pdf.html', contexto)
-    pdf = HTML(string=html_string, base_url=request.build_absolute_uri('/')).write_pdf()
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="guia_{guia.numero_guia}.pdf"'
-    return response
+    try:
+        ficheiro = abrir_pdf('guia', guia, base_url=request.build_absolute_uri('/'))
+    except PDFIndisponivel:
+        return HttpResponse("WeasyPrint não está instalado.", status=501)
+    return FileResponse(ficheiro, as_attachment=True, filename=f"guia_{guia.numero_guia}.pdf", content_type='application/pdf')
 
 @login_required
 def enviar_guia_email_view(request, guia_id):
@@ -508,41 +514,16 @@ def enviar_guia_email_view(request, guia_id):
         if not guia.cliente.email:
             messages.error(request, _("O cliente '{nome}' não tem um endereço de email associado.").format(nome=guia.cliente.nome))
             return redirect('detalhe_guia', guia_id=guia.id)
-        if HTML is None:
-            messages.error(request, "A biblioteca WeasyPrint não está instalada. O PDF não pode ser gerado.")
-            return redirect('detalhe_guia', guia_id=guia.id)
         try:
-            config = Configuracao.objects.first()
-            if not config or not config.email_remetente or not config.password_remetente:
-                messages.error(request, _("As credenciais de email não estão configuradas na área de administração."))
-                return redirect('detalhe_guia', guia_id=guia.id)
-            dados_empresa = DadosEmpresa.objects.first()
-            
-            corpo_email = f"Caro(a) {guia.cliente.nome},\n\nSegue em anexo a Guia de Transporte com o número {guia.numero_guia}.\n\nCom os melhores cumprimentos,\n{dados_empresa.nome_empresa if dados_empresa else 'A nossa empresa'}"
-            
-            logo_uri = None
-            if dados_empresa and dados_empresa.logotipo and hasattr(dados_empresa.logotipo, 'path'):
-                logo_path = pathlib.Path(dados_empresa.logotipo.path)
-                logo_uri = logo_path.as_uri()
-            
-            contexto_pdf = {'guia': guia, 'dados_empresa': dados_empresa, 'logo_uri': logo_uri}
-            html_string = render_to_string('stock/guia_pdf.html', contexto_pdf)
-            pdf_em_memoria = HTML(string=html_string, base_url=request.build_absolute_uri('/')).write_pdf()
-            
-            assunto = _("Guia de Transporte Nº {numero_guia} da {nome_empresa}").format(numero_guia=guia.numero_guia, nome_empresa=dados_empresa.nome_empresa if dados_empresa else '')
-            
-            email = EmailMessage(assunto, corpo_email, config.email_remetente, [guia.cliente.email])
-            email.attach(f'Guia-{guia.numero_guia}.pdf', pdf_em_memoria, 'application/pdf')
-            connection = get_connection(host=settings.EMAIL_HOST, port=settings.EMAIL_PORT, username=config.email_remetente, password=config.password_remetente, use_tls=settings.EMAIL_USE_TLS)
-            connection.send_messages([email])
-            messages.success(request, _("Guia de Transporte enviada com sucesso para {email}.").format(email=guia.cliente.email))
-        except Exception as e:
-            messages.error(request, _("Ocorreu um erro ao enviar o email: {erro}").format(erro=e))
+            enfileirar_email_guia(guia, request.user)
+            messages.success(request, _("A Guia de Transporte vai ser enviada para {email}. O estado do envio aparece abaixo.").format(email=guia.cliente.email))
+        except EmailNaoConfigurado as e:
+            messages.error(request, str(e))
     return redirect('detalhe_guia', guia_id=guia.id)
 
 
 class CustomLoginView(auth_views.LoginView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['dados_empresa'] = DadosEmpresa.objects.first()
+        context['dados_empresa'] = obter_dados_empresa()
         return context
\ No newline at end of file